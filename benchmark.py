@@ -0,0 +1,182 @@
+import os
+import time
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import psutil
+import monitor
+import rate_limit
+import record_writer
+import task_poller
+import landsat_lst_image
+import workflow_image
+from functools import partial
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from fake_backend import FakeEarthEngine, FakeDrive
+from fetch_drive import DriveDownloader
+from job_scheduler import run_jobs
+from scene_availability import SATELLITE_ORDER
+
+class ResourceSampler:
+    """
+    sample the resident memory, process and thread number of the benchmark in the background
+    """
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self.peak_processes = 0
+        self.peak_threads = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sampler', daemon=True)
+
+    def sample(self):
+        processes = [self.process] + self.process.children(recursive=True)
+        rss = 0
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_processes = max(self.peak_processes, len(processes))
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+@contextmanager
+def fake_backend_installed(fake_ee, speedup):
+    """
+    route the earth engine calls of the workflow to the fake backend and scale the fixed waits by speedup
+    """
+    patches = [
+        (landsat_lst_image, 'ee', fake_ee.as_module()),
+        (landsat_lst_image, 'fetch_best_landsat_image', fake_ee.fetch_image),
+        (landsat_lst_image, 'DRIVE_SETTLE_SECONDS', landsat_lst_image.DRIVE_SETTLE_SECONDS / speedup),
+        (task_poller, 'ee', fake_ee.as_module()),
+        (workflow_image, 'ee', fake_ee.as_module()),
+        (monitor, 'SLOT_WAIT_SECONDS', monitor.SLOT_WAIT_SECONDS / speedup),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    # the rate limits are quotas per real second, they are scaled like the latencies
+    limit_env = {f'{name.upper()}_RATE_LIMIT': str(rate * speedup) for name, (rate, _) in rate_limit.DEFAULT_LIMITS.items()}
+    original_env = {key: os.environ.get(key) for key in limit_env}
+    for module, name, value in patches:
+        setattr(module, name, value)
+    os.environ.update(limit_env)
+    rate_limit.endpoints.clear()
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+        for key, value in original_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        rate_limit.endpoints.clear()
+
+def fake_cities(city_num, year_list, city_size=0.3):
+    """
+    square cities of city_size degrees where every satellite has a clear scene in every month
+    """
+    city_boundaries = []
+    availabilities = {}
+    for index in range(city_num):
+        city_name = f'城市{index}'
+        west, south = 110 + index % 10, 25 + index // 10
+        city_geometry = {'type': 'Polygon', 'coordinates': [[[west, south], [west + city_size, south], [west + city_size, south + city_size],
+                                                             [west, south + city_size], [west, south]]]}
+        city_boundaries.append({'city_name': city_name, 'city_code': index, 'area': 1.0, 'city_geometry': city_geometry,
+                                'urban_geometry': city_geometry, 'urban_city_name': city_name})
+        availabilities[index] = {
+            satellite: {f'{year}-{month:02}': [1, 5.0] for year in year_list for month in range(1, 13)}
+            for satellite in SATELLITE_ORDER
+        }
+    return city_boundaries, availabilities
+
+def run_benchmark(city_num, year_num=1, speedup=60, max_workers=12, poll_gap=20, ee_options=None, drive_options=None):
+    """
+    run the drive export workflow over city_num cities and year_num years against the fake backend
+
+    the latencies, limits and waits are divided by speedup, the rates are reported in simulated hours
+    """
+    work_path = tempfile.mkdtemp(prefix='lst_benchmark_')
+    os.environ['JOB_LEDGER_FILE_PATH'] = os.path.join(work_path, 'ledger.sqlite')
+    os.environ['RECORD_FILE_PATH'] = os.path.join(work_path, 'record.csv')
+    save_path = os.path.join(work_path, 'images')
+    folder_name = 'landsat_lst_benchmark'
+    fake_drive = FakeDrive(speedup=speedup, **(drive_options or {}))
+    fake_ee = FakeEarthEngine(fake_drive, speedup=speedup, **(ee_options or {}))
+    year_list = range(2000, 2000 + year_num)
+    city_boundaries, availabilities = fake_cities(city_num, year_list)
+    try:
+        with fake_backend_installed(fake_ee, speedup):
+            workflow_image.init_record_file()
+            sampler = ResourceSampler().start()
+            start = time.time()
+            downloader = DriveDownloader(fake_drive, session=fake_drive.session())
+            poller = task_poller.TaskPoller(partial(landsat_lst_image.download_exported_file, fake_drive.auth, downloader, folder_name, save_path),
+                                            landsat_lst_image.record_failed_export, gap=poll_gap / speedup).start()
+            jobs = workflow_image.iterate_jobs(city_boundaries, year_list, set(), availabilities)
+            run_jobs(jobs, partial(workflow_image.run_export_job, poller, folder_name, True), max_workers,
+                     cost=workflow_image.expected_job_cost, on_result=workflow_image.log_job_result)
+            poller.join()
+            poller.stop()
+            record_writer.close_writer()
+            elapsed = time.time() - start
+            sampler.stop()
+        job_num = city_num * year_num * 12
+        completed = sum(state == 'COMPLETED' for job_states in monitor.load_job_states().values() for _, state, _, _ in job_states)
+        calls = fake_ee.calls + fake_drive.calls
+        return {
+            'cities': city_num,
+            'jobs': job_num,
+            'completed': completed,
+            'wall_seconds': round(elapsed, 1),
+            'tasks_per_hour': round(completed / (elapsed * speedup / 3600), 1),
+            'round_trips_per_job': round(sum(calls.values()) / job_num, 2),
+            'round_trips': dict(calls),
+            'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1),
+            'peak_processes': sampler.peak_processes,
+            'peak_threads': sampler.peak_threads,
+        }
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+def __main__():
+    load_dotenv()
+    logging.basicConfig(level=logging.WARNING)
+    city_counts = [int(count) for count in os.getenv('BENCHMARK_CITIES', '1,10,100').split(',')]
+    speedup = float(os.getenv('BENCHMARK_SPEEDUP', 60))
+    max_workers = int(os.getenv('MAX_WORKERS', 12))
+    results = []
+    for city_num in city_counts:
+        result = run_benchmark(city_num, speedup=speedup, max_workers=max_workers)
+        print(f"{city_num:>4} cities: {result['completed']}/{result['jobs']} jobs in {result['wall_seconds']}s, "
+              f"{result['tasks_per_hour']} tasks/h, {result['round_trips_per_job']} round trips/job, "
+              f"peak {result['peak_rss_mb']} MB, {result['peak_processes']} processes, {result['peak_threads']} threads")
+        results.append(result)
+    result_file_path = os.getenv('BENCHMARK_RESULT_PATH')
+    if result_file_path is not None:
+        with open(result_file_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    __main__()
@@ -0,0 +1,116 @@
+import ee
+import os
+import rate_limit
+import telemetry
+import json
+import logging
+from landsat_lst_image import filter_city_bound
+from info_batcher import evaluate, evaluate_all
+
+ASSET_PATH = 'projects/ee-channingtong/assets/'
+
+def load_cache():
+    cache_file_path = os.getenv('BOUNDARY_CACHE_FILE_PATH')
+    if cache_file_path is None or not os.path.exists(cache_file_path):
+        return {}
+    with open(cache_file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_cache(cache):
+    cache_file_path = os.getenv('BOUNDARY_CACHE_FILE_PATH')
+    if cache_file_path is None:
+        return
+    temp_file_path = cache_file_path + '.tmp'
+    with open(temp_file_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(temp_file_path, cache_file_path)
+
+def list_asset_update_times(asset_path=ASSET_PATH):
+    """
+    return {asset id: update time} of every asset in the folder with one paged listing
+    """
+    update_times = {}
+    params = {'parent': asset_path.rstrip('/')}
+    while True:
+        response = rate_limit.call('getinfo', ee.data.listAssets, params)
+        for asset in response.get('assets', []):
+            update_times[asset.get('id', asset.get('name'))] = asset.get('updateTime')
+        if not response.get('nextPageToken'):
+            return update_times
+        params['pageToken'] = response['nextPageToken']
+
+def cached_asset(cache, asset_id, update_times):
+    """
+    return the cached value of the asset, or None if the asset is updated since it was cached
+    """
+    update_time = update_times.get(asset_id)
+    entry = cache.get(asset_id)
+    if entry is not None and update_time is not None and entry['update_time'] == update_time:
+        return entry['value']
+    return None
+
+def store_asset(cache, asset_id, update_times, value):
+    cache[asset_id] = {'update_time': update_times.get(asset_id), 'value': value}
+    return value
+
+def total_boundary_info(asset_id):
+    def add_area(feature):
+        return feature.set('area', feature.geometry().area(1))
+    return ee.FeatureCollection(asset_id).map(add_area)
+
+def urban_boundary_info(asset_id):
+    urban_boundary = ee.FeatureCollection(asset_id)
+    return ee.Dictionary({
+        'geometry': filter_city_bound(urban_boundary.geometry()),
+        'city_name': urban_boundary.first().get('city_name'),
+    })
+
+def city_boundary_record(city_boundary, urban_boundary):
+    return {
+        'city_name': city_boundary['properties']['市名'],
+        'city_code': city_boundary['properties']['市代码'],
+        'area': city_boundary['properties']['area'],
+        'city_geometry': city_boundary['geometry'],
+        'urban_geometry': urban_boundary['geometry'],
+        'urban_city_name': urban_boundary['city_name'],
+    }
+
+def load_cached_city_boundaries(asset_path=ASSET_PATH):
+    """
+    return the city boundaries from the cache only, for the local stages that do not talk to earth engine
+    """
+    cache = load_cache()
+    total_boundary = cache[asset_path + 'YZBboundary']['value']
+    city_boundaries = []
+    for city_boundary in total_boundary:
+        urban_boundary = cache[asset_path + f"urban_{city_boundary['properties']['市代码']}"]['value']
+        city_boundaries.append(city_boundary_record(city_boundary, urban_boundary))
+    return city_boundaries
+
+def load_city_boundaries(asset_path=ASSET_PATH):
+    """
+    return the administrative and main urban boundary of every city as geojson
+    """
+    cache = load_cache()
+    update_times = list_asset_update_times(asset_path)
+    city_boundaries = []
+    try:
+        total_id = asset_path + 'YZBboundary'
+        total_boundary = cached_asset(cache, total_id, update_times)
+        if total_boundary is None:
+            logging.info(f"resolve boundary {total_id}")
+            with telemetry.span('boundary_info', asset=total_id):
+                total_boundary = store_asset(cache, total_id, update_times, evaluate(total_boundary_info(total_id))['features'])
+        urban_ids = [asset_path + f"urban_{city_boundary['properties']['市代码']}" for city_boundary in total_boundary]
+        missing_ids = [urban_id for urban_id in set(urban_ids) if cached_asset(cache, urban_id, update_times) is None]
+        logging.info(f"resolve {len(missing_ids)} urban boundaries")
+        with telemetry.span('boundary_info', assets=len(missing_ids)):
+            urban_infos = evaluate_all([urban_boundary_info(urban_id) for urban_id in missing_ids])
+        for urban_id, value in zip(missing_ids, urban_infos):
+            store_asset(cache, urban_id, update_times, value)
+        for city_boundary, urban_id in zip(total_boundary, urban_ids):
+            urban_boundary = cache[urban_id]['value']
+            city_boundaries.append(city_boundary_record(city_boundary, urban_boundary))
+    finally:
+        save_cache(cache)
+    return city_boundaries
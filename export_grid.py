@@ -0,0 +1,45 @@
+import os
+import re
+import math
+from shapely.geometry import shape, box
+
+# every export is snapped to one global 30 m grid in EPSG:4326, so the tiles of a city line up pixel to pixel
+PIXEL_DEGREES = 30 / 111319.49079327357
+CRS_TRANSFORM = [PIXEL_DEGREES, 0, -180, 0, -PIXEL_DEGREES, 90]
+MAX_TILE_ATTEMPTS = 3
+TILE_DESCRIPTION_PATTERN = re.compile(r'^(?P<description>.+)_r(?P<row>\d+)c(?P<col>\d+)$')
+
+def tile_pixels():
+    """
+    side of the export tiles in pixels from EXPORT_TILE_PIXELS, None exports every city as one task
+    """
+    pixels = os.getenv('EXPORT_TILE_PIXELS')
+    return int(pixels) if pixels else None
+
+def grid_tiles(geojson, pixels):
+    """
+    return (row, col, [west, south, east, north]) of the grid cells intersecting the geometry,
+    rows count from 90N and columns from 180W
+    """
+    geometry = shape(geojson)
+    size = pixels * PIXEL_DEGREES
+    west, south, east, north = geometry.bounds
+    tiles = []
+    for row in range(math.floor((90 - north) / size), math.ceil((90 - south) / size)):
+        for col in range(math.floor((west + 180) / size), math.ceil((east + 180) / size)):
+            cell = box(-180 + col * size, 90 - (row + 1) * size, -180 + (col + 1) * size, 90 - row * size)
+            if cell.intersects(geometry):
+                tiles.append((row, col, list(cell.bounds)))
+    return tiles
+
+def tile_description(description, row, col):
+    return f'{description}_r{row}c{col}'
+
+def parse_tile_description(task_identifier):
+    """
+    return (job description, row, col) of a tile export, or None for a whole city export
+    """
+    matched = TILE_DESCRIPTION_PATTERN.match(task_identifier)
+    if matched is None:
+        return None
+    return matched.group('description'), int(matched.group('row')), int(matched.group('col'))
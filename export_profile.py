@@ -0,0 +1,69 @@
+import os
+import numpy as np
+
+# earth engine exports every band of an image with one data type, the packed profiles use uint16 so
+# QA_PIXEL keeps all its bits. a band is stored as round((value - offset) / scale), 0 is nodata
+NODATA = 0
+EXPORT_PROFILES = {
+    'full': None, # every band of the lst image as float
+    'lst': {
+        'bands': ['LST', 'QA_PIXEL'],
+        'scales': {'LST': (0.01, 150)},
+    },
+    'recompute': { # the inputs of lst_numpy, EM_bare is the aster bare soil emissivity added by start_export
+        'bands': ['B10', 'NDVI', 'TPW', 'EM_bare', 'QA_PIXEL'],
+        'scales': {'B10': (0.01, 150), 'NDVI': (0.0001, -1.0001), 'TPW': (0.01, -0.01), 'EM_bare': (0.00001, 0.5)},
+    },
+}
+
+def get_export_profile(name=None):
+    """
+    the profile named by EXPORT_PROFILE, default full
+    """
+    name = name or os.getenv('EXPORT_PROFILE', 'full')
+    if name not in EXPORT_PROFILES:
+        raise ValueError(f"export profile should be one of {list(EXPORT_PROFILES)}")
+    return EXPORT_PROFILES[name]
+
+def apply_export_profile(image, profile):
+    """
+    select the bands of the profile and pack them into uint16 on the server
+    """
+    if profile is None:
+        return image
+    packed = []
+    for band in profile['bands']:
+        band_image = image.select(band)
+        if band in profile['scales']:
+            scale, offset = profile['scales'][band]
+            band_image = band_image.subtract(offset).divide(scale).round().clamp(1, 65535)
+        packed.append(band_image.toUint16())
+    return packed[0].addBands(packed[1:]).unmask(NODATA)
+
+def export_format_options(profile):
+    if profile is None:
+        return {}
+    return {'formatOptions': {'cloudOptimized': True, 'noData': NODATA}}
+
+def tag_export_profile(dst, profile):
+    """
+    record the band names, scale, offset and nodata of a packed export in the dataset the COG is copied from,
+    so readers can decode it. tagging the finished COG would move its header to the end of the file
+    """
+    if profile is None:
+        return
+    dst.nodata = NODATA
+    dst.scales = [profile['scales'].get(band, (1, 0))[0] for band in profile['bands']]
+    dst.offsets = [profile['scales'].get(band, (1, 0))[1] for band in profile['bands']]
+    for index, band in enumerate(profile['bands'], start=1):
+        dst.set_band_description(index, band)
+
+def read_decoded(src, band_index, window=None):
+    """
+    read one band as float32 with nan for nodata, packed bands are decoded with their scale and offset
+    """
+    data = src.read(band_index, window=window, masked=True).astype(np.float32)
+    scale, offset = src.scales[band_index - 1], src.offsets[band_index - 1]
+    if (scale, offset) != (1, 0):
+        data = data * np.float32(scale) + np.float32(offset)
+    return data.filled(np.nan)
@@ -0,0 +1,320 @@
+import re
+import time
+import random
+import hashlib
+import itertools
+import threading
+import numpy as np
+import requests
+import rate_limit
+from collections import Counter
+from functools import lru_cache
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+class QuotaExceeded(Exception):
+    """
+    raised like the 'Too many requests' errors of earth engine, so the rate limiter retries it
+    """
+    def __init__(self):
+        super().__init__('Too many requests, quota exceeded')
+
+def lognormal(median, sigma=0.5):
+    """
+    latency distribution in seconds, sigma 0 gives a fixed latency
+    """
+    return lambda rng: median * rng.lognormvariate(0, sigma) if sigma > 0 else median
+
+@lru_cache(maxsize=256)
+def geotiff_bytes(row_off, size, west=114, north=31, pixel=0.00027, band_names=('LST', 'EM', 'QA_PIXEL')):
+    """
+    one exported file on a shared grid, the shards of the same export are stacked by row, the bytes are shared by every export
+    """
+    data = np.random.default_rng(row_off).uniform(280, 320, (len(band_names), size, size)).astype('float32')
+    profile = {'driver': 'GTiff', 'height': size, 'width': size, 'count': len(band_names), 'dtype': 'float32',
+               'crs': 'EPSG:4326', 'transform': from_origin(west, north - row_off * pixel, pixel, pixel)}
+    with MemoryFile() as memory_file:
+        with memory_file.open(**profile) as dst:
+            dst.write(data)
+            for index, name in enumerate(band_names, start=1):
+                dst.set_band_description(index, name)
+        return memory_file.read()
+
+class FakeEarthEngine:
+    """
+    in-process stand-in of the earth engine calls made by the export workflow
+
+    every latency is given in real earth engine seconds and divided by speedup, a finished task
+    writes its GeoTIFF, split into `tiles` files, to the fake drive
+    """
+    def __init__(self, drive, speedup=60, search=lognormal(2, 0.5), ready=lognormal(120, 1.0), running=lognormal(300, 0.5),
+                 empty_rate=0.1, failure_rate=0.02, quota_error_rate=0.01, tiles=1, tile_size=256, seed=0):
+        self.drive = drive
+        self.speedup = speedup
+        self.search = search
+        self.ready = ready
+        self.running = running
+        self.empty_rate = empty_rate
+        self.failure_rate = failure_rate
+        self.quota_error_rate = quota_error_rate
+        self.tiles = tiles
+        self.tile_size = tile_size
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.task_ids = itertools.count(1)
+        self.calls = Counter()
+
+    def draw(self, distribution):
+        with self.lock:
+            return distribution(self.rng) / self.speedup
+
+    def chance(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def round_trip(self, kind):
+        with self.lock:
+            self.calls[kind] += 1
+        if self.chance(self.quota_error_rate):
+            raise QuotaExceeded()
+
+    def fetch_image(self, satellite, date_start, date_end, city_geometry, cloud_threshold, urban_geometry, use_ndvi):
+        """
+        same signature and result as ee_lst fetch_best_landsat_image, the search request goes through
+        the getinfo limits like a rate limited computeValue
+        """
+        rate_limit.call('getinfo', self.round_trip, 'search')
+        time.sleep(self.draw(self.search))
+        if self.chance(self.empty_rate):
+            raise ValueError(f'no {satellite} scene under cloud threshold {cloud_threshold}')
+        return object(), 1.0, 1.0, 5.0, 5.0, 15
+
+    def export_to_drive(self, image, description, folder, region=None, crsTransform=None, **kwargs):
+        task = FakeTask(self, description, folder)
+        if crsTransform is not None: # grid tile, the file covers the tile rectangle
+            west, _, east, north = region.bounds
+            task.grid = (west, north, crsTransform[0] * round((east - west) / crsTransform[0]) / self.tile_size)
+        return task
+
+    def start_task(self, task):
+        self.round_trip('task_start')
+        now = time.time()
+        ready_until = now + self.draw(self.ready)
+        running_until = ready_until + self.draw(self.running)
+        failed = self.chance(self.failure_rate)
+        with self.lock:
+            task.id = f'FAKE{next(self.task_ids):08d}'
+            self.tasks[task.id] = {'task': task, 'created': now, 'ready_until': ready_until,
+                                   'running_until': running_until, 'failed': failed, 'published': False}
+
+    def task_state(self, entry, now):
+        if now < entry['ready_until']:
+            return 'READY'
+        if now < entry['running_until']:
+            return 'RUNNING'
+        if entry['failed']:
+            return 'FAILED'
+        with self.lock:
+            published, entry['published'] = entry['published'], True
+        if not published:
+            self.publish(entry['task'])
+        return 'COMPLETED'
+
+    def publish(self, task):
+        if task.grid is not None:
+            self.drive.add_file(task.folder, f'{task.description}.tif', geotiff_bytes(0, self.tile_size, *task.grid))
+        elif self.tiles == 1:
+            self.drive.add_file(task.folder, f'{task.description}.tif', geotiff_bytes(0, self.tile_size))
+        else:
+            for tile in range(self.tiles):
+                row_off = tile * self.tile_size
+                self.drive.add_file(task.folder, f'{task.description}-{row_off:010d}-0000000000.tif', geotiff_bytes(row_off, self.tile_size))
+
+    def get_task_list(self):
+        self.round_trip('task_list')
+        now = time.time()
+        with self.lock:
+            entries = list(self.tasks.values())
+        task_list = []
+        for entry in entries:
+            state = self.task_state(entry, now)
+            task = {'id': entry['task'].id, 'description': entry['task'].description, 'state': state,
+                    'creation_timestamp_ms': int(entry['created'] * 1000)}
+            if state != 'READY':
+                task['start_timestamp_ms'] = int(entry['ready_until'] * 1000)
+                task['update_timestamp_ms'] = int(min(now, entry['running_until']) * 1000)
+            task_list.append(task)
+        return task_list
+
+    def as_module(self):
+        """
+        the subset of the ee module used by landsat_lst_image, task_poller and workflow_image
+        """
+        return SimpleNamespace(
+            Date=FakeDate,
+            Geometry=FakeGeometry,
+            batch=SimpleNamespace(Export=SimpleNamespace(image=SimpleNamespace(toDrive=self.export_to_drive))),
+            data=SimpleNamespace(getTaskList=self.get_task_list),
+        )
+
+class FakeTask:
+    def __init__(self, backend, description, folder):
+        self.backend = backend
+        self.description = description
+        self.folder = folder
+        self.grid = None
+        self.id = None
+
+    def start(self):
+        self.backend.start_task(self)
+
+class FakeGeometry:
+    def __init__(self, geojson):
+        self.geojson = geojson
+
+    @staticmethod
+    def Rectangle(coords, proj=None, geodesic=None):
+        geometry = FakeGeometry(None)
+        geometry.bounds = coords
+        return geometry
+
+class FakeDate:
+    def __init__(self, value):
+        self.value = value
+
+    @staticmethod
+    def fromYMD(year, month, day):
+        return FakeDate(datetime(year, month, day))
+
+    def advance(self, delta, unit):
+        return FakeDate(self.value + timedelta(**{f'{unit}s': delta}))
+
+class FakeDrive:
+    """
+    in-process stand-in of the pydrive listing and the drive v2 media download, at `bandwidth` bytes per second
+    """
+    def __init__(self, speedup=60, list_latency=lognormal(0.5, 0.3), bandwidth=20 * 1024 * 1024, page_size=100, seed=0):
+        self.speedup = speedup
+        self.list_latency = list_latency
+        self.bandwidth = bandwidth
+        self.page_size = page_size
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.folders = {} # folder name -> folder id
+        self.files = {} # file id -> file metadata and content
+        self.file_ids = itertools.count(1)
+        self.calls = Counter()
+        self.auth = SimpleNamespace(
+            credentials=SimpleNamespace(access_token='fake', refresh_token='fake', token_expiry=datetime.now() + timedelta(days=1)),
+            Refresh=lambda: None,
+        )
+
+    def add_file(self, folder_name, title, content):
+        with self.lock:
+            folder_id = self.folders.setdefault(folder_name, f'folder{len(self.folders) + 1}')
+            file_id = f'file{next(self.file_ids):08d}'
+            created = datetime(2000, 1, 1) + timedelta(seconds=int(file_id[4:])) # drive keeps duplicate titles apart by id and date
+            self.files[file_id] = {'id': file_id, 'title': title, 'parent': folder_id, 'fileSize': str(len(content)),
+                                   'createdDate': created.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                                   'md5Checksum': hashlib.md5(content).hexdigest(), 'content': content}
+
+    def ListFile(self, params):
+        return FakeFileList(self, params)
+
+    def query(self, q):
+        title = re.search(r"title='([^']*)'", q)
+        if FOLDER_MIME_TYPE in q and title is not None: # folder lookup by name
+            with self.lock:
+                folder_id = self.folders.get(title.group(1))
+            return [] if folder_id is None else [{'id': folder_id, 'title': title.group(1)}]
+        parent_id = re.search(r"'([^']*)' in parents", q).group(1)
+        with self.lock:
+            return [{key: value for key, value in file_meta.items() if key != 'content'}
+                    for file_meta in self.files.values() if file_meta['parent'] == parent_id]
+
+    def list_page(self):
+        with self.lock:
+            self.calls['drive_list'] += 1
+            latency = self.list_latency(self.rng) / self.speedup
+        time.sleep(latency)
+
+    def session(self):
+        return FakeSession(self)
+
+class FakeFileList:
+    def __init__(self, drive, params):
+        self.drive = drive
+        self.params = params
+        self.pages = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pages is None:
+            self.drive.list_page()
+            files = self.drive.query(self.params['q'])
+            page_size = self.params.get('maxResults', self.drive.page_size)
+            self.pages = [files[offset:offset + page_size] for offset in range(0, len(files), page_size)]
+        elif self.pages:
+            self.drive.list_page()
+        if not self.pages:
+            raise StopIteration
+        return self.pages.pop(0)
+
+    def GetList(self):
+        return [file_meta for page in self for file_meta in page]
+
+class FakeSession:
+    """
+    answers the requests made by DriveDownloader in place of a requests.Session
+    """
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, method, url, headers=None, params=None, stream=False, **kwargs):
+        file_id = url.rsplit('/', 1)[-1]
+        with self.drive.lock:
+            self.drive.calls[f'drive_{method.lower()}'] += 1
+            file_meta = self.drive.files.get(file_id)
+            if method == 'DELETE' and file_meta is not None:
+                del self.drive.files[file_id]
+        if file_meta is None:
+            return FakeResponse(404, b'', self.drive.bandwidth)
+        if method == 'DELETE':
+            return FakeResponse(204, b'', self.drive.bandwidth)
+        range_header = (headers or {}).get('Range')
+        if range_header is not None:
+            offset = int(re.match(r'bytes=(\d+)-', range_header).group(1))
+            return FakeResponse(206, file_meta['content'][offset:], self.drive.bandwidth)
+        return FakeResponse(200, file_meta['content'], self.drive.bandwidth)
+
+class FakeResponse:
+    def __init__(self, status_code, content, bandwidth):
+        self.status_code = status_code
+        self.content = content
+        self.bandwidth = bandwidth
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error', response=self)
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self.content), chunk_size):
+            chunk = self.content[offset:offset + chunk_size]
+            time.sleep(len(chunk) / self.bandwidth)
+            yield chunk
@@ -1,37 +1,17 @@
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
+from concurrent.futures import ThreadPoolExecutor
 import os
 import time
-from datetime import datetime
+import hashlib
+import threading
+import requests
+import rate_limit
+import telemetry
 import logging
-def check_task_status(task, task_identifier, gap = 20):
-    """
-    监控任务状态直到完成或失败
-    
-    Args:
-        task: ee.batch.Task 对象
-        timeout_minutes: 超时时间（分钟）
-    
-    Returns:
-        bool: 任务是否成功完成
-    """
-    
-    while True:
-        status = task.status()
-        state = status['state']
-        if (state != 'READY'):
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {task_identifier} task state: {state}")
-            if state == 'COMPLETED':
-                time.sleep(10) # ensure the image is seccussfully written to drive
-                print(f"✓ {task_identifier} task success")
-                return True
-            elif state in ['FAILED', 'CANCELLED']:
-                logging.error(f"{task_identifier} failed")
-                print(f"× {task_identifier} task failed")
-                return False
-            
-        time.sleep(gap)
 
+DRIVE_FILES_API = 'https://www.googleapis.com/drive/v2/files'
+STREAM_RETRIES = 4 # a transfer dropped mid stream is resumed from the part file this many times
 
 def create_folder(drive,parent_folder_id,folder_name):
     folder_metadata = {
@@ -53,31 +33,184 @@ def create_folder(drive,parent_folder_id,folder_name):
 def get_folder_id_by_name(drive, folder_name, parent_id='root'):
     """通过文件夹名称获取ID"""
     query = f"title='{folder_name}' and mimeType='application/vnd.google-apps.folder' and '{parent_id}' in parents and trashed=false"
-    file_list = drive.ListFile({'q': query}).GetList()
+    file_list = rate_limit.call('drive', drive.ListFile({'q': query}).GetList)
     if file_list:
         return file_list[0]['id']
     return None
 
-def download_and_clean(drive,folder_id, cloud_file_name, save_path):
-    cloud_file_name = cloud_file_name
-    os.makedirs(save_path, exist_ok=True)
-    
-    file_list = drive.ListFile({
-        'q': f"'{folder_id}' in parents and mimeType != 'application/vnd.google-apps.folder'",
-        'maxResults': 1000
-    }).GetList()
-    
-    is_found = False
-    for file_obj in file_list:
-        if (file_obj['title'].startswith(cloud_file_name)):
-            is_found = True
-            print(f"find file {cloud_file_name}")
-            local_file_name = os.path.join(save_path, cloud_file_name)
-            print(f"downloading to {local_file_name}")
-            file_obj.GetContentFile(local_file_name)
-            file_obj.Delete()
-            print(f"delete {cloud_file_name}")
-            continue
-    if (not is_found):
-        print(f"not find file {cloud_file_name}")
-    return
\ No newline at end of file
+class DriveDownloader:
+    """
+    download exported files from drive with a bounded pool of resumable, checksum verified transfers
+
+    folder ids and folder listings are cached so every export does not list the whole folder again
+    """
+    def __init__(self, drive, max_workers=4, chunk_size=8 * 1024 * 1024, listing_ttl=60, session=None):
+        self.drive = drive
+        self.gauth = drive.auth
+        self.chunk_size = chunk_size
+        self.listing_ttl = listing_ttl
+        self.session = session if session is not None else create_session(max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='drive')
+        self.lock = threading.Lock()
+        self.folder_ids = {} # (parent id, folder name) -> folder id
+        self.listing = {} # folder id -> {file id: file metadata}
+        self.listing_time = {} # folder id -> time of the last listing
+
+    def get_folder_id(self, folder_name, parent_id='root'):
+        key = (parent_id, folder_name)
+        with self.lock:
+            if key in self.folder_ids:
+                return self.folder_ids[key]
+        folder_id = get_folder_id_by_name(self.drive, folder_name, parent_id)
+        if folder_id is not None:
+            with self.lock:
+                self.folder_ids[key] = folder_id
+        return folder_id
+
+    def list_folder(self, folder_id):
+        """
+        list every file in the folder page by page and refresh the cached index
+        """
+        listing = {}
+        file_pages = self.drive.ListFile({
+            'q': f"'{folder_id}' in parents and mimeType != 'application/vnd.google-apps.folder' and trashed=false",
+            'maxResults': 1000
+        })
+        while True:
+            try:
+                page = rate_limit.call('drive', next, file_pages)
+            except StopIteration:
+                break
+            for file_obj in page:
+                listing[file_obj['id']] = dict(file_obj)
+        with self.lock:
+            self.listing[folder_id] = listing
+            self.listing_time[folder_id] = time.time()
+        return listing
+
+    def find_files(self, folder_id, cloud_file_name):
+        """
+        return the files exported under the task description, including every tile of a sharded export
+        """
+        def match(listing):
+            return [file_meta for file_meta in listing.values() if is_export_of(file_meta['title'], cloud_file_name)]
+        with self.lock:
+            listing = self.listing.get(folder_id)
+            listing_time = self.listing_time.get(folder_id, 0)
+        if listing is not None and time.time() - listing_time < self.listing_ttl:
+            file_list = match(listing)
+            if file_list:
+                return file_list
+        return match(self.list_folder(folder_id))
+
+    def request(self, method, url, headers=None, **kwargs):
+        return rate_limit.call('drive', self.authorized_request, method, url, headers, **kwargs)
+
+    def authorized_request(self, method, url, headers=None, **kwargs):
+        headers = dict(headers or {})
+        for attempt in range(2):
+            headers['Authorization'] = f'Bearer {self.gauth.credentials.access_token}'
+            response = self.session.request(method, url, headers=headers, **kwargs)
+            if response.status_code == 401 and attempt == 0: # access token expired
+                response.close()
+                with self.lock:
+                    self.gauth.Refresh()
+                continue
+            response.raise_for_status()
+            return response
+
+    def download(self, file_meta, save_path, retries=STREAM_RETRIES, base_delay=1.0):
+        """
+        download one file, an interrupted transfer is resumed from the bytes already on disk.
+        the part file is named by the drive file id, so files sharing a title never write into one another
+        """
+        local_file_name = os.path.join(save_path, file_meta['title'])
+        part_file_name = os.path.join(save_path, f"{file_meta['id']}.part")
+        file_size = int(file_meta.get('fileSize', -1))
+        for attempt in range(retries + 1):
+            offset = os.path.getsize(part_file_name) if os.path.exists(part_file_name) else 0
+            if offset > file_size >= 0: # stale part file
+                os.remove(part_file_name)
+                offset = 0
+            if offset == file_size:
+                break
+            try:
+                headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+                response = self.request('GET', f"{DRIVE_FILES_API}/{file_meta['id']}", params={'alt': 'media'}, headers=headers, stream=True)
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with response, open(part_file_name, mode) as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        telemetry.download_bytes.inc(len(chunk))
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == retries:
+                    raise
+                logging.warning(f"{file_meta['title']} dropped at {os.path.getsize(part_file_name) if os.path.exists(part_file_name) else 0} bytes({e}), resuming")
+                time.sleep(base_delay * 2 ** attempt)
+        if 'md5Checksum' in file_meta and file_md5(part_file_name) != file_meta['md5Checksum']:
+            os.remove(part_file_name)
+            raise IOError(f"checksum mismatch for {file_meta['title']}")
+        os.replace(part_file_name, local_file_name)
+        return local_file_name
+
+    def download_and_delete(self, folder_id, file_meta, save_path, labels=None):
+        print(f"downloading to {os.path.join(save_path, file_meta['title'])}")
+        with telemetry.span('drive_download', file=file_meta['title'], bytes=int(file_meta.get('fileSize', 0)), **(labels or {})):
+            local_file_name = self.download(file_meta, save_path)
+        self.delete_file(folder_id, file_meta)
+        print(f"delete {file_meta['title']}")
+        return local_file_name
+
+    def delete_file(self, folder_id, file_meta):
+        self.request('DELETE', f"{DRIVE_FILES_API}/{file_meta['id']}")
+        with self.lock:
+            self.listing.get(folder_id, {}).pop(file_meta['id'], None)
+
+    def download_and_clean(self, folder_id, cloud_file_name, save_path, labels=None):
+        """
+        download every file of the export in parallel and delete the verified drive copies.
+        of files sharing a title only the newest is downloaded, the older ones are left by failed downloads and are deleted
+
+        Args:
+            labels: (city, year, month, satellite) keys of the job added to the drive spans
+        """
+        os.makedirs(save_path, exist_ok=True)
+        with telemetry.span('drive_list', job=cloud_file_name, **(labels or {})):
+            file_list = self.find_files(folder_id, cloud_file_name)
+        if (not file_list):
+            print(f"not find file {cloud_file_name}")
+            return []
+        newest = {}
+        for file_meta in sorted(file_list, key=lambda file_meta: file_meta.get('createdDate', '')):
+            older = newest.get(file_meta['title'])
+            if older is not None:
+                print(f"delete older copy of {older['title']}")
+                self.delete_file(folder_id, older)
+            newest[file_meta['title']] = file_meta
+        file_list = list(newest.values())
+        print(f"find {len(file_list)} file(s) for {cloud_file_name}")
+        futures = [self.executor.submit(self.download_and_delete, folder_id, file_meta, save_path, labels) for file_meta in file_list]
+        return [future.result() for future in futures]
+
+def create_session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    return session
+
+def is_export_of(title, cloud_file_name):
+    """
+    gee names a single export <description>.tif and the tiles of a sharded one <description>-<row>-<col>.tif
+    """
+    if not title.startswith(cloud_file_name):
+        return False
+    rest = title[len(cloud_file_name):]
+    return rest == '' or rest.startswith('.') or rest.startswith('-')
+
+def file_md5(file_name, chunk_size=8 * 1024 * 1024):
+    md5 = hashlib.md5()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
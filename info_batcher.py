@@ -0,0 +1,114 @@
+import ee
+import time
+import rate_limit
+import logging
+import threading
+from concurrent.futures import Future
+
+class InfoBatcher:
+    """
+    coalesce small getInfo calls, the pending objects are packed into one ee.List per request
+
+    a batch is sent when it holds max_batch objects, when the time window since its first
+    object has passed, or when flush() is called
+    """
+    def __init__(self, max_batch=32, window=0.2, max_workers=2):
+        self.max_batch = max_batch
+        self.window = window
+        self.max_workers = max_workers
+        self.pending = [] # (ee object, future)
+        self.flushing = False
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def submit(self, ee_object):
+        future = Future()
+        with self.condition:
+            self.pending.append((ee_object, future))
+            if not self.threads:
+                for index in range(self.max_workers):
+                    thread = threading.Thread(target=self._run, name=f'info_batcher_{index}', daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+            self.condition.notify_all()
+        return future
+
+    def flush(self):
+        """
+        send the pending objects without waiting for the time window
+        """
+        with self.condition:
+            self.flushing = True
+            self.condition.notify_all()
+
+    def _take_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = time.time() + self.window
+            while len(self.pending) < self.max_batch and not self.flushing:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            if not self.pending:
+                self.flushing = False
+            return batch
+
+    def _evaluate(self, batch):
+        try:
+            values = rate_limit.call('getinfo', ee.List([ee_object for ee_object, _ in batch]).getInfo)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # one bad object fails the whole list, evaluate them one by one to isolate it
+            logging.warning(f"batched getInfo of {len(batch)} objects failed({e}), retry one by one")
+            for item in batch:
+                self._evaluate([item])
+            return
+        for (_, future), value in zip(batch, values):
+            future.set_result(value)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._evaluate(batch)
+
+default_batcher = None
+default_batcher_lock = threading.Lock()
+
+def get_batcher():
+    global default_batcher
+    with default_batcher_lock:
+        if default_batcher is None:
+            default_batcher = InfoBatcher()
+    return default_batcher
+
+def evaluate(ee_object):
+    """
+    drop-in replacement of ee_object.getInfo() sharing the request with concurrent callers
+    """
+    return get_batcher().submit(ee_object).result()
+
+def evaluate_all(ee_objects):
+    batcher = get_batcher()
+    futures = [batcher.submit(ee_object) for ee_object in ee_objects]
+    batcher.flush()
+    return [future.result() for future in futures]
+
+def limit_compute_value():
+    """
+    send every getInfo round trip, including the ones made inside the ee_lst scene search, through
+    the getinfo limits one request at a time
+    """
+    compute_value = ee.data.computeValue
+    if getattr(compute_value, 'rate_limited', False):
+        return
+    def limited_compute_value(*args, **kwargs):
+        return rate_limit.call('getinfo', compute_value, *args, **kwargs)
+    limited_compute_value.rate_limited = True
+    ee.data.computeValue = limited_compute_value
@@ -0,0 +1,51 @@
+import heapq
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def run_jobs(jobs, worker, max_in_flight, cost=None, on_result=None, lookahead=None):
+    """
+    run worker(job) for a stream of jobs on one long-lived pool
+
+    at most max_in_flight jobs run at the same time, the next job is started as soon as any job
+    finishes. jobs are pulled lazily from the iterable into a window of `lookahead` jobs, and the
+    cheapest job of the window by cost(job) is started first.
+
+    Args:
+        jobs: iterable of jobs, usually a generator
+        worker: function called with one job, its return value is passed to on_result
+        max_in_flight: number of jobs running at the same time
+        cost: function returning the expected cost of a job, lower runs first
+        on_result: function called with (job, result) as soon as a job finishes, result is None if it raised
+        lookahead: number of jobs buffered for prioritising, default 4 * max_in_flight
+    """
+    lookahead = lookahead or max_in_flight * 4
+    job_iter = iter(jobs)
+    order = itertools.count() # keep the input order between jobs of the same cost
+    window = []
+    running = {}
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='job') as executor:
+        while True:
+            while not exhausted and len(window) < lookahead:
+                try:
+                    job = next(job_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                heapq.heappush(window, (cost(job) if cost else 0, next(order), job))
+            while window and len(running) < max_in_flight:
+                _, _, job = heapq.heappop(window)
+                running[executor.submit(worker, job)] = job
+            if not running:
+                return
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"job {job} failed: {e}")
+                    result = None
+                if on_result is not None:
+                    on_result(job, result)
@@ -1,18 +1,31 @@
 import ee
 import os
 import folium
-import time
 import logging
 import traceback
-import multiprocessing as mp
-import csv
 import monitor
+import record_writer
+import scene_index
+import telemetry
+import threading
+import pandas as pd
 
-from dotenv import load_dotenv
 from pypinyin import lazy_pinyin as pinyin
-from fetch_drive import download_and_clean, check_task_status
-from fetch_drive import get_folder_id_by_name as get_folder_id
-from ee_lst.landsat_lst import fetch_best_landsat_image
+from ee_lst.landsat_lst import fetch_best_landsat_image, fetch_landsat_collection
+from ee_lst.aster_bare_emiss import emiss_bare_band10
+from scene_catalog import select_best_scene
+from functools import partial
+from task_poller import start_task
+from info_batcher import evaluate_all
+from mosaic import mosaic_tiles, mosaic_export, assemble_grid_tiles
+from export_profile import get_export_profile, apply_export_profile, export_format_options
+from export_grid import CRS_TRANSFORM, MAX_TILE_ATTEMPTS, tile_description, parse_tile_description
+
+CLOUD_THRESHOLD = 25
+DRIVE_SETTLE_SECONDS = 20 # a finished export takes a while to show up in the drive listing
+
+tile_exports = {} # tile description -> function restarting the tile export, rebuilt from the ledger after a restart
+tile_exports_lock = threading.Lock()
 
 # Define a method to display Earth Engine image tiles
 def add_ee_layer(self, ee_image_object, vis_params, name):
@@ -25,38 +38,38 @@ def add_ee_layer(self, ee_image_object, vis_params, name):
         control=True,
     ).add_to(self)
 
-def show_map(self, map_data, map_name, type = 'LST'):
-    # Visualization parameters
-    cmap1 = ["blue", "cyan", "green", "yellow", "red"]
-    cmap2 = ["F2F2F2", "EFC2B3", "ECB176", "E9BD3A", "E6E600", "63C600", "00A600"]
+# band, visualization parameters and layer name of every map type
+MAP_CMAP1 = ["blue", "cyan", "green", "yellow", "red"]
+MAP_CMAP2 = ["F2F2F2", "EFC2B3", "ECB176", "E9BD3A", "E6E600", "63C600", "00A600"]
+MAP_LAYERS = {
+    'TPW': ("TPW", {"min": 0, "max": 60, "palette": MAP_CMAP1}, "TCWV"),
+    'TPWpos': ("TPWpos", {"min": 0, "max": 9, "palette": MAP_CMAP1}, "TCWVpos"),
+    'FVC': ("FVC", {"min": 0, "max": 1, "palette": MAP_CMAP2}, "FVC"),
+    'EM': ("EM", {"min": 0.9, "max": 1.0, "palette": MAP_CMAP1}, "Emissivity"),
+    'B10': ("B10", {"min": 290, "max": 320, "palette": MAP_CMAP1}, "TIR BT"),
+    'LST': ("LST", {"min": 290, "max": 320, "palette": MAP_CMAP1}, "LST"),
+}
 
+def show_map(self, map_data, map_name, type = 'LST'):
     # Add EE drawing method to folium
     folium.Map.add_ee_layer = add_ee_layer
 
     # Create a folium map object
     geometry = map_data['geometry']
     feature_image = map_data['image']
-    centerXY = geometry.centroid().getInfo()['coordinates']
+    centroid_info, geometry_info = evaluate_all([geometry.centroid(), geometry])
+    centerXY = centroid_info['coordinates']
     center = [centerXY[1], centerXY[0]]
     map_render = folium.Map(center, zoom_start=10, height=500)
 
     # Add the Earth Engine layers to the folium map
-    if (type == 'TPW'):
-        map_render.add_ee_layer(feature_image.select("TPW"), {"min": 0, "max": 60, "palette": cmap1}, "TCWV")
-    elif (type == 'TPWpos'):
-        map_render.add_ee_layer(feature_image.select("TPWpos"), {"min": 0, "max": 9, "palette": cmap1}, "TCWVpos")
-    elif (type == 'FVC'):
-        map_render.add_ee_layer(feature_image.select("FVC"), {"min": 0, "max": 1, "palette": cmap2}, "FVC")
-    elif (type == 'EM'):
-        map_render.add_ee_layer(feature_image.select("EM"), {"min": 0.9, "max": 1.0, "palette": cmap1}, "Emissivity")
-    elif (type == 'B10'):
-        map_render.add_ee_layer(feature_image.select("B10"), {"min": 290, "max": 320, "palette": cmap1}, "TIR BT")
-    elif (type == 'LST'):
-        map_render.add_ee_layer(feature_image.select("LST"), {"min": 290, "max": 320, "palette": cmap1}, "LST")
+    if type in MAP_LAYERS:
+        band, vis_params, layer_name = MAP_LAYERS[type]
+        map_render.add_ee_layer(feature_image.select(band), vis_params, layer_name)
 
     ## add geometry boundary
     folium.GeoJson(
-        geometry.getInfo(),
+        geometry_info,
         name='Geometry',
     ).add_to(map_render)
     # Display the map
@@ -65,42 +78,104 @@ def show_map(self, map_data, map_name, type = 'LST'):
 def filter_city_bound(city_geometry):
     """
     city geometry buffer has many scatters. select the largest polygon as the main urban area
+
+    the selection is computed on the server, nothing is requested until the result is evaluated
+    """
+    def polygon_area(polygon):
+        polygon = ee.Geometry(polygon)
+        return ee.Feature(polygon).set('area', polygon.area(1))
+    polygons = ee.FeatureCollection(city_geometry.geometries().map(polygon_area))
+    return ee.Feature(polygons.sort('area', False).first()).geometry()
+
+def fetch_catalog_image(scene, satellite, date_start, date_end, city_geometry, cloud_threshold, urban_geometry, use_ndvi):
+    """
+    build the lst image of a scene chosen from the local catalog, same return as fetch_best_landsat_image
+    """
+    landsat_image = scene_day_image(satellite, scene['date'], city_geometry, cloud_threshold, use_ndvi)
+    return landsat_image, scene['toa_porpotion'], scene['sr_porpotion'], scene['toa_cloud'], scene['sr_cloud'], scene['day']
+
+def scene_day_image(satellite, date, geometry, cloud_threshold, use_ndvi):
+    """
+    the lst mosaic of the scenes of one satellite acquired on the date ('YYYY-MM-DD') over the geometry
     """
-    if (city_geometry.type().getInfo() == 'Polygon'):
-        return city_geometry
-    geometry_num = city_geometry.geometries().length().getInfo()
-    logging.debug(f"geometry_num: {geometry_num}")
-    largest = None
-    max_area = 0
-    for i in range(0,geometry_num):
-        polygon = ee.Geometry.Polygon(city_geometry.coordinates().get(i))
-        area = polygon.area().getInfo()
-        if area > max_area:
-            max_area = area
-            largest = ee.Geometry(polygon)
-    logging.debug(f"max area is {max_area}")
-    return largest
-
-def create_lst_image(city_name,year,month,city_geometry,urban_geometry,folder_name,to_drive):
+    scene_start = ee.Date(date)
+    landsat_coll = fetch_landsat_collection(satellite, scene_start, scene_start.advance(1, 'day'), geometry, cloud_threshold, use_ndvi)
+    return landsat_coll.mosaic().set('system:time_start', scene_start.millis())
+
+def start_export(image, description, folder_name, region, **grid):
+    """
+    export the image reduced to the bands and encoding of the EXPORT_PROFILE
+    """
+    profile = get_export_profile()
+    if profile is not None and 'EM_bare' in profile['bands']:
+        image = image.addBands(emiss_bare_band10(image).rename('EM_bare'))
+    task = ee.batch.Export.image.toDrive(image=apply_export_profile(image, profile),
+                            description=description,
+                            folder=f'{folder_name}',
+                            crs='EPSG:4326',
+                            region=region,
+                            fileFormat='GeoTIFF',
+                            maxPixels=1e13,
+                            **export_format_options(profile),
+                            **grid)
+    start_task(task, description)
+    return task
+
+def start_tile_exports(image, description, folder_name, tiles, city_name, year, month, satellite, scene_date=None):
+    """
+    export every grid tile not downloaded by an earlier attempt as a task of its own, return [(task id, tile description)].
+    the scene date is kept in the ledger with the tile bounds, so the tiles can be exported again after a restart
+    """
+    export_params = None if scene_date is None else {'folder': folder_name, 'satellite': satellite, 'date': scene_date}
+    monitor.register_tiles(description, tiles, export_params)
+    completed_tiles = monitor.load_completed_tiles(description)
+    if len(completed_tiles) == len(tiles): # the tiles were downloaded but not assembled, export them again
+        completed_tiles = set()
+    monitor.submit_job(city_name, year, month, satellite, None, description)
+    task_list = []
+    for row, col, bounds in tiles:
+        if (row, col) in completed_tiles:
+            continue
+        tile_name = tile_description(description, row, col)
+        restart = partial(start_export, image, tile_name, folder_name, ee.Geometry.Rectangle(bounds, 'EPSG:4326', False), crsTransform=CRS_TRANSFORM)
+        task = restart()
+        monitor.submit_tile(description, row, col, task.id)
+        with tile_exports_lock:
+            tile_exports[tile_name] = restart
+        task_list.append((task.id, tile_name))
+    logging.info(f"{description} exported as {len(task_list)} of {len(tiles)} grid tiles")
+    return task_list
+
+def create_lst_image(city_name,year,month,city_geometry,urban_geometry,folder_name,to_drive,satellite_list=None,catalog=None,tiles=None):
     # Define parameters
     month_length = [31,28,31,30,31,30,31,31,30,31,30,31]
-    satellite_list = ['L8', 'L5', 'L7', 'L4']
+    if satellite_list is None:
+        satellite_list = ['L8', 'L5', 'L7', 'L4']
     date_start = ee.Date.fromYMD(year, month, 1)
     date_end = ee.Date.fromYMD(year, month, month_length[month-1]).advance(1, 'day')
     use_ndvi = True
-    cloud_threshold = 25
-   
-    load_dotenv()
-    record_file_path = os.getenv('RECORD_FILE_PATH') # csv
+    cloud_threshold = CLOUD_THRESHOLD
+
+    fetch_image = fetch_best_landsat_image
+    if catalog is not None:
+        # the scene is chosen from the local catalog, only the lst of the chosen date is built on the server
+        scene = select_best_scene(catalog, year, month, satellite_list, cloud_threshold)
+        satellite_list = [] if scene is None else [scene['satellite']]
+        fetch_image = partial(fetch_catalog_image, scene)
+
+    # the month is claimed before its scene search, so finished and running months cost no search
+    if to_drive and not monitor.claim_job_slot(city_name, year, month):
+        logging.info(f"{city_name} {year}-{month:02} is exporting or exported already")
+        return None
 
     landsat_coll = None
+    fetch_error = None
     map_name = f'landsat_{city_name}'
     for satellite in satellite_list:
         try:
-            landsat_coll, toa_porpotion, sr_porpotion, toa_cloud, sr_cloud , day = fetch_best_landsat_image(satellite, date_start, date_end, city_geometry, cloud_threshold, urban_geometry, use_ndvi)
-            with open(record_file_path, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([city_name, year, month, toa_porpotion, sr_porpotion, toa_cloud, sr_cloud, day])
+            with telemetry.span('scene_search', city=city_name, year=year, month=month, satellite=satellite):
+                landsat_coll, toa_porpotion, sr_porpotion, toa_cloud, sr_cloud , day = fetch_image(satellite, date_start, date_end, city_geometry, cloud_threshold, urban_geometry, use_ndvi)
+            record_writer.write_record([city_name, year, month, toa_porpotion, sr_porpotion, toa_cloud, sr_cloud, day])
             logging.info(f"success: {satellite}")
             map_name = f'{map_name}_{satellite}_{year}_{month}'
             break
@@ -109,28 +184,32 @@ def create_lst_image(city_name,year,month,city_geometry,urban_geometry,folder_na
             continue
         except Exception as e:
             logging.error(f"fetch error: {e}\n traceback: {traceback.format_exc()}")
+            fetch_error = e
             continue
     
     if landsat_coll is None:
         logging.error("No Landsat data found")
+        if fetch_error is None:
+            monitor.record_search_result(city_name, year, month, 'EMPTY', f'no scene under cloud threshold {cloud_threshold}')
+        else:
+            monitor.record_search_result(city_name, year, month, 'FAILED', fetch_error)
         return None
 
     if to_drive:
         e_city_name = ''.join(pinyin(city_name))
         descrption = f"{e_city_name}Landsat{year}{month:02}"
         try:
-            task = ee.batch.Export.image.toDrive(image=landsat_coll,
-                                    description=descrption,
-                                    folder=f'{folder_name}',
-                                    scale=30,
-                                    crs='EPSG:4326',
-                                    region=city_geometry,
-                                    fileFormat='GeoTIFF',
-                                    maxPixels=1e13)
-            task.start()
-            return task, descrption
+            monitor.assign_job_satellite(city_name, year, month, satellite)
+            with telemetry.span('task_start', city=city_name, year=year, month=month, satellite=satellite):
+                if tiles is not None:
+                    scene_date = f'{year}-{month:02}-{int(day):02}' if pd.notna(day) else None
+                    return start_tile_exports(landsat_coll, descrption, folder_name, tiles, city_name, year, month, satellite, scene_date), descrption
+                task = start_export(landsat_coll, descrption, folder_name, city_geometry, scale=30)
+            monitor.submit_job(city_name, year, month, satellite, task.id, descrption)
+            return [(task.id, descrption)], descrption
         except Exception as e:
             logging.error(f"error to export: {e}\n traceback: {traceback.format_exc()}")
+            monitor.release_job(city_name, year, month, satellite, e)
             return None
     else:
         try:
@@ -142,55 +221,113 @@ def create_lst_image(city_name,year,month,city_geometry,urban_geometry,folder_na
             logging.error(f"error: {e}\n traceback: {traceback.format_exc()}")
     return None
 
-def monitor_export_task(gauth,task,file_name,drive,folder_name,save_path):
-    task_identifier = file_name
-    is_success = check_task_status(task,task_identifier)
+def finish_export(save_path, description):
+    """
+    mark the job completed and add the downloaded image to the local scene index
+    """
+    file_path = os.path.join(save_path, f'{description}.tif')
+    monitor.complete_job(description)
+    try:
+        scene_index.ingest_scene(file_path)
+    except Exception as e:
+        logging.error(f'{description} failed to be indexed: {e}')
+
+def download_exported_file(gauth,downloader,folder_name,save_path,file_name):
+    """
+    download the finished export, called by the task poller's download workers
+    """
     monitor.check_and_refresh_token(gauth)
-    if is_success:
-        time.sleep(20) # wait for the last iamge to be created
-        folder_id = get_folder_id(drive,folder_name)
-        try:
-            download_and_clean(drive, folder_id, file_name, save_path)
-            monitor.remove_process(file_name)
-        except Exception as e:
-            logging.error(f'{file_name} failed to download({e})')
-        logging.info(f'{file_name} exported')
+    tile = parse_tile_description(file_name)
+    labels = monitor.job_labels(file_name if tile is None else tile[0]) # the drive spans join the ee spans of the job
+    telemetry.sleep(DRIVE_SETTLE_SECONDS, 'drive_settle', job=file_name, **labels) # wait for the last iamge to be created
+    folder_id = downloader.get_folder_id(folder_name)
+    download_path = save_path if tile is None else os.path.join(save_path, 'tiles') # grid tiles wait there for the others
+    try:
+        file_list = downloader.download_and_clean(folder_id, file_name, download_path, labels)
+        if not file_list:
+            raise FileNotFoundError(f'no exported file of {file_name} in {folder_name}')
+        export_profile = get_export_profile()
+        with telemetry.span('mosaic', job=file_name, files=len(file_list), **labels):
+            # sharded exports are merged into one file, the tags of the export profile go into the final COG
+            mosaics = mosaic_export(file_list, download_path, export_profile=None if tile is not None else export_profile)
+            if tile is None and not mosaics and export_profile is not None: # one file, copied again to carry the tags
+                mosaic_tiles(file_list, os.path.join(save_path, f'{file_name}.tif'), export_profile=export_profile)
+        if tile is None:
+            finish_export(save_path, file_name)
+        else:
+            description, row, col = tile
+            with tile_exports_lock:
+                tile_exports.pop(file_name, None)
+            if monitor.complete_tile(description, row, col) == 0:
+                with telemetry.span('assemble', job=description, **labels):
+                    assemble_grid_tiles(description, download_path, save_path, export_profile)
+                finish_export(save_path, description)
+    except Exception as e:
+        logging.error(f'{file_name} failed to download({e})')
+        if tile is None:
+            monitor.fail_job(file_name, e)
+        else:
+            monitor.fail_tile(*tile, e)
+            monitor.fail_job(tile[0], f'{file_name} failed to download({e})')
+    logging.info(f'{file_name} exported')
     return
 
-def export_lst_image(gauth,city_name,year,month,city_geometry,urban_geometry,folder_name,to_drive,drive, save_path):
+def load_tile_restart(description, row, col):
+    """
+    the export of a tile rebuilt from its ledger row, raise if the row has no export parameters
+    """
+    export_params = monitor.load_tile_export(description, row, col)
+    if export_params is None:
+        raise RuntimeError('no export parameters in the ledger to export the tile again')
+    region = ee.Geometry.Rectangle(export_params['bounds'], 'EPSG:4326', False)
+    image = scene_day_image(export_params['satellite'], export_params['date'], region, CLOUD_THRESHOLD, True)
+    logging.info(f"{tile_description(description, row, col)} rebuilt from the ledger, {export_params['satellite']} {export_params['date']}")
+    return partial(start_export, image, tile_description(description, row, col), export_params['folder'], region, crsTransform=CRS_TRANSFORM)
+
+def record_failed_export(file_name):
+    """
+    a failed grid tile is exported again on its own up to MAX_TILE_ATTEMPTS times, return the id of the new task
+    """
+    tile = parse_tile_description(file_name)
+    if tile is None:
+        monitor.fail_job(file_name, 'export task failed')
+        return None
+    description, row, col = tile
+    attempts = monitor.fail_tile(description, row, col, 'export task failed')
+    with tile_exports_lock:
+        restart = tile_exports.pop(file_name, None)
+    try:
+        if attempts >= MAX_TILE_ATTEMPTS:
+            raise RuntimeError(f'tile failed {attempts} times')
+        if restart is None: # the tile was exported by an earlier process, rebuild its export from the ledger
+            restart = load_tile_restart(description, row, col)
+        task = restart()
+        monitor.submit_tile(description, row, col, task.id)
+        with tile_exports_lock:
+            tile_exports[file_name] = restart
+        return task.id
+    except Exception as e:
+        logging.error(f'{file_name} is not exported again, {description} fails: {e}')
+        monitor.fail_job(description, f'{file_name} export failed({e})')
+        return None
+
+def export_lst_image(poller,city_name,year,month,city_geometry,urban_geometry,folder_name,to_drive,satellite_list=None,catalog=None,tiles=None):
 
     """
-    export the lst image to the drive
+    export the lst image to the drive, the finished task is downloaded by the poller
     """
     try:
-        task, file_name = create_lst_image(city_name,year,month,city_geometry,urban_geometry,folder_name,to_drive)
+        task_list, file_name = create_lst_image(city_name,year,month,city_geometry,urban_geometry,folder_name,to_drive,satellite_list,catalog,tiles)
     except Exception as e:
         logging.error(f"error to create task: {e}")
         return None
     
     if (to_drive):
         try:
-            try:
-                while monitor.is_process_counter_exceed_limit():
-                    logging.info(f"process counter exceed limit, wait for 10 minutes")
-                    time.sleep(600)
-            except Exception as e:
-                logging.error(f"error to check process counter: {e}")
-            try:
-                process = mp.Process(
-                    name=file_name,
-                    target=monitor_export_task, 
-                    args=(gauth,task,file_name,drive,folder_name,save_path),
-                    daemon=False
-                )
-                process.start()
-                logging.info(f'[{process.pid}] start export {file_name}')
-                monitor.add_process(process)
-            except Exception as e:
-                logging.error(f"error to start process: {e}")
-                return None
-            return month
+            for task_id, task_identifier in task_list:
+                poller.submit(task_id, task_identifier)
+                logging.info(f'[{task_id}] start export {task_identifier}')
         except Exception as e:
-            logging.error(f'{file_name} failed: {e}')
+            logging.error(f'{file_name} failed to register: {e}')
             return None
-
+        return month
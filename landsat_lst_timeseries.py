@@ -2,8 +2,19 @@ import ee
 from ee_lst.landsat_lst import fetch_landsat_collection
 from ee_lst.broadband_emiss import add_band
 from functools import partial
-import random
-ee.Initialize()
+from info_batcher import evaluate
+import telemetry
+import task_poller
+import series_cache
+import csv
+import time
+from datetime import date
+
+SERIES_BANDS = ['LST', 'TPW', 'EM', 'BBE']
+SERIES_FOLDER = 'landsat_lst_timeseries'
+SERIES_DESCRIPTION_PREFIX = 'export_landsat_lst_timeseries_for_'
+SERIES_TASK_TIMEOUT = 12 * 3600 # a series export still unfinished after this is given up
+SERIES_DOWNLOAD_TIMEOUT = 600 # how long a process waiting on an adopted export waits for its starter to download it
 
 # Define the Landsat LST calculation functions (equivalent to JS modules)
 def get_specific_collection(satellite, date_start, date_end, geometry, cloud_threshold, use_ndvi):
@@ -28,20 +39,21 @@ def create_add_band_mapper():
 def create_feature(geometry, site, satellite, image):
     date = ee.Date(image.get('system:time_start'))
     scale = 30 # 30m resolution 
+    values = image.select(SERIES_BANDS).reduceRegion(ee.Reducer.mean(), geometry, scale)
     props = {
         'year': date.get('year'),
         'month': date.get('month'),
         'day': date.get('day'),
-        'lst': image.select('LST').reduceRegion(ee.Reducer.mean(), geometry, scale).get('LST'),
-        'tpw': image.select('TPW').reduceRegion(ee.Reducer.mean(), geometry, scale).get('TPW'),
-        'em': image.select('EM').reduceRegion(ee.Reducer.mean(), geometry, scale).get('EM'),
+        'lst': values.get('LST'),
+        'tpw': values.get('TPW'),
+        'em': values.get('EM'),
         'satellite': satellite,
-        'bbe': image.select('BBE').reduceRegion(ee.Reducer.mean(), geometry, scale).get('BBE')
+        'bbe': values.get('BBE')
     }
     return ee.Feature(site, props)
 
-def get_collection(date_start, date_end, site, cloud_threshold, use_ndvi):
-    geometry = site.buffer(30)
+def get_collection(date_start, date_end, site, cloud_threshold, use_ndvi, buffer=30):
+    geometry = site.buffer(buffer)
     add_bbe = create_add_band_mapper()
 
     get_collection = get_collection_wapper(date_start, date_end, geometry, cloud_threshold, use_ndvi)
@@ -60,28 +72,178 @@ def get_collection(date_start, date_end, site, cloud_threshold, use_ndvi):
 def export_to_drive(landsat_coll, point_name):
     task = ee.batch.Export.table.toDrive(
         collection=ee.FeatureCollection(landsat_coll),
-        description='export_landsat_lst_timeseries_for_'+point_name,
-        folder='landsat_lst_timeseries',
+        description=SERIES_DESCRIPTION_PREFIX+point_name,
+        folder=SERIES_FOLDER,
         fileNamePrefix=point_name,
         fileFormat='CSV'
     )
-    task.start()
+    task_poller.start_task(task, SERIES_DESCRIPTION_PREFIX+point_name)
     print("Export task started.") 
     return task
 
-def create_series(lat,lon):
-    # use current time to generate a random number
-    random_number = random.randint(10000, 99999)
-    point_name = str(lat).replace('.', '') + '_' + str(lon).replace('.', '') + '_' + str(random_number)
+def create_sites_feature_mapper(sites, satellite, buffer):
+    """
+    map one image to the features of all sites with a single multi-band reduceRegions
+    """
+    buffered_sites = sites.map(lambda site: site.buffer(buffer))
+    def mapper(image):
+        date = ee.Date(image.get('system:time_start'))
+        reduced = image.select(SERIES_BANDS).reduceRegions(collection=buffered_sites, reducer=ee.Reducer.mean(), scale=30)
+        reduced = reduced.filter(ee.Filter.notNull(SERIES_BANDS)) # a site masked out in the scene gets no band property
+        def set_props(feature):
+            return feature.select(['site_id'] + SERIES_BANDS, ['site_id', 'lst', 'tpw', 'em', 'bbe']).set({
+                'year': date.get('year'),
+                'month': date.get('month'),
+                'day': date.get('day'),
+                'satellite': satellite
+            })
+        return reduced.map(set_props)
+    return mapper
+
+def read_site_rows(file_path, id_column='site_id', lon_column='lon', lat_column='lat'):
+    """
+    return [(site id, lon, lat)] of the csv
+    """
+    with open(file_path, 'r', newline='', encoding='utf-8') as f:
+        return [(row[id_column], float(row[lon_column]), float(row[lat_column])) for row in csv.DictReader(f)]
+
+def load_site_chunks(site_source, chunk_size, id_column='site_id', lon_column='lon', lat_column='lat'):
+    """
+    split the sites of a csv file or of a feature collection asset with a site_id property on the client,
+    so every export carries only its own chunk of sites
+
+    Returns:
+        [ee.FeatureCollection of at most chunk_size sites]
+    """
+    if site_source.endswith('.csv'):
+        rows = read_site_rows(site_source, id_column, lon_column, lat_column)
+        return [
+            ee.FeatureCollection([ee.Feature(ee.Geometry.Point([lon, lat]), {'site_id': site_id}) for site_id, lon, lat in rows[offset:offset + chunk_size]])
+            for offset in range(0, len(rows), chunk_size)
+        ]
+    sites = ee.FeatureCollection(site_source)
+    site_ids = evaluate(sites.aggregate_array(id_column))
+    return [sites.filter(ee.Filter.inList(id_column, site_ids[offset:offset + chunk_size])) for offset in range(0, len(site_ids), chunk_size)]
+
+def create_batch_series(site_source, batch_name, chunk_size=500, buffer=30,
+                        date_start='1982-08-01', date_end='2024-01-31', cloud_threshold=20, use_ndvi=True):
+    """
+    export the time series of many sites, one table per satellite and chunk of sites, return [(task, export name)]
+    """
+    add_bbe = create_add_band_mapper()
+    tasks = []
+    for chunk_index, chunk_sites in enumerate(load_site_chunks(site_source, chunk_size)):
+        get_collection = get_collection_wapper(date_start, date_end, chunk_sites.geometry(), cloud_threshold, use_ndvi)
+        for sat in ['L8', 'L7', 'L5', 'L4']:
+            coll = get_collection(sat).map(add_bbe)
+            site_coll = coll.map(create_sites_feature_mapper(chunk_sites, sat, buffer)).flatten()
+            export_name = f'{batch_name}_{sat}_{chunk_index:03}'
+            tasks.append((export_to_drive(site_coll, export_name), export_name))
+    return tasks
+
+def create_series(lat, lon, buffer=30, date_start='1982-08-01', date_end='2024-01-31', cloud_threshold=20, use_ndvi=True):
+    params = series_cache.series_params(lat, lon, buffer, date_start, date_end, cloud_threshold, use_ndvi)
+    point_name = series_cache.series_point_name(lat, lon, series_cache.series_key(params))
     site = ee.Geometry.Point([lat, lon])
-    date_start = '1982-08-01'
-    date_end = '2024-01-31'
-    cloud_threshold = 20
-    use_ndvi = True
-    landsat_coll = get_collection(date_start, date_end, site, cloud_threshold, use_ndvi)
+    landsat_coll = get_collection(date_start, date_end, site, cloud_threshold, use_ndvi, buffer)
     return export_to_drive(landsat_coll, point_name)
 
+def find_running_export(point_name):
+    """
+    id of an unfinished export of the same series, started by another process
+    """
+    description = SERIES_DESCRIPTION_PREFIX + point_name
+    for task_id, task in task_poller.fetch_tasks().items():
+        if task.get('description') == description and task['state'] in ['READY', 'RUNNING']:
+            return task_id
+    return None
+
+def wait_for_task(task_id, point_name, gap=10, timeout=SERIES_TASK_TIMEOUT, max_missing_polls=task_poller.MAX_MISSING_POLLS):
+    """
+    return True when the task completes, False when it fails, times out or is missing from the task list
+    """
+    deadline = time.monotonic() + timeout
+    missing = 0
+    while True:
+        state = task_poller.fetch_task_states().get(task_id)
+        if state == 'COMPLETED':
+            telemetry.sleep(10, 'drive_settle', job=point_name)
+            return True
+        if state in ['FAILED', 'CANCELLED']:
+            print(f"× {point_name} task failed")
+            return False
+        missing = missing + 1 if state is None else 0
+        if missing >= max_missing_polls:
+            print(f"× {point_name} task {task_id} is not in the task list")
+            return False
+        if time.monotonic() >= deadline:
+            print(f"× {point_name} task {task_id} unfinished after {timeout} seconds")
+            return False
+        telemetry.sleep(gap, 'series_wait', job=point_name)
+
+def fetch_series(downloader, lat, lon, buffer=30, date_start='1982-08-01', date_end='2024-01-31', cloud_threshold=20, use_ndvi=True,
+                 folder_id=None, gap=10):
+    """
+    return the time series of the point as a dataframe, from the local cache when the same request was exported before
+
+    Args:
+        downloader: fetch_drive.DriveDownloader of the drive receiving the exports
+        folder_id: id of the drive folder of the exports, looked up by name if None
+    """
+    params = series_cache.series_params(lat, lon, buffer, date_start, date_end, cloud_threshold, use_ndvi)
+    key = series_cache.series_key(params)
+    point_name = series_cache.series_point_name(lat, lon, key)
+
+    def produce():
+        task_id = find_running_export(point_name)
+        adopted = task_id is not None
+        if adopted:
+            print(f"{point_name} is already exporting, waiting for task {task_id}")
+        else:
+            task_id = create_series(lat, lon, buffer, date_start, date_end, cloud_threshold, use_ndvi).id
+        if not wait_for_task(task_id, point_name, gap):
+            raise RuntimeError(f'export of series {point_name} failed')
+        if adopted: # the process that started the export downloads it, so the file is not fetched twice
+            series = series_cache.wait_for_cached_series(key, SERIES_DOWNLOAD_TIMEOUT, gap)
+            if series is not None:
+                return series
+            print(f"{point_name} was not downloaded by the process that started it, downloading it")
+        try:
+            file_list = downloader.download_and_clean(folder_id or downloader.get_folder_id(SERIES_FOLDER), point_name, series_cache.cache_path())
+            if not file_list:
+                raise FileNotFoundError(f'{point_name} not found on drive')
+        except Exception:
+            series = series_cache.load_cached_series(key) # downloaded and deleted from drive by another process meanwhile
+            if series is not None:
+                return series
+            raise
+        return series_cache.store_series(key, params, file_list[0])
+
+    return series_cache.collapse(key, produce)
+
+def update_series(downloader, lat, lon, buffer=30, date_start='1982-08-01', date_end=None, cloud_threshold=20, use_ndvi=True,
+                  folder_id=None, gap=10):
+    """
+    bring the stored series of the site up to date_end (default today), only the scenes from the last
+    stored acquisition date on are exported and merged into it, deduplicated on satellite and date
+    """
+    date_end = date_end or date.today().isoformat()
+    params = series_cache.series_params(lat, lon, buffer, date_start, date_end, cloud_threshold, use_ndvi)
+    site_params = series_cache.site_params(params)
+    site_key = series_cache.series_key(site_params)
+    with series_cache.site_locks[site_key]:
+        series = series_cache.load_site_series(site_key)
+        # the last day is asked again, scenes of that day written after the previous update are kept by the dedup
+        last_date = series_cache.last_acquisition_date(series)
+        update_start = max(date_start, last_date) if last_date is not None else date_start
+        if update_start >= date_end:
+            return series
+        print(f"updating series of ({lat}, {lon}) from {update_start} to {date_end}")
+        new_series = fetch_series(downloader, lat, lon, buffer, update_start, date_end, cloud_threshold, use_ndvi, folder_id, gap)
+        return series_cache.store_site_series(site_key, site_params, series_cache.merge_series(series, new_series))
+
 def __main__():
+    ee.Initialize()
     lat = 114.35
     lon = 30.35
     create_series(lat, lon)
@@ -0,0 +1,148 @@
+import os
+import json
+import logging
+import numpy as np
+import rasterio
+import monitor
+from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from resume import DOWNLOAD_FILE_PATTERN
+from export_profile import read_decoded
+
+# statistical mono-window algorithm, LST = A * Tb / em + B / em + C
+# the coefficients of every satellite and TPW class are read from LST_COEFFICIENTS_PATH, as exported from ee_lst:
+# {"L8": {"em_veg": ..., "smw": [{"TPWpos": 0, "A": ..., "B": ..., "C": ...}, ...]}, ...}
+NDVI_BARE = 0.2
+NDVI_VEGETATION = 0.86
+EM_WATER = 0.99
+EM_SNOW = 0.989
+
+def load_coefficients(file_path=None):
+    file_path = file_path or os.getenv('LST_COEFFICIENTS_PATH')
+    with open(file_path, 'r', encoding='utf-8') as f:
+        coefficients = json.load(f)
+    for satellite_coefficients in coefficients.values():
+        smw = sorted(satellite_coefficients['smw'], key=lambda row: row['TPWpos'])
+        satellite_coefficients['A'] = np.array([row['A'] for row in smw], dtype=np.float32)
+        satellite_coefficients['B'] = np.array([row['B'] for row in smw], dtype=np.float32)
+        satellite_coefficients['C'] = np.array([row['C'] for row in smw], dtype=np.float32)
+    return coefficients
+
+def compute_fvc(ndvi, ndvi_bare=NDVI_BARE, ndvi_vegetation=NDVI_VEGETATION):
+    fvc = ((ndvi - ndvi_bare) / (ndvi_vegetation - ndvi_bare)) ** 2
+    return np.clip(fvc, 0, 1)
+
+def compute_tpw_position(tpw):
+    """
+    TPW classes of 6 mm, (0, 6] is 0 and anything above 54 is 9
+    """
+    return np.clip(np.ceil(tpw / 6) - 1, 0, 9).astype(np.int8)
+
+def compute_emissivity(fvc, em_bare, em_veg, qa=None):
+    em = fvc * em_veg + (1 - fvc) * em_bare
+    if qa is not None:
+        em = np.where((qa & (1 << 7)) != 0, EM_WATER, em) # water
+        em = np.where((qa & (1 << 5)) != 0, EM_SNOW, em) # snow
+    return em
+
+def compute_lst(tb, em, tpw_position, satellite_coefficients):
+    a = satellite_coefficients['A'][tpw_position]
+    b = satellite_coefficients['B'][tpw_position]
+    c = satellite_coefficients['C'][tpw_position]
+    return a * tb / em + b / em + c
+
+def read_bands(src, band_index, window):
+    def read(name):
+        if name not in band_index:
+            return None
+        return read_decoded(src, band_index[name], window)
+    return read
+
+def missing_bands(band_names):
+    """
+    the inputs of process_window absent from the band names, the emissivity comes from EM or from EM_bare with NDVI or FVC
+    """
+    missing = [band for band in ['B10', 'TPW'] if band not in band_names]
+    if 'EM' not in band_names and not ('EM_bare' in band_names and ('NDVI' in band_names or 'FVC' in band_names)):
+        missing.append('EM or EM_bare with NDVI')
+    return missing
+
+def process_window(read, satellite_coefficients):
+    tb = read('B10')
+    ndvi = read('NDVI')
+    fvc = compute_fvc(ndvi) if ndvi is not None else read('FVC')
+    em_bare = read('EM_bare')
+    if em_bare is not None and fvc is not None:
+        qa = read('QA_PIXEL')
+        qa = None if qa is None else np.nan_to_num(qa).astype(np.uint16)
+        em = compute_emissivity(fvc, em_bare, satellite_coefficients['em_veg'], qa)
+    else:
+        em = read('EM') # no bare soil emissivity exported, keep the emissivity of ee_lst
+    tpw = read('TPW')
+    tpw_position = compute_tpw_position(np.nan_to_num(tpw))
+    lst = compute_lst(tb, em, tpw_position, satellite_coefficients)
+    lst[np.isnan(tb) | np.isnan(em) | np.isnan(tpw)] = np.nan
+    return lst.astype(np.float32)
+
+def process_scene(src_path, dst_path, satellite, coefficients):
+    """
+    compute the lst of one exported band stack window by window, memory is bounded by the block size
+    """
+    satellite_coefficients = coefficients[satellite]
+    with rasterio.open(src_path) as src:
+        band_index = {name: index for index, name in enumerate(src.descriptions, start=1) if name}
+        missing = missing_bands(band_index)
+        if missing:
+            raise ValueError(f"{src_path} has no {', '.join(missing)}, export it with the 'recompute' or 'full' EXPORT_PROFILE")
+        profile = src.profile.copy()
+        profile.update(count=1, dtype='float32', nodata=np.nan, driver='GTiff',
+                       tiled=True, blockxsize=512, blockysize=512, compress='deflate', predictor=3, BIGTIFF='IF_SAFER')
+        temp_path = dst_path + '.part'
+        with rasterio.open(temp_path, 'w', **profile) as dst:
+            dst.set_band_description(1, 'LST')
+            for _, window in dst.block_windows(1):
+                dst.write(process_window(read_bands(src, band_index, window), satellite_coefficients), 1, window=window)
+    os.replace(temp_path, dst_path)
+    return dst_path
+
+def reprocess_scenes(scene_list, output_path, coefficients, max_workers=None):
+    """
+    recompute the lst of (file path, satellite) scenes on a process pool
+    """
+    os.makedirs(output_path, exist_ok=True)
+    finished = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_scene, src_path, os.path.join(output_path, os.path.basename(src_path)), satellite, coefficients): src_path
+            for src_path, satellite in scene_list
+        }
+        for future in as_completed(futures):
+            try:
+                finished.append(future.result())
+                logging.info(f"{futures[future]} reprocessed")
+            except Exception as e:
+                logging.error(f"{futures[future]} failed to reprocess: {e}")
+    return finished
+
+def list_downloaded_scenes(save_path):
+    """
+    return (file path, satellite) of the downloaded scenes whose satellite is known by the job ledger
+    """
+    satellites = monitor.load_completed_satellites()
+    scene_list = []
+    for file_name in sorted(os.listdir(save_path)):
+        matched = DOWNLOAD_FILE_PATTERN.match(file_name)
+        if matched is None:
+            continue
+        description = f"{matched.group('city')}Landsat{matched.group('year')}{matched.group('month')}"
+        if description in satellites:
+            scene_list.append((os.path.join(save_path, file_name), satellites[description]))
+    return scene_list
+
+def __main__():
+    load_dotenv()
+    scene_list = list_downloaded_scenes(os.getenv('IMAGE_SAVE_PATH'))
+    reprocess_scenes(scene_list, os.getenv('LST_REPROCESS_PATH'), load_coefficients())
+
+if __name__ == '__main__':
+    __main__()
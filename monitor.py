@@ -1,63 +1,316 @@
-import time
+import json
 import logging
 import os
-from multiprocessing import Lock
+import sqlite3
+import telemetry
+from contextlib import closing
 from datetime import datetime, timedelta
 
-def file_is_occupied(file_name):
-    """
-    check if the record file is occupied by other process
-    """
-    try:
-        with open(file_name, 'r') as f:
-            f.readlines()
-        return False
-    except IOError:
-        return True
-    except Exception as e:
-        logging.error(f"error to check if file {file_name} is occupied: {e}")
-        raise e
-
-
-def is_process_counter_exceed_limit():
-    process_list_file_name = os.getenv('PROCESS_MONITOR_FILE_PATH')
-    while (file_is_occupied(process_list_file_name)):
-        time.sleep(1)
-    try:
-        with open(process_list_file_name, 'r') as f:
-            process_list = f.readlines()
-    except Exception as e:
-        logging.error(f"error to check process counter: {e}")
-        raise e
-    return len(process_list) > 100
-
-def add_process(process):
-    process_list_file_name = os.getenv('PROCESS_MONITOR_FILE_PATH')
-    try:
-        with Lock():
-            while (file_is_occupied(process_list_file_name)):
-                time.sleep(1)
-            with open(process_list_file_name, 'a') as f:
-                f.write(f'{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}-{process.pid}:{process.name}\n')
-    except Exception as e:
-        logging.error(f"error to add process: {e}")
-        raise e
-
-def remove_process(process_name):
-    process_list_file_name = os.getenv('PROCESS_MONITOR_FILE_PATH')
-    try:
-        with Lock():
-            while (file_is_occupied(process_list_file_name)):
-                time.sleep(1)
-            with open(process_list_file_name, 'r') as f:
-                process_list = f.readlines()
-            process_list = [line for line in process_list if line.split(':')[1].strip() != process_name]
-            with open(process_list_file_name, 'w') as f:
-                f.writelines(process_list)
-    except Exception as e:
-        logging.error(f"error to remove process: {e}")
-        raise e
-    
+IN_FLIGHT_STATES = ('CLAIMED', 'SUBMITTED')
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    city TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    satellite TEXT NOT NULL,
+    description TEXT,
+    task_id TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (city, year, month, satellite)
+);
+CREATE INDEX IF NOT EXISTS jobs_description ON jobs(description);
+CREATE INDEX IF NOT EXISTS jobs_task_id ON jobs(task_id);
+CREATE TABLE IF NOT EXISTS job_tiles (
+    description TEXT NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_col INTEGER NOT NULL,
+    task_id TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    export_params TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (description, tile_row, tile_col)
+);
+CREATE INDEX IF NOT EXISTS job_tiles_task_id ON job_tiles(task_id);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters VALUES ('in_flight', 0);
+CREATE TRIGGER IF NOT EXISTS jobs_in_flight_insert AFTER INSERT ON jobs
+WHEN NEW.state IN ('CLAIMED', 'SUBMITTED')
+BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'in_flight';
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_in_flight_update AFTER UPDATE OF state ON jobs
+BEGIN
+    UPDATE counters
+    SET value = value + (NEW.state IN ('CLAIMED', 'SUBMITTED')) - (OLD.state IN ('CLAIMED', 'SUBMITTED'))
+    WHERE name = 'in_flight';
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_in_flight_delete AFTER DELETE ON jobs
+WHEN OLD.state IN ('CLAIMED', 'SUBMITTED')
+BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'in_flight';
+END;
+"""
+
+def now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def connect():
+    """
+    open a connection to the job ledger, every thread uses its own connection
+    """
+    ledger_file_path = os.getenv('JOB_LEDGER_FILE_PATH')
+    conn = sqlite3.connect(ledger_file_path, timeout=60, isolation_level=None)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def init_ledger():
+    """
+    create the ledger and release the claims left by an interrupted run
+    """
+    with closing(connect()) as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(LEDGER_SCHEMA)
+        tile_columns = [column for _, column, *_ in conn.execute('PRAGMA table_info(job_tiles)')]
+        if 'export_params' not in tile_columns: # ledgers created before the tiles could be restarted from it
+            conn.execute('ALTER TABLE job_tiles ADD COLUMN export_params TEXT')
+        conn.execute("UPDATE jobs SET state = 'FAILED', last_error = 'interrupted', updated_at = ? WHERE state = 'CLAIMED'", (now(),))
+
+def claim_job(city, year, month, max_in_flight=None):
+    """
+    atomically claim the month before its scene search, the claim row has satellite NONE until
+    assign_job_satellite. return False if the month is running or finished already, None if
+    max_in_flight jobs are in flight, the limit is checked in the same transaction as the claim
+    """
+    with closing(connect()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            states = [state for state, in conn.execute('SELECT state FROM jobs WHERE city = ? AND year = ? AND month = ?',
+                                                       (city, year, month))]
+            if any(state in IN_FLIGHT_STATES or state == 'COMPLETED' for state in states):
+                conn.execute('ROLLBACK')
+                return False
+            in_flight = conn.execute("SELECT value FROM counters WHERE name = 'in_flight'").fetchone()[0]
+            if max_in_flight is not None and in_flight >= max_in_flight:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute("""
+                INSERT INTO jobs (city, year, month, satellite, state, attempts, created_at, updated_at)
+                VALUES (?, ?, ?, 'NONE', 'CLAIMED', 1, ?, ?)
+                ON CONFLICT (city, year, month, satellite)
+                DO UPDATE SET state = 'CLAIMED', attempts = attempts + 1, last_error = NULL, updated_at = excluded.updated_at
+            """, (city, year, month, now(), now()))
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+def assign_job_satellite(city, year, month, satellite):
+    """
+    move the claim of the month to the satellite whose scene was found, an earlier failed row of the satellite is merged into it
+    """
+    with closing(connect()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT attempts FROM jobs WHERE city = ? AND year = ? AND month = ? AND satellite = ?',
+                               (city, year, month, satellite)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM jobs WHERE city = ? AND year = ? AND month = ? AND satellite = ?', (city, year, month, satellite))
+            conn.execute("""
+                UPDATE jobs SET satellite = ?, attempts = attempts + ?, updated_at = ?
+                WHERE city = ? AND year = ? AND month = ? AND satellite = 'NONE' AND state = 'CLAIMED'
+            """, (satellite, 0 if row is None else row[0], now(), city, year, month))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+def submit_job(city, year, month, satellite, task_id, description):
+    with closing(connect()) as conn:
+        conn.execute("""
+            UPDATE jobs SET state = 'SUBMITTED', task_id = ?, description = ?, updated_at = ?
+            WHERE city = ? AND year = ? AND month = ? AND satellite = ?
+        """, (task_id, description, now(), city, year, month, satellite))
+
+def release_job(city, year, month, satellite, error):
+    """
+    give back a claim whose export could not be started
+    """
+    with closing(connect()) as conn:
+        conn.execute("""
+            UPDATE jobs SET state = 'FAILED', last_error = ?, updated_at = ?
+            WHERE city = ? AND year = ? AND month = ? AND satellite = ?
+        """, (str(error), now(), city, year, month, satellite))
+
+def complete_job(description):
+    with closing(connect()) as conn:
+        conn.execute("UPDATE jobs SET state = 'COMPLETED', updated_at = ? WHERE description = ? AND state = 'SUBMITTED'",
+                     (now(), description))
+
+def fail_job(description, error):
+    with closing(connect()) as conn:
+        conn.execute("UPDATE jobs SET state = 'FAILED', last_error = ?, updated_at = ? WHERE description = ? AND state = 'SUBMITTED'",
+                     (str(error), now(), description))
+
+def record_search_result(city, year, month, state, error):
+    """
+    record a month whose scene search ended without export, EMPTY if no scene is under the cloud threshold,
+    this also releases the claim of the month
+    """
+    with closing(connect()) as conn:
+        conn.execute("""
+            INSERT INTO jobs (city, year, month, satellite, state, attempts, last_error, created_at, updated_at)
+            VALUES (?, ?, ?, 'NONE', ?, 1, ?, ?, ?)
+            ON CONFLICT (city, year, month, satellite)
+            DO UPDATE SET state = excluded.state, attempts = attempts + (jobs.state != 'CLAIMED'),
+                          last_error = excluded.last_error, updated_at = excluded.updated_at
+        """, (city, year, month, state, str(error), now(), now()))
+
+def load_job_states():
+    """
+    return {(city, year, month): [(satellite, state, attempts, last error)]}
+    """
+    job_states = {}
+    with closing(connect()) as conn:
+        for city, year, month, satellite, state, attempts, last_error in conn.execute(
+                'SELECT city, year, month, satellite, state, attempts, last_error FROM jobs'):
+            job_states.setdefault((city, year, month), []).append((satellite, state, attempts, last_error))
+    return job_states
+
+def load_completed_satellites():
+    """
+    return {task description: satellite} of the downloaded jobs
+    """
+    with closing(connect()) as conn:
+        rows = conn.execute("SELECT description, satellite FROM jobs WHERE state = 'COMPLETED'").fetchall()
+    return dict(rows)
+
+def job_satellite(description):
+    """
+    return the satellite of the downloaded job, None if unknown
+    """
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT satellite FROM jobs WHERE description = ? AND state = 'COMPLETED'", (description,)).fetchone()
+    return None if row is None else row[0]
+
+def job_labels(description):
+    """
+    return {'city', 'year', 'month', 'satellite'} of the job, the keys of its telemetry spans, {} if unknown
+    """
+    with closing(connect()) as conn:
+        row = conn.execute('SELECT city, year, month, satellite FROM jobs WHERE description = ?', (description,)).fetchone()
+    return {} if row is None else dict(zip(['city', 'year', 'month', 'satellite'], row))
+
+def count_in_flight():
+    with closing(connect()) as conn:
+        return conn.execute("SELECT value FROM counters WHERE name = 'in_flight'").fetchone()[0]
+
+def list_submitted_jobs():
+    """
+    return {task id: task description} of the jobs and tiles waiting for export or download
+    """
+    with closing(connect()) as conn:
+        rows = conn.execute("SELECT task_id, description FROM jobs WHERE state = 'SUBMITTED' AND task_id IS NOT NULL").fetchall()
+        tile_rows = conn.execute("SELECT task_id, description, tile_row, tile_col FROM job_tiles WHERE state = 'SUBMITTED'").fetchall()
+    submitted_jobs = dict(rows)
+    for task_id, description, row, col in tile_rows:
+        submitted_jobs[task_id] = f'{description}_r{row}c{col}'
+    return submitted_jobs
+
+def register_tiles(description, tiles, export_params=None):
+    """
+    add the grid tiles of a job, the tiles downloaded by an earlier attempt stay COMPLETED.
+    export_params and the bounds of every tile are kept so a failed tile can be exported again by another process
+
+    Args:
+        tiles: [(row, col, [west, south, east, north])]
+        export_params: {'folder', 'satellite', 'date'} of the export
+    """
+    rows = []
+    for row, col, bounds in tiles:
+        params = None if export_params is None else json.dumps(dict(export_params, bounds=bounds))
+        rows.append((description, row, col, params, now()))
+    with closing(connect()) as conn:
+        conn.executemany("""
+            INSERT INTO job_tiles (description, tile_row, tile_col, state, export_params, updated_at) VALUES (?, ?, ?, 'PENDING', ?, ?)
+            ON CONFLICT (description, tile_row, tile_col) DO UPDATE SET export_params = excluded.export_params
+        """, rows)
+
+def load_tile_export(description, row, col):
+    """
+    return the export_params of the tile with its bounds, None if the tile was registered without them
+    """
+    with closing(connect()) as conn:
+        found = conn.execute("SELECT export_params FROM job_tiles WHERE description = ? AND tile_row = ? AND tile_col = ?",
+                             (description, row, col)).fetchone()
+    if found is None or found[0] is None:
+        return None
+    return json.loads(found[0])
+
+def load_completed_tiles(description):
+    with closing(connect()) as conn:
+        rows = conn.execute("SELECT tile_row, tile_col FROM job_tiles WHERE description = ? AND state = 'COMPLETED'",
+                            (description,)).fetchall()
+    return set(rows)
+
+def submit_tile(description, row, col, task_id):
+    with closing(connect()) as conn:
+        conn.execute("""
+            UPDATE job_tiles SET state = 'SUBMITTED', task_id = ?, attempts = attempts + 1, last_error = NULL, updated_at = ?
+            WHERE description = ? AND tile_row = ? AND tile_col = ?
+        """, (task_id, now(), description, row, col))
+
+def fail_tile(description, row, col, error):
+    """
+    return the number of attempts of the failed tile
+    """
+    with closing(connect()) as conn:
+        conn.execute("UPDATE job_tiles SET state = 'FAILED', last_error = ?, updated_at = ? WHERE description = ? AND tile_row = ? AND tile_col = ?",
+                     (str(error), now(), description, row, col))
+        return conn.execute("SELECT attempts FROM job_tiles WHERE description = ? AND tile_row = ? AND tile_col = ?",
+                            (description, row, col)).fetchone()[0]
+
+def complete_tile(description, row, col):
+    """
+    return the number of tiles of the job still to download, only the last finished tile sees 0
+    """
+    with closing(connect()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("UPDATE job_tiles SET state = 'COMPLETED', updated_at = ? WHERE description = ? AND tile_row = ? AND tile_col = ?",
+                     (now(), description, row, col))
+        remaining = conn.execute("SELECT COUNT(*) FROM job_tiles WHERE description = ? AND state != 'COMPLETED'",
+                                 (description,)).fetchone()[0]
+        conn.execute('COMMIT')
+    return remaining
+
+def max_in_flight():
+    return int(os.getenv('MAX_IN_FLIGHT_TASKS', 100))
+
+SLOT_WAIT_SECONDS = 30
+
+def claim_job_slot(city, year, month, gap = None):
+    """
+    claim the month, blocking while the number of in-flight jobs is at the limit. return False if
+    the month is running or finished already
+    """
+    gap = gap or SLOT_WAIT_SECONDS
+    while True:
+        claimed = claim_job(city, year, month, max_in_flight())
+        if claimed is not None:
+            return claimed
+        logging.info(f"in-flight jobs exceed limit, wait for {gap} seconds")
+        telemetry.sleep(gap, 'wait_for_slot')
+
 def check_and_refresh_token(gauth):
     if gauth.credentials.refresh_token is None:
         raise Exception('refresh token is None')
@@ -65,4 +318,4 @@ def check_and_refresh_token(gauth):
     if delta_time < 300:
         gauth.Refresh()
         gauth.SaveCredentialsFile(os.getenv('CREDENTIALS_FILE_PATH'))
-        logging.info(f"token current expires in: {gauth.credentials.token_expiry}")
\ No newline at end of file
+        logging.info(f"token current expires in: {gauth.credentials.token_expiry}")
@@ -0,0 +1,111 @@
+import os
+import re
+import logging
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.shutil import copy as raster_copy
+from dotenv import load_dotenv
+from export_grid import parse_tile_description
+from export_profile import get_export_profile, tag_export_profile
+
+TILE_FILE_PATTERN = re.compile(r'^(?P<description>.+)-(?P<row>\d+)-(?P<col>\d+)\.tif$')
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+
+def group_tiles(file_list):
+    """
+    return {description: [tile path]} of the sharded exports in file_list
+    """
+    groups = {}
+    for file_path in file_list:
+        matched = TILE_FILE_PATTERN.match(os.path.basename(file_path))
+        if matched is not None:
+            groups.setdefault(matched.group('description'), []).append(file_path)
+    return groups
+
+def mosaic_profile(tile_paths, block_size):
+    """
+    gee cuts the tiles from one pixel grid, the mosaic is the union of their bounds on that grid
+    """
+    lefts, bottoms, rights, tops = [], [], [], []
+    for tile_path in tile_paths:
+        with rasterio.open(tile_path) as tile:
+            lefts.append(tile.bounds.left)
+            bottoms.append(tile.bounds.bottom)
+            rights.append(tile.bounds.right)
+            tops.append(tile.bounds.top)
+            profile = tile.profile.copy()
+            descriptions = tile.descriptions
+            res_x, res_y = tile.res
+    left, top = min(lefts), max(tops)
+    width = round((max(rights) - left) / res_x)
+    height = round((top - min(bottoms)) / res_y)
+    transform = rasterio.Affine(res_x, 0, left, 0, -res_y, top)
+    profile.update(driver='GTiff', width=width, height=height, transform=transform,
+                   tiled=True, blockxsize=block_size, blockysize=block_size, compress='deflate', BIGTIFF='IF_SAFER')
+    return profile, descriptions
+
+def mosaic_tiles(tile_paths, dst_path, block_size=512, overview_factors=OVERVIEW_FACTORS, export_profile=None):
+    """
+    copy the tiles block by block into one cloud optimized geotiff with overviews, memory is bounded by the block size.
+    the tags of the export profile are written before the COG is created
+    """
+    profile, descriptions = mosaic_profile(tile_paths, block_size)
+    temp_path = dst_path + '.part'
+    with rasterio.open(temp_path, 'w', **profile) as dst:
+        for index, description in enumerate(descriptions, start=1):
+            if description:
+                dst.set_band_description(index, description)
+        tag_export_profile(dst, export_profile)
+        for tile_path in tile_paths:
+            with rasterio.open(tile_path) as tile:
+                row_off = round((dst.bounds.top - tile.bounds.top) / tile.res[1])
+                col_off = round((tile.bounds.left - dst.bounds.left) / tile.res[0])
+                for _, window in tile.block_windows(1):
+                    target = Window(window.col_off + col_off, window.row_off + row_off, window.width, window.height)
+                    dst.write(tile.read(window=window), window=target)
+        dst.build_overviews(overview_factors, Resampling.average)
+    cog_path = dst_path + '.cog'
+    raster_copy(temp_path, cog_path, driver='COG', blocksize=block_size, compress='DEFLATE', overviews='FORCE_USE_EXISTING', BIGTIFF='IF_SAFER')
+    os.remove(temp_path)
+    os.replace(cog_path, dst_path)
+    return dst_path
+
+def mosaic_export(file_list, save_path, remove_tiles=True, export_profile=None):
+    """
+    replace the tiles of a sharded export by <description>.tif, single file exports are left as they are
+    """
+    mosaics = []
+    for description, tile_paths in group_tiles(file_list).items():
+        dst_path = os.path.join(save_path, f'{description}.tif')
+        logging.info(f"mosaic {len(tile_paths)} tiles of {description}")
+        mosaic_tiles(sorted(tile_paths), dst_path, export_profile=export_profile)
+        if remove_tiles:
+            for tile_path in tile_paths:
+                os.remove(tile_path)
+        mosaics.append(dst_path)
+    return mosaics
+
+def assemble_grid_tiles(description, tiles_path, save_path, export_profile=None):
+    """
+    merge the downloaded grid tiles of the job into <description>.tif and remove them
+    """
+    tile_paths = []
+    for file_name in os.listdir(tiles_path):
+        tile = parse_tile_description(os.path.splitext(file_name)[0])
+        if file_name.endswith('.tif') and tile is not None and tile[0] == description:
+            tile_paths.append(os.path.join(tiles_path, file_name))
+    logging.info(f"assemble {len(tile_paths)} grid tiles of {description}")
+    dst_path = mosaic_tiles(sorted(tile_paths), os.path.join(save_path, f'{description}.tif'), export_profile=export_profile)
+    for tile_path in tile_paths:
+        os.remove(tile_path)
+    return dst_path
+
+def __main__():
+    load_dotenv()
+    save_path = os.getenv('IMAGE_SAVE_PATH')
+    file_list = [os.path.join(save_path, file_name) for file_name in os.listdir(save_path)]
+    mosaic_export(file_list, save_path, export_profile=get_export_profile())
+
+if __name__ == '__main__':
+    __main__()
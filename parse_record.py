@@ -1,118 +1,126 @@
 import pandas as pd
 import os
+from functools import lru_cache
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import PatternFill,Font
+from openpyxl.formatting.rule import FormulaRule
 from dotenv import load_dotenv
 import ee
+from info_batcher import evaluate, evaluate_all
+from record_writer import query_records
+
+PROPERTY_LIST = ['toa_image_porpotion','sr_image_porpotion','toa_cloud_ratio','sr_cloud_ratio']
 
 def date_line(year):
     month = list(range(1, 13))
     return [year] + month
 
-def parse_record(file_path, start_year=1985, end_year=2024):
-    file_dir = os.path.dirname(file_path)
-    df = pd.read_csv(file_path)
-    df = df.sort_values(by=['city', 'year', 'month'])
-    city_list = df['city'].unique()
+def pivot_record(df, start_year, end_year):
+    """
+    pivot the record to one row per (city, year, property) and one column per month
+    """
+    df = df.drop_duplicates(subset=['city', 'year', 'month'], keep='last')
+    long_df = df.melt(id_vars=['city', 'year', 'month'], value_vars=PROPERTY_LIST, var_name='property')
+    table = long_df.set_index(['city', 'year', 'property', 'month'])['value'].unstack('month')
+    full_index = pd.MultiIndex.from_product(
+        [df['city'].unique(), range(start_year, end_year+1), PROPERTY_LIST],
+        names=['city', 'year', 'property'])
+    return table.reindex(index=full_index, columns=range(1, 13))
 
-    total_year = range(start_year, end_year+1)
+def city_rows(city_table, start_year, end_year):
+    """
+    yield the year line followed by one line per property for every year
+    """
+    values = city_table.astype(object).where(city_table.notna(), '/').to_numpy()
+    property_num = len(PROPERTY_LIST)
+    for index, year in enumerate(range(start_year, end_year+1)):
+        yield date_line(year)
+        for pid, pro in enumerate(PROPERTY_LIST):
+            yield [pro] + list(values[index * property_num + pid])
+
+def add_quality_rules(sheet, max_row):
+    """
+    colour the cloud ratio and image cover lines with sheet level conditional formatting
+    """
     cloud_high_color = Font(color='FF0000')
     cloud_median_color = Font(color='0000FF')
     cloud_low_color = PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid') # green for low cloud
     cover_high_color = PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid') # green for high cover
     cover_low_color = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid') # yellow for low cover
-    note_city = Workbook()
-    note_city.remove(note_city['Sheet'])
-    for city in city_list:
-        this_city_data = df[df['city'] == city]
+    cell_range = f'B1:M{max_row}'
+    is_cloud = 'RIGHT($A1,11)="cloud_ratio",ISNUMBER(B1)'
+    is_cover = 'RIGHT($A1,15)="image_porpotion",ISNUMBER(B1)'
+    sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'AND({is_cloud},B1>10)'], font=cloud_high_color, stopIfTrue=True))
+    sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'AND({is_cloud},B1<5)'], fill=cloud_low_color, stopIfTrue=True))
+    sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'AND({is_cloud})'], font=cloud_median_color, stopIfTrue=True))
+    sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'AND({is_cover},B1<0.9)'], fill=cover_low_color, stopIfTrue=True))
+    sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'AND({is_cover})'], fill=cover_high_color, stopIfTrue=True))
+
+def parse_record(file_path, start_year=1985, end_year=2024):
+    file_dir = os.path.dirname(file_path)
+    df = query_records(file_path)
+    df = df.sort_values(by=['city', 'year', 'month'], kind='stable')
+    table = pivot_record(df, start_year, end_year)
+
+    note_city = Workbook(write_only=True)
+    for city in df['city'].unique():
         file_name = f"records/{city}.csv"
         note_city_ws = note_city.create_sheet(title=city)
-        current_row = 1  # 添加行追踪器
         os.makedirs(os.path.dirname(file_name), exist_ok=True)
         print(f'executing {city}')
+        row_num = 0
         with open(file_name, "w", newline='', encoding='utf-8') as f:
-            for index, year in enumerate(total_year):
-                print(f'executing {year}')
-                f.write(','.join(map(str, date_line(year))) + '\n')
-                note_city_ws.append(date_line(year))
-                current_year_data = this_city_data[this_city_data['year'] == year]
-                property_list = ['toa_image_porpotion','sr_image_porpotion','toa_cloud_ratio','sr_cloud_ratio']
-                for pid, pro in enumerate(property_list):
-                    value_list = ['/'] * 12
-                    for index, row in current_year_data.iterrows():
-                        value_list[row['month']-1] = row[pro]
-                    row_line = [pro] + value_list
-                    note_city_ws.append(row_line)
-                    # change color of cloud ratio
-                    if pro in ['toa_cloud_ratio', 'sr_cloud_ratio']:
-                        for i in range(1, 13):
-                            if row_line[i] != '/':
-                                if float(row_line[i]) > 10:
-                                    note_city_ws.cell(column=i+1, row=current_row+pid+1).font = cloud_high_color
-                                elif float(row_line[i]) < 5:
-                                    note_city_ws.cell(column=i+1, row=current_row+pid+1).fill = cloud_low_color
-                                else:
-                                    note_city_ws.cell(column=i+1, row=current_row+pid+1).font = cloud_median_color
-                    elif pro in ['toa_image_porpotion', 'sr_image_porpotion']:
-                        for i in range(1, 13):
-                            if row_line[i] != '/':
-                                if float(row_line[i]) < 0.9:
-                                    note_city_ws.cell(column=i+1, row=current_row+pid+1).fill = cover_low_color
-                                else:
-                                    note_city_ws.cell(column=i+1, row=current_row+pid+1).fill = cover_high_color
-
-                    f.write(','.join(map(str, row_line)) + '\n')
-                current_row += 5  # 每年的数据占用5行（1行年份+4行属性）
+            for row_line in city_rows(table.loc[city], start_year, end_year):
+                f.write(','.join(map(str, row_line)) + '\n')
+                note_city_ws.append(row_line)
+                row_num += 1 # 每年的数据占用5行（1行年份+4行属性）
+        add_quality_rules(note_city_ws, row_num)
     note_city.save(os.path.join(file_dir, 'city_quality_records.xlsx'))
 
+@lru_cache(maxsize=1)
 def get_geo_boundary():
     load_dotenv()
     project_name = os.getenv('PROJECT_NAME')
     ee.Initialize(project=project_name)
 
     asset_path = 'projects/ee-channingtong/assets/'
-    total_boundary = ee.FeatureCollection(asset_path + 'YZBboundary')
-    geo_boundary_dict = {}
-    for city_boundary in total_boundary.getInfo()['features']:
-        city_name = city_boundary['properties']['市名']
-        city_outbound = ee.Geometry(city_boundary['geometry']).bounds().getInfo()
-        geo_boundary_dict[city_name] = city_outbound
+    total_boundary = evaluate(ee.FeatureCollection(asset_path + 'YZBboundary'))
+    city_list = [city_boundary['properties']['市名'] for city_boundary in total_boundary['features']]
+    city_outbounds = evaluate_all([ee.Geometry(city_boundary['geometry']).bounds() for city_boundary in total_boundary['features']])
+    geo_boundary_dict = dict(zip(city_list, city_outbounds))
 
     return geo_boundary_dict
 
+def scan_tagged_records(tag_file_path, start_year, end_year):
+    """
+    yield (city, year, month) of the filled month cells in the year lines of the tag workbook
+    """
+    year_num = end_year - start_year + 1
+    workbook = load_workbook(tag_file_path, read_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            for row_index, row in enumerate(sheet.iter_rows(max_row=year_num * 5, max_col=13)):
+                if row_index % 5 != 0: # only the year line is tagged
+                    continue
+                year = start_year + row_index // 5
+                for month, cell in enumerate(row[1:13], start=1):
+                    fill = getattr(cell, 'fill', None)
+                    if fill is not None and fill.start_color.index != "00000000":
+                        yield (sheet.title, year, month)
+    finally:
+        workbook.close()
+
 def reverse_parse_record(tag_file_path, raw_file_path, start_year=1985, end_year=2024):
-    workbook = load_workbook(tag_file_path)
-    year_list = list(range(start_year, end_year+1))
-    month_list = list(range(1, 13))
-    valid_records = []
-    for sheet_name in workbook.sheetnames:
-        sheet = workbook[sheet_name]
-        for year in year_list:
-            row = 1 + (year - start_year) * 5
-            for month in month_list:
-                cell = sheet.cell(row=row, column=month+1)
-                if cell.fill.start_color.index != "00000000":
-                    valid_records.append((sheet_name,year, month))
+    valid_records = pd.DataFrame(list(scan_tagged_records(tag_file_path, start_year, end_year)), columns=['city', 'year', 'month'])
+    valid_records = valid_records.astype({'year': int, 'month': int})
 
-    raw_data = pd.read_csv(raw_file_path)
+    raw_data = pd.read_csv(raw_file_path, usecols=['city', 'year', 'month', 'day'])
+    raw_data = raw_data.drop_duplicates(subset=['city', 'year', 'month'], keep='last') # last write wins, like the record index
     geo_boundary_dict = get_geo_boundary()
 
-    output_df = pd.DataFrame(columns=['city', 'year', 'month', 'day', 'geometry'])
-    for record in valid_records:
-        str_string = f"{record[0]},{record[1]},{record[2]}"
-        for row in raw_data.iterrows():
-            row_data = row[1]
-            identify = f"{row_data['city']},{row_data['year']},{row_data['month']}"
-            if str_string == identify:
-                output_df.loc[len(output_df)] = {
-                    'city': row_data['city'],
-                    'year': row_data['year'],
-                    'month': row_data['month'],
-                    'day': row_data['day'],
-                    'geometry': geo_boundary_dict[row_data['city']]
-                }
-                print(f"added {record[0]},{record[1]},{record[2]}")
-                break
+    output_df = valid_records.merge(raw_data, on=['city', 'year', 'month'], how='inner')
+    output_df['geometry'] = output_df['city'].map(geo_boundary_dict)
+    print(f"added {len(output_df)} of {len(valid_records)} tagged records")
     # output as json file using pandas
     output_df.to_json('remote_sensing_record.json', orient='records', lines=True, force_ascii=False)
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,230 @@
+import ee
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import rate_limit
+import telemetry
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from shapely.geometry import shape, mapping
+from boundary_cache import load_cached_city_boundaries
+from landsat_lst_image import CLOUD_THRESHOLD, MAP_LAYERS, scene_day_image
+from scene_index import query_scenes
+
+SIMPLIFY_DEGREES = 0.001 # about 100 m, plenty for an outline drawn over 30 m tiles
+COORDINATE_DIGITS = 5
+MAP_ID_TTL = 12 * 3600 # earth engine tile urls stop working after a while, older map ids are requested again
+
+class MapIdCache:
+    """
+    tile url of every (image, visualization parameters), kept in a json file between runs
+    """
+    def __init__(self, cache_file_path, ttl=MAP_ID_TTL):
+        self.cache_file_path = cache_file_path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(cache_file_path):
+            with open(cache_file_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or time.time() - entry['created'] > self.ttl:
+            return None
+        return entry['url']
+
+    def put(self, key, url):
+        with self.lock:
+            self.entries[key] = {'url': url, 'created': time.time()}
+
+    def save(self):
+        with self.lock:
+            entries = dict(self.entries)
+        temp_file_path = self.cache_file_path + '.tmp'
+        with open(temp_file_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(temp_file_path, self.cache_file_path)
+
+def map_id_key(scene, city_code, layer):
+    """
+    the image of a preview is rebuilt from these, so they identify its tiles
+    """
+    band, vis_params, _ = MAP_LAYERS[layer]
+    identity = {'satellite': scene['satellite'], 'date': scene['date'], 'city_code': city_code,
+                'cloud_threshold': CLOUD_THRESHOLD, 'band': band, 'vis': vis_params}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def round_coordinates(coordinates):
+    if isinstance(coordinates[0], (int, float)):
+        return [round(value, COORDINATE_DIGITS) for value in coordinates]
+    return [round_coordinates(part) for part in coordinates]
+
+def simplify_boundary(geojson, tolerance=SIMPLIFY_DEGREES):
+    """
+    return (simplified geojson, [lat, lon] of the centroid), computed locally
+    """
+    geometry = shape(geojson)
+    simplified = mapping(geometry.simplify(tolerance, preserve_topology=True))
+    centroid = geometry.centroid
+    return {'type': simplified['type'], 'coordinates': round_coordinates(simplified['coordinates'])}, \
+        [round(centroid.y, COORDINATE_DIGITS), round(centroid.x, COORDINATE_DIGITS)]
+
+def fetch_tile_url(image, layer):
+    band, vis_params, _ = MAP_LAYERS[layer]
+    map_id_dict = rate_limit.call('getinfo', image.select(band).getMapId, vis_params)
+    return map_id_dict['tile_fetcher'].url_format
+
+def preview_entry(map_ids, city_boundary, scene, layer):
+    key = map_id_key(scene, city_boundary['city_code'], layer)
+    url = map_ids.get(key)
+    if url is None:
+        with telemetry.span('map_id', job=scene['description'], layer=layer):
+            image = scene_day_image(scene['satellite'], scene['date'], ee.Geometry(city_boundary['city_geometry']), CLOUD_THRESHOLD, True)
+            url = fetch_tile_url(image, layer)
+        map_ids.put(key, url)
+    return {'title': f"{scene['city']} {scene['date']} {scene['satellite']}", 'city': scene['city'],
+            'year': int(scene['year']), 'city_code': city_boundary['city_code'], 'url': url}
+
+def build_gallery(scenes, city_boundaries, gallery_path, layer='LST', max_workers=8):
+    """
+    write one index.html previewing every scene, the map ids are requested concurrently and cached,
+    each city outline is simplified and written once, the maps are created when scrolled into view
+
+    Args:
+        scenes: dataframe of scene_index.query_scenes
+        city_boundaries: records of boundary_cache
+    """
+    if layer not in MAP_LAYERS:
+        raise ValueError(f"layer should be one of {list(MAP_LAYERS)}")
+    os.makedirs(gallery_path, exist_ok=True)
+    boundaries = {city_boundary['city_name']: city_boundary for city_boundary in city_boundaries}
+    scene_list = [scene for scene in scenes.to_dict('records') if scene['city'] in boundaries and pd.notna(scene['date'])]
+    if len(scene_list) < len(scenes):
+        logging.warning(f"{len(scenes) - len(scene_list)} scenes without a date or a city boundary are skipped")
+    outlines = {}
+    for city_name in sorted({scene['city'] for scene in scene_list}):
+        city_boundary = boundaries[city_name]
+        outline, center = simplify_boundary(city_boundary['city_geometry'])
+        outlines[city_boundary['city_code']] = {'geometry': outline, 'center': center}
+
+    map_ids = MapIdCache(os.getenv('PREVIEW_MAP_ID_CACHE_PATH') or os.path.join(gallery_path, 'map_ids.json'))
+    entries = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preview') as executor:
+            futures = [executor.submit(preview_entry, map_ids, boundaries[scene['city']], scene, layer) for scene in scene_list]
+            for scene, future in zip(scene_list, futures):
+                try:
+                    entries.append(future.result())
+                except Exception as e:
+                    logging.error(f"{scene['description']} failed to be previewed: {e}")
+    finally:
+        map_ids.save()
+
+    _, vis_params, layer_name = MAP_LAYERS[layer]
+    index_file_path = os.path.join(gallery_path, 'index.html')
+    with open(index_file_path, 'w', encoding='utf-8') as f:
+        f.write(GALLERY_TEMPLATE.replace('__LAYER__', layer_name).replace('__DATA__', json.dumps(
+            {'entries': entries, 'outlines': outlines, 'vis': vis_params}, ensure_ascii=False)))
+    logging.info(f"{len(entries)} previews written to {index_file_path}")
+    return index_file_path
+
+GALLERY_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Landsat __LAYER__ previews</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+body { font-family: sans-serif; margin: 12px; }
+#grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(320px, 1fr)); gap: 12px; }
+.card h4 { margin: 4px 0; font-weight: normal; }
+.map { height: 280px; background: #eee; }
+</style>
+</head>
+<body>
+<h2>Landsat __LAYER__ previews</h2>
+<label>city <select id="city"><option value="">all</option></select></label>
+<label>year <select id="year"><option value="">all</option></select></label>
+<span id="count"></span>
+<div id="grid"></div>
+<script>
+const data = __DATA__;
+const maps = new Map();
+const observer = new IntersectionObserver((records) => {
+  for (const record of records) {
+    const node = record.target;
+    if (record.isIntersecting && !maps.has(node)) { // the tiles are requested only for the visible maps
+      const entry = data.entries[node.dataset.index];
+      const outline = data.outlines[entry.city_code];
+      const map = L.map(node, { zoomControl: false, attributionControl: false }).setView(outline.center, 9);
+      L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png').addTo(map);
+      L.tileLayer(entry.url).addTo(map);
+      const boundary = L.geoJSON(outline.geometry, { style: { color: '#000', weight: 1, fill: false } }).addTo(map);
+      map.fitBounds(boundary.getBounds());
+      maps.set(node, map);
+    } else if (!record.isIntersecting && maps.has(node)) {
+      maps.get(node).remove();
+      maps.delete(node);
+    }
+  }
+}, { rootMargin: '300px' });
+
+function fillSelect(id, values) {
+  const select = document.getElementById(id);
+  for (const value of [...new Set(values)].sort()) {
+    select.add(new Option(value, value));
+  }
+  select.onchange = render;
+}
+
+function render() {
+  const city = document.getElementById('city').value;
+  const year = document.getElementById('year').value;
+  const grid = document.getElementById('grid');
+  for (const map of maps.values()) { map.remove(); }
+  maps.clear();
+  observer.disconnect();
+  grid.replaceChildren();
+  let count = 0;
+  data.entries.forEach((entry, index) => {
+    if ((city && entry.city !== city) || (year && String(entry.year) !== year)) { return; }
+    const card = document.createElement('div');
+    card.className = 'card';
+    card.innerHTML = '<h4></h4><div class="map"></div>';
+    card.querySelector('h4').textContent = entry.title;
+    const node = card.querySelector('.map');
+    node.dataset.index = index;
+    grid.appendChild(card);
+    observer.observe(node);
+    count += 1;
+  });
+  document.getElementById('count').textContent = count + ' scenes, ' + data.vis.min + ' to ' + data.vis.max;
+}
+
+fillSelect('city', data.entries.map((entry) => entry.city));
+fillSelect('year', data.entries.map((entry) => String(entry.year)));
+render();
+</script>
+</body>
+</html>
+"""
+
+def __main__():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    ee.Initialize(project=os.getenv('PROJECT_NAME'))
+    gallery_path = os.getenv('PREVIEW_GALLERY_PATH')
+    if gallery_path is None:
+        raise ValueError('PREVIEW_GALLERY_PATH is not set')
+    build_gallery(query_scenes(), load_cached_city_boundaries(), gallery_path, os.getenv('PREVIEW_LAYER', 'LST'),
+                  int(os.getenv('MAX_WORKERS', 12)))
+
+if __name__ == '__main__':
+    __main__()
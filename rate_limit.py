@@ -0,0 +1,153 @@
+import os
+import time
+import random
+import logging
+import threading
+import requests
+
+# endpoint class -> (requests per second, max concurrent requests)
+DEFAULT_LIMITS = {
+    'getinfo': (10.0, 8), # interactive computations, getInfo and scene searches
+    'task_start': (1.0, 2), # batch export task creation
+    'task_list': (0.5, 1), # task state listing
+    'drive': (10.0, 8), # drive list, get and delete
+}
+
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+# no timeout messages here, earth engine reports a computation too heavy to finish as "Computation timed out."
+# and running it again fails the same way, only timeouts of the transport are retried
+TRANSIENT_MESSAGES = ['too many requests', 'quota exceeded', 'rate limit', 'service unavailable',
+                      'internal error', 'backend error', 'connection reset']
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout)
+THROTTLE_MESSAGES = ['too many requests', 'quota exceeded', 'rate limit']
+
+class TokenBucket:
+    """
+    block the caller until a token is available, tokens refill at `rate` per second up to `capacity`
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                current = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (current - self.updated) * self.rate)
+                self.updated = current
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Endpoint:
+    """
+    rate and concurrency limit of one endpoint class, adjusted by additive increase / multiplicative decrease
+
+    every successful call raises the limits a little, every call rejected by a quota halves them
+    """
+    def __init__(self, name, rate, max_concurrency):
+        self.name = name
+        self.max_rate = rate
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.bucket = TokenBucket(rate, max(1.0, rate))
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.concurrency):
+                self.condition.wait()
+            self.in_flight += 1
+        self.bucket.acquire()
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.bucket.rate = max(self.max_rate / 64, self.bucket.rate / 2)
+                logging.warning(f"{self.name} throttled, limit to {self.bucket.rate:.2f} req/s and {int(self.concurrency)} concurrent")
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 100)
+            self.condition.notify_all()
+
+endpoints = {}
+endpoints_lock = threading.Lock()
+held = threading.local() # endpoints whose slot the current thread holds
+
+def get_endpoint(name):
+    """
+    the limits can be overridden by <NAME>_RATE_LIMIT and <NAME>_MAX_CONCURRENCY environment variables
+    """
+    with endpoints_lock:
+        if name not in endpoints:
+            rate, max_concurrency = DEFAULT_LIMITS[name]
+            rate = float(os.getenv(f'{name.upper()}_RATE_LIMIT', rate))
+            max_concurrency = int(os.getenv(f'{name.upper()}_MAX_CONCURRENCY', max_concurrency))
+            endpoints[name] = Endpoint(name, rate, max_concurrency)
+        return endpoints[name]
+
+def is_transient(error):
+    """
+    quota, throttling, server and connection errors are worth retrying
+    """
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    status = getattr(getattr(error, 'resp', None), 'status', None) # googleapiclient HttpError
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None) # requests HTTPError
+    if status is not None:
+        return int(status) in TRANSIENT_STATUS
+    message = str(error).lower()
+    return any(pattern in message for pattern in TRANSIENT_MESSAGES)
+
+def is_throttled(error):
+    """
+    the request was rejected by a quota, unlike a timeout or a server error it surely had no effect
+    """
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None:
+        return int(status) == 429
+    message = str(error).lower()
+    return any(pattern in message for pattern in THROTTLE_MESSAGES)
+
+def call(endpoint_name, func, *args, retries=6, base_delay=1.0, max_delay=120.0, **kwargs):
+    """
+    call func under the endpoint limits, transient errors are retried with jittered exponential backoff
+
+    a call made while the thread already holds a slot of the endpoint runs in that slot, so nested
+    calls cannot deadlock when the concurrency is cut down to one
+    """
+    held_endpoints = getattr(held, 'endpoints', None)
+    if held_endpoints is None:
+        held_endpoints = held.endpoints = set()
+    if endpoint_name in held_endpoints:
+        return func(*args, **kwargs)
+    endpoint = get_endpoint(endpoint_name)
+    for attempt in range(retries + 1):
+        endpoint.acquire()
+        held_endpoints.add(endpoint_name)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            held_endpoints.discard(endpoint_name)
+            transient = is_transient(e)
+            endpoint.release(throttled=is_throttled(e)) # only a quota rejection cuts the limits, not a server error
+            if not transient or attempt == retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logging.info(f"{endpoint_name} transient error({e}), retry {attempt + 1} in {delay:.1f} seconds")
+            time.sleep(delay)
+            continue
+        held_endpoints.discard(endpoint_name)
+        endpoint.release()
+        return result
@@ -2,52 +2,48 @@ import ee.data
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
 from datetime import datetime
-from fetch_drive import monitor_export_task
-import multiprocessing as mp
+from dotenv import load_dotenv
+from functools import partial
+from landsat_lst_image import download_exported_file, record_failed_export
+from task_poller import TaskPoller
+from fetch_drive import DriveDownloader
 import monitor
+import rate_limit
 import ee
 import os
 import logging
 
 def retrieve_unfinished_tasks():
-    monitor_file_path = os.getenv('PROCESS_MONITOR_FILE_PATH')
-    # read local unfinished tasks record
-    unfinished_tasks = []
-    with open(monitor_file_path, 'r') as f:
-        lines = f.readlines()
-    for line in lines:
-        unfinished_tasks.append(line.split(':')[1])
+    """
+    return {task id: task description} of the exports not downloaded yet
+    """
+    # read local unfinished jobs from the ledger
+    unfinished_tasks = monitor.list_submitted_jobs()
     # read gee task manager unfinished tasks
-    ee.Initialize(os.getenv('PROJECT_NAME'))
-    tasks = ee.data.listOperations()
-    for task in tasks:
-        if task.state in ['READY', 'RUNNING']:
-            unfinished_tasks.append(task.description)
-    unfinished_tasks = list(set(unfinished_tasks))
+    ee.Initialize(project=os.getenv('PROJECT_NAME'))
+    for task in rate_limit.call('task_list', ee.data.getTaskList):
+        if task['state'] in ['READY', 'RUNNING']:
+            unfinished_tasks[task['id']] = task['description']
     return unfinished_tasks
 
-def rebuild_process_monitor(task_list):
-    monitor_file_path = os.getenv('PROCESS_MONITOR_FILE_PATH')
-    with open(monitor_file_path, 'w') as f:
-        for file_name in task_list:
-            process = mp.Process(
-                    name=file_name,
-                    target=monitor_export_task, 
-                    args=(gauth,task,file_name,drive,folder_name,save_path),
-                    daemon=False
-                )
-            process.start()
-            logging.info(f'[{process.pid}] start export {file_name}')
-            monitor.add_process(process)
+def rebuild_process_monitor(poller, task_list):
+    for task_id, file_name in task_list.items():
+        poller.submit(task_id, file_name)
+        logging.info(f'[{task_id}] resume export {file_name}')
 
 def __main__():
+    load_dotenv()
     gauth = GoogleAuth()
-    gauth.LoadCredentialsFile('credentials.json')
+    gauth.LoadCredentialsFile(os.getenv('CREDENTIALS_FILE_PATH'))
     if gauth.credentials is None:
         gauth.LocalWebserverAuth()
     drive = GoogleDrive(gauth)
+    folder_name = 'landsat_lst_timeseries'
+    save_path = os.getenv('IMAGE_SAVE_PATH')
+    poller = TaskPoller(partial(download_exported_file, gauth, DriveDownloader(drive), folder_name, save_path), record_failed_export).start()
     unfinished_tasks = retrieve_unfinished_tasks()
-    rebuild_process_monitor(unfinished_tasks)   
+    rebuild_process_monitor(poller, unfinished_tasks)
+    poller.join()
 
 if __name__ == '__main__':
-    __main__()
\ No newline at end of file
+    __main__()
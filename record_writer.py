@@ -0,0 +1,204 @@
+import os
+import csv
+import queue
+import sqlite3
+import logging
+import threading
+import time
+import pandas as pd
+from contextlib import closing
+
+RECORD_HEADER = ['city', 'year', 'month', 'toa_image_porpotion', 'sr_image_porpotion', 'toa_cloud_ratio', 'sr_cloud_ratio', 'day']
+FSYNC_POLICIES = ('always', 'batch', 'never')
+
+def index_file_path(record_file_path):
+    return os.getenv('RECORD_INDEX_FILE_PATH') or os.path.splitext(record_file_path)[0] + '.sqlite'
+
+def connect_index(record_file_path):
+    conn = sqlite3.connect(index_file_path(record_file_path), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS records (
+            city TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            toa_image_porpotion REAL,
+            sr_image_porpotion REAL,
+            toa_cloud_ratio REAL,
+            sr_cloud_ratio REAL,
+            day INTEGER,
+            PRIMARY KEY (city, year, month)
+        )""")
+    conn.execute("CREATE TABLE IF NOT EXISTS indexed_file (inode INTEGER NOT NULL, size INTEGER NOT NULL)")
+    return conn
+
+def index_rows(conn, rows, record_file_path):
+    """
+    index the rows and remember the inode and size of the csv they were appended to
+    """
+    stat = os.stat(record_file_path)
+    conn.executemany(f"INSERT OR REPLACE INTO records VALUES ({', '.join('?' * len(RECORD_HEADER))})", rows)
+    conn.execute("DELETE FROM indexed_file")
+    conn.execute("INSERT INTO indexed_file VALUES (?, ?)", (stat.st_ino, stat.st_size))
+    conn.commit()
+
+def rebuild_index(record_file_path):
+    """
+    index the rows of the csv again, the csv stays the source of truth
+    """
+    with open(record_file_path, 'r', newline='', encoding='utf-8') as f:
+        rows = [[row[column] for column in RECORD_HEADER] for row in csv.DictReader(f)]
+    with closing(connect_index(record_file_path)) as conn:
+        conn.execute("DELETE FROM records")
+        index_rows(conn, rows, record_file_path)
+    logging.info(f"indexed {len(rows)} records of {record_file_path}")
+
+def index_is_current(record_file_path):
+    """
+    False if the index is missing, lost track of a batch, or was built from a csv since deleted, rotated or truncated
+    """
+    if not os.path.exists(index_file_path(record_file_path)):
+        return False
+    with closing(connect_index(record_file_path)) as conn:
+        indexed = conn.execute("SELECT inode, size FROM indexed_file").fetchone()
+    stat = os.stat(record_file_path)
+    return indexed is not None and indexed[0] == stat.st_ino and indexed[1] <= stat.st_size
+
+def ensure_index(record_file_path):
+    if not index_is_current(record_file_path):
+        rebuild_index(record_file_path)
+
+def forget_indexed_file(record_file_path):
+    """
+    make the next reader rebuild the index, after a batch reached the csv but not the index
+    """
+    try:
+        with closing(connect_index(record_file_path)) as conn:
+            conn.execute("DELETE FROM indexed_file")
+            conn.commit()
+    except Exception as e:
+        logging.error(f"record index of {record_file_path} could not be invalidated: {e}")
+
+class RecordWriter:
+    """
+    the only writer of the record csv, rows from any thread are queued and appended in batches
+
+    a batch is written when batch_size rows are queued or flush_interval seconds passed, then indexed in sqlite.
+    fsync is 'always' after every batch, 'batch' when the writer is flushed or closed, or 'never'
+    """
+    def __init__(self, record_file_path, batch_size=50, flush_interval=5.0, fsync='batch'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy should be one of {FSYNC_POLICIES}")
+        self.record_file_path = record_file_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.queue = queue.Queue()
+        new_file = not os.path.exists(record_file_path)
+        self.file = open(record_file_path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(RECORD_HEADER)
+            self.file.flush()
+        ensure_index(record_file_path) # a new csv empties the index of the old one
+        self.thread = threading.Thread(target=self.run, name='record-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, row):
+        self.queue.put(('row', row))
+
+    def flush(self):
+        """
+        block until every queued row is written
+        """
+        done = threading.Event()
+        self.queue.put(('flush', done))
+        done.wait()
+
+    def close(self):
+        self.flush()
+        self.queue.put(('stop', None))
+        self.thread.join()
+        self.file.close()
+
+    def run(self):
+        with closing(connect_index(self.record_file_path)) as conn:
+            batch = []
+            deadline = None # flush time of the oldest queued row, a steady trickle of rows cannot hold it back
+            while True:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    kind, item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    kind, item = 'timeout', None
+                if kind == 'row':
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_interval
+                    batch.append(item)
+                    if len(batch) < self.batch_size and time.monotonic() < deadline:
+                        continue
+                try:
+                    self.write_batch(conn, batch, sync=kind in ('flush', 'stop'))
+                except Exception as e: # the writer keeps running, a dead writer would block every flush
+                    logging.error(f"{len(batch)} records failed to be written: {e}")
+                    forget_indexed_file(self.record_file_path)
+                finally:
+                    if kind == 'flush':
+                        item.set()
+                batch = []
+                deadline = None
+                if kind == 'stop':
+                    return
+
+    def write_batch(self, conn, batch, sync):
+        if batch:
+            self.writer.writerows(batch)
+            self.file.flush()
+            index_rows(conn, batch, self.record_file_path)
+        if self.fsync == 'always' and batch or self.fsync == 'batch' and sync:
+            os.fsync(self.file.fileno())
+
+default_writer = None
+default_writer_lock = threading.Lock()
+
+def get_writer():
+    """
+    the writer of RECORD_FILE_PATH, flushed by RECORD_BATCH_SIZE, RECORD_FLUSH_INTERVAL and RECORD_FSYNC
+    """
+    global default_writer
+    with default_writer_lock:
+        if default_writer is None:
+            default_writer = RecordWriter(os.getenv('RECORD_FILE_PATH'),
+                                          batch_size=int(os.getenv('RECORD_BATCH_SIZE', 50)),
+                                          flush_interval=float(os.getenv('RECORD_FLUSH_INTERVAL', 5)),
+                                          fsync=os.getenv('RECORD_FSYNC', 'batch'))
+    return default_writer
+
+def write_record(row):
+    get_writer().write(row)
+
+def close_writer():
+    global default_writer
+    with default_writer_lock:
+        if default_writer is not None:
+            default_writer.close()
+            default_writer = None
+
+def query_records(record_file_path, city=None, year=None, month=None):
+    """
+    return the recorded rows matching the given keys as a dataframe, read from the index instead of the csv
+    """
+    ensure_index(record_file_path)
+    conditions = [(column, value) for column, value in (('city', city), ('year', year), ('month', month)) if value is not None]
+    where = ' AND '.join(f'{column} = ?' for column, _ in conditions)
+    sql = f"SELECT {', '.join(RECORD_HEADER)} FROM records" + (f" WHERE {where}" if where else '')
+    with closing(connect_index(record_file_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=[value for _, value in conditions])
+
+def load_recorded_keys(record_file_path):
+    """
+    return the (city, year, month) keys of the recorded rows
+    """
+    ensure_index(record_file_path)
+    with closing(connect_index(record_file_path)) as conn:
+        return {(city, year, month) for city, year, month in conn.execute("SELECT city, year, month FROM records")}
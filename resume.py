@@ -0,0 +1,62 @@
+import os
+import re
+import logging
+import monitor
+import record_writer
+from pypinyin import lazy_pinyin as pinyin
+
+# <pinyin city name>Landsat<year><month>.tif, only the assembled image, a leftover shard or tile of an
+# export that was never mosaicked does not make the month downloaded
+DOWNLOAD_FILE_PATTERN = re.compile(r'^(?P<city>.+)Landsat(?P<year>\d{4})(?P<month>\d{2})\.tif$')
+
+def load_recorded_jobs(record_file_path):
+    """
+    return the (city, year, month) keys whose best scene is already recorded
+    """
+    if record_file_path is None or not os.path.exists(record_file_path):
+        return set()
+    return record_writer.load_recorded_keys(record_file_path)
+
+def load_downloaded_jobs(save_path, city_names):
+    """
+    return the (city, year, month) keys whose image is already downloaded to save_path
+    """
+    pinyin_names = {''.join(pinyin(city_name)): city_name for city_name in city_names}
+    downloaded_jobs = set()
+    if save_path is None or not os.path.isdir(save_path):
+        return downloaded_jobs
+    for file_name in os.listdir(save_path):
+        matched = DOWNLOAD_FILE_PATTERN.match(file_name)
+        if matched is None or matched.group('city') not in pinyin_names:
+            continue
+        downloaded_jobs.add((pinyin_names[matched.group('city')], int(matched.group('year')), int(matched.group('month'))))
+    return downloaded_jobs
+
+def load_finished_jobs(record_file_path, save_path, city_names, to_drive, retry_empty=False, max_attempts=3):
+    """
+    return the (city, year, month) keys that should not be planned again
+
+    a job is finished if its image is downloaded (or recorded when not exporting to drive),
+    if it is still exporting, if no scene is under the cloud threshold, or if its scene search
+    failed max_attempts times already
+    """
+    if to_drive:
+        finished_jobs = load_downloaded_jobs(save_path, city_names)
+    else:
+        finished_jobs = load_recorded_jobs(record_file_path)
+    skipped_empty, skipped_failed = 0, 0
+    for key, job_states in monitor.load_job_states().items():
+        for satellite, state, attempts, last_error in job_states:
+            if state == 'COMPLETED' or state in monitor.IN_FLIGHT_STATES:
+                finished_jobs.add(key)
+            elif satellite == 'NONE' and state == 'EMPTY' and not retry_empty:
+                finished_jobs.add(key)
+                skipped_empty += 1
+            elif satellite == 'NONE' and state == 'FAILED' and attempts >= max_attempts:
+                finished_jobs.add(key)
+                skipped_failed += 1
+    logging.info(f"{len(finished_jobs)} jobs finished, {skipped_empty} known empty, {skipped_failed} failed {max_attempts} times")
+    return finished_jobs
+
+def plan_months(city_name, year, finished_jobs, month_list=range(1,13)):
+    return [month for month in month_list if (city_name, year, month) not in finished_jobs]
@@ -0,0 +1,94 @@
+import ee
+import os
+import json
+import logging
+from datetime import datetime
+from info_batcher import evaluate_all
+
+LANDSAT_COLLECTIONS = {
+    'L4': 'LANDSAT/LT04/C02/T1_L2',
+    'L5': 'LANDSAT/LT05/C02/T1_L2',
+    'L7': 'LANDSAT/LE07/C02/T1_L2',
+    'L8': 'LANDSAT/LC08/C02/T1_L2',
+}
+SATELLITE_ORDER = ['L8', 'L5', 'L7', 'L4']
+
+def availability_info(geometry, date_start, date_end):
+    """
+    number of scenes and minimum cloud cover per satellite and month over the geometry, as one ee.Dictionary
+    """
+    def add_month(image):
+        return image.set('month_key', ee.Date(image.get('system:time_start')).format('YYYY-MM'))
+    reducer = ee.Reducer.count().combine(ee.Reducer.min(), sharedInputs=True).group(groupField=1, groupName='month_key')
+    info = {}
+    for satellite, collection_id in LANDSAT_COLLECTIONS.items():
+        collection = ee.ImageCollection(collection_id).filterBounds(geometry).filterDate(date_start, date_end).map(add_month)
+        info[satellite] = collection.reduceColumns(reducer, ['CLOUD_COVER', 'month_key']).get('groups')
+    return ee.Dictionary(info)
+
+def parse_availability(info):
+    """
+    return {satellite: {'YYYY-MM': [scene number, minimum cloud cover]}}
+    """
+    return {
+        satellite: {group['month_key']: [group['count'], group['min']] for group in groups}
+        for satellite, groups in info.items()
+    }
+
+def index_file_path(city_code):
+    index_path = os.getenv('AVAILABILITY_INDEX_PATH')
+    if index_path is None:
+        return None
+    return os.path.join(index_path, f'{city_code}.json')
+
+def load_cached_availability(city_code, max_age_days):
+    file_path = index_file_path(city_code)
+    if file_path is None or not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r', encoding='utf-8') as f:
+        cached = json.load(f)
+    built_at = datetime.strptime(cached['built_at'], '%Y-%m-%d %H:%M:%S')
+    if (datetime.now() - built_at).days > max_age_days: # new scenes are acquired every month
+        return None
+    return cached['availability']
+
+def save_availability(city_code, availability):
+    file_path = index_file_path(city_code)
+    if file_path is None:
+        return
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump({'built_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'availability': availability}, f)
+
+def load_availability(city_boundaries, date_start='1982-01-01', date_end='2025-01-01', max_age_days=30):
+    """
+    return {city code: availability} for every city, the missing indexes are built with batched aggregations
+    """
+    availabilities = {}
+    missing = []
+    for city_boundary in city_boundaries:
+        cached = load_cached_availability(city_boundary['city_code'], max_age_days)
+        if cached is None:
+            missing.append(city_boundary)
+        else:
+            availabilities[city_boundary['city_code']] = cached
+    if missing:
+        logging.info(f"build scene availability index of {len(missing)} cities")
+        infos = evaluate_all([availability_info(ee.Geometry(city_boundary['city_geometry']), date_start, date_end) for city_boundary in missing])
+        for city_boundary, info in zip(missing, infos):
+            availability = parse_availability(info)
+            save_availability(city_boundary['city_code'], availability)
+            availabilities[city_boundary['city_code']] = availability
+    return availabilities
+
+def candidate_satellites(availability, year, month, cloud_threshold, satellite_list=SATELLITE_ORDER):
+    """
+    the satellites with at least one scene under the cloud threshold in the month, in preference order
+    """
+    month_key = f'{year}-{month:02}'
+    candidates = []
+    for satellite in satellite_list:
+        scene_num, min_cloud = availability.get(satellite, {}).get(month_key, [0, None])
+        if scene_num > 0 and min_cloud is not None and min_cloud < cloud_threshold:
+            candidates.append(satellite)
+    return candidates
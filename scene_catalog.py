@@ -0,0 +1,115 @@
+import ee
+import os
+import time
+import logging
+import pandas as pd
+from info_batcher import evaluate_all
+from scene_availability import LANDSAT_COLLECTIONS, SATELLITE_ORDER
+
+TOA_COLLECTIONS = {
+    'L4': 'LANDSAT/LT04/C02/T1_TOA',
+    'L5': 'LANDSAT/LT05/C02/T1_TOA',
+    'L7': 'LANDSAT/LE07/C02/T1_TOA',
+    'L8': 'LANDSAT/LC08/C02/T1_TOA',
+}
+CATALOG_COLUMNS = ['satellite', 'date', 'year', 'month', 'day', 'scene_ids', 'cloud_cover',
+                   'toa_porpotion', 'sr_porpotion', 'urban_porpotion', 'toa_cloud', 'sr_cloud']
+MIN_URBAN_COVERAGE = 0.9 # a scene must cover this share of the urban area, or its cloud ratio says little
+
+def coverage(collection, city_geometry, city_area):
+    """
+    proportion of the city covered by the footprints of the collection
+    """
+    return collection.geometry().intersection(city_geometry, 1).area(1).divide(city_area)
+
+def cloud_ratio(collection, urban_geometry):
+    """
+    percentage of cloud and cloud shadow pixels in the urban area, from the QA_PIXEL band
+    """
+    def ratio():
+        qa = collection.select('QA_PIXEL').mosaic()
+        cloud = qa.bitwiseAnd(1 << 3).neq(0).Or(qa.bitwiseAnd(1 << 4).neq(0))
+        mean = cloud.reduceRegion(ee.Reducer.mean(), urban_geometry, 90, bestEffort=True).values().get(0)
+        # null when the mosaic does not reach the urban area, counted as fully cloudy
+        return ee.Number(ee.Algorithms.If(ee.Algorithms.IsEqual(mean, None), 1, mean)).multiply(100)
+    return ee.Algorithms.If(collection.size().gt(0), ratio(), 100)
+
+def acquisition_dates(satellite, city_geometry, date_start, date_end):
+    collection = ee.ImageCollection(LANDSAT_COLLECTIONS[satellite]).filterBounds(city_geometry).filterDate(date_start, date_end)
+    return collection.aggregate_array('system:time_start').map(lambda t: ee.Date(t).format('YYYY-MM-dd')).distinct().sort()
+
+def describe_dates(satellite, dates, city_geometry, urban_geometry):
+    """
+    scene metadata of every acquisition date in the page, the scenes of one date are treated as one mosaic
+    """
+    toa = ee.ImageCollection(TOA_COLLECTIONS[satellite]).filterBounds(city_geometry)
+    sr = ee.ImageCollection(LANDSAT_COLLECTIONS[satellite]).filterBounds(city_geometry)
+    city_area = city_geometry.area(1)
+    urban_area = urban_geometry.area(1)
+    def describe(date):
+        date_start = ee.Date.parse('YYYY-MM-dd', date)
+        date_end = date_start.advance(1, 'day')
+        toa_day = toa.filterDate(date_start, date_end)
+        sr_day = sr.filterDate(date_start, date_end)
+        return ee.Dictionary({
+            'date': date,
+            'scene_ids': sr_day.aggregate_array('system:index'),
+            'cloud_cover': sr_day.aggregate_min('CLOUD_COVER'),
+            'toa_porpotion': coverage(toa_day, city_geometry, city_area),
+            'sr_porpotion': coverage(sr_day, city_geometry, city_area),
+            'urban_porpotion': coverage(sr_day, urban_geometry, urban_area),
+            'toa_cloud': cloud_ratio(toa_day, urban_geometry),
+            'sr_cloud': cloud_ratio(sr_day, urban_geometry),
+        })
+    return ee.List(dates).map(describe)
+
+def build_catalog(city_geometry, urban_geometry, date_start='1982-01-01', date_end='2025-01-01', page_size=50):
+    """
+    pull the scene metadata of the city footprint for every satellite, page by page
+    """
+    satellite_dates = evaluate_all([acquisition_dates(satellite, city_geometry, date_start, date_end) for satellite in SATELLITE_ORDER])
+    pages = []
+    for satellite, dates in zip(SATELLITE_ORDER, satellite_dates):
+        for offset in range(0, len(dates), page_size):
+            pages.append((satellite, dates[offset:offset + page_size]))
+    logging.info(f"catalog {sum(len(dates) for dates in satellite_dates)} acquisition dates in {len(pages)} pages")
+    page_infos = evaluate_all([describe_dates(satellite, dates, city_geometry, urban_geometry) for satellite, dates in pages])
+    rows = []
+    for (satellite, _), infos in zip(pages, page_infos):
+        for info in infos:
+            year, month, day = map(int, info['date'].split('-'))
+            rows.append({**info, 'satellite': satellite, 'year': year, 'month': month, 'day': day,
+                         'scene_ids': ','.join(info['scene_ids'])})
+    return pd.DataFrame(rows, columns=CATALOG_COLUMNS)
+
+def load_catalog(city_code, city_geometry, urban_geometry, max_age_days=30):
+    """
+    load the catalog of the city from SCENE_CATALOG_PATH, build it if missing, older than max_age_days
+    or written before a column was added
+    """
+    catalog_file_path = os.path.join(os.getenv('SCENE_CATALOG_PATH'), f'{city_code}.parquet')
+    if os.path.exists(catalog_file_path) and time.time() - os.path.getmtime(catalog_file_path) < max_age_days * 86400:
+        catalog = pd.read_parquet(catalog_file_path)
+        if set(CATALOG_COLUMNS) <= set(catalog.columns):
+            return catalog
+    logging.info(f"build scene catalog of {city_code}")
+    catalog = build_catalog(city_geometry, urban_geometry)
+    os.makedirs(os.path.dirname(catalog_file_path), exist_ok=True)
+    catalog.to_parquet(catalog_file_path, index=False)
+    return catalog
+
+def select_best_scene(catalog, year, month, satellite_list, cloud_threshold, min_coverage=MIN_URBAN_COVERAGE):
+    """
+    pick the scene of the month in memory, the first satellite in preference order with a scene under
+    the cloud threshold wins, then the clearest urban area and the largest coverage. scenes covering
+    less than min_coverage of the urban area are never chosen
+    """
+    month_catalog = catalog[(catalog['year'] == year) & (catalog['month'] == month) & (catalog['cloud_cover'] < cloud_threshold)
+                            & (catalog['urban_porpotion'] >= min_coverage)]
+    for satellite in satellite_list:
+        candidates = month_catalog[month_catalog['satellite'] == satellite]
+        if candidates.empty:
+            continue
+        candidates = candidates.sort_values(by=['sr_cloud', 'sr_porpotion'], ascending=[True, False])
+        return candidates.iloc[0].to_dict()
+    return None
@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import logging
+import rasterio
+import pandas as pd
+import monitor
+from contextlib import closing
+from rasterio.warp import transform_bounds
+from dotenv import load_dotenv
+from pypinyin import lazy_pinyin as pinyin
+from record_writer import query_records
+from resume import DOWNLOAD_FILE_PATTERN
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    description TEXT NOT NULL UNIQUE,
+    city TEXT,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    date TEXT,
+    satellite TEXT,
+    toa_cloud_ratio REAL,
+    sr_cloud_ratio REAL,
+    file_path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    file_mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scenes_date ON scenes(year, month);
+CREATE VIRTUAL TABLE IF NOT EXISTS scene_bounds USING rtree(id, west, east, south, north);
+"""
+
+def connect():
+    """
+    open the scene index at SCENE_INDEX_FILE_PATH, None if it is not set
+    """
+    index_file_path = os.getenv('SCENE_INDEX_FILE_PATH')
+    if index_file_path is None:
+        return None
+    conn = sqlite3.connect(index_file_path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+def scene_record(description, pinyin_city, year, month):
+    """
+    city name, acquisition date and cloud ratios of the scene from the record index
+    """
+    record_file_path = os.getenv('RECORD_FILE_PATH')
+    if record_file_path is None or not os.path.exists(record_file_path):
+        return None
+    records = query_records(record_file_path, year=year, month=month)
+    for record in records.to_dict('records'):
+        if ''.join(pinyin(record['city'])) == pinyin_city:
+            return record
+    return None
+
+def ingest_scene(file_path, conn=None):
+    """
+    add or update the downloaded scene in the index, the footprint is read from the GeoTIFF header
+    """
+    matched = DOWNLOAD_FILE_PATTERN.match(os.path.basename(file_path))
+    if matched is None:
+        return False
+    own_conn = conn is None
+    conn = conn or connect()
+    if conn is None:
+        return False
+    try:
+        year, month = int(matched.group('year')), int(matched.group('month'))
+        description = f"{matched.group('city')}Landsat{year}{month:02}"
+        with rasterio.open(file_path) as src:
+            west, south, east, north = transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+        record = scene_record(description, matched.group('city'), year, month) or {}
+        date = f"{year}-{month:02}-{int(record['day']):02}" if pd.notna(record.get('day')) else None
+        stat = os.stat(file_path)
+        with conn:
+            row = conn.execute('SELECT id FROM scenes WHERE description = ?', (description,)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM scene_bounds WHERE id = ?', row)
+                conn.execute('DELETE FROM scenes WHERE id = ?', row)
+            cursor = conn.execute("""
+                INSERT INTO scenes (description, city, year, month, date, satellite, toa_cloud_ratio, sr_cloud_ratio, file_path, file_size, file_mtime)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (description, record.get('city'), year, month, date, monitor.job_satellite(description),
+                  record.get('toa_cloud_ratio'), record.get('sr_cloud_ratio'), os.path.abspath(file_path), stat.st_size, stat.st_mtime))
+            conn.execute('INSERT INTO scene_bounds VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, west, east, south, north))
+        return True
+    finally:
+        if own_conn:
+            conn.close()
+
+def ingest_directory(save_path):
+    """
+    index the scenes of the folder that are new or changed since they were indexed
+    """
+    if os.getenv('SCENE_INDEX_FILE_PATH') is None:
+        raise ValueError('SCENE_INDEX_FILE_PATH is not set')
+    with closing(connect()) as conn:
+        indexed = {file_path: (file_size, file_mtime) for file_path, file_size, file_mtime in conn.execute('SELECT file_path, file_size, file_mtime FROM scenes')}
+        ingested = 0
+        for file_name in sorted(os.listdir(save_path)):
+            file_path = os.path.abspath(os.path.join(save_path, file_name))
+            if not file_name.endswith('.tif'):
+                continue
+            stat = os.stat(file_path)
+            if indexed.get(file_path) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                ingested += ingest_scene(file_path, conn)
+            except Exception as e:
+                logging.error(f"{file_path} failed to be indexed: {e}")
+    logging.info(f"{ingested} scenes indexed from {save_path}")
+    return ingested
+
+def query_scenes(bbox=None, date_start=None, date_end=None, months=None, satellites=None, max_cloud=None, city=None):
+    """
+    return the indexed scenes matching every given condition as a dataframe
+
+    Args:
+        bbox: (west, south, east, north) in degrees, scenes whose footprint intersects it
+        date_start, date_end: 'YYYY-MM-DD' bounds of the acquisition date, inclusive
+        months: months of the year, e.g. [6, 7, 8] for the summers
+        satellites: e.g. ['L5', 'L7']
+        max_cloud: maximum cloud ratio of the urban area in the surface reflectance scene
+        city: chinese city name
+    """
+    joins, conditions, params = [], [], []
+    if bbox is not None:
+        west, south, east, north = bbox
+        joins.append('JOIN scene_bounds b ON b.id = s.id')
+        conditions.append('b.west <= ? AND b.east >= ? AND b.south <= ? AND b.north >= ?')
+        params += [east, west, north, south]
+    if date_start is not None:
+        conditions.append('s.date >= ?')
+        params.append(date_start)
+    if date_end is not None:
+        conditions.append('s.date <= ?')
+        params.append(date_end)
+    if months is not None:
+        conditions.append(f"s.month IN ({', '.join('?' * len(months))})")
+        params += list(months)
+    if satellites is not None:
+        conditions.append(f"s.satellite IN ({', '.join('?' * len(satellites))})")
+        params += list(satellites)
+    if max_cloud is not None:
+        conditions.append('s.sr_cloud_ratio <= ?')
+        params.append(max_cloud)
+    if city is not None:
+        conditions.append('s.city = ?')
+        params.append(city)
+    sql = f"SELECT s.* FROM scenes s {' '.join(joins)}" + (f" WHERE {' AND '.join(conditions)}" if conditions else '') + ' ORDER BY s.year, s.month, s.city'
+    if os.getenv('SCENE_INDEX_FILE_PATH') is None:
+        raise ValueError('SCENE_INDEX_FILE_PATH is not set')
+    with closing(connect()) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def __main__():
+    load_dotenv()
+    ingest_directory(os.getenv('IMAGE_SAVE_PATH'))
+
+if __name__ == '__main__':
+    __main__()
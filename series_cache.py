@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import telemetry
+import pandas as pd
+from collections import defaultdict
+from concurrent.futures import Future
+
+# bump when the bands, the reducer or the ee_lst algorithm change, so older cached series are not served
+SERIES_ALGORITHM_VERSION = 1
+COORDINATE_DIGITS = 6 # about 0.1 m, coordinates closer than this share one series
+SERIES_DEDUP_COLUMNS = ['satellite', 'year', 'month', 'day']
+
+inflight = {} # series key -> future of the export running in this process
+inflight_lock = threading.Lock()
+site_locks = defaultdict(threading.Lock) # site key -> lock of its appended series
+
+def series_params(lat, lon, buffer, date_start, date_end, cloud_threshold, use_ndvi):
+    """
+    the parameters deciding the content of a point series, in canonical form
+    """
+    return {
+        'lat': round(float(lat), COORDINATE_DIGITS),
+        'lon': round(float(lon), COORDINATE_DIGITS),
+        'buffer': float(buffer),
+        'date_start': str(date_start),
+        'date_end': str(date_end),
+        'cloud_threshold': float(cloud_threshold),
+        'use_ndvi': bool(use_ndvi),
+        'version': SERIES_ALGORITHM_VERSION,
+    }
+
+def series_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()[:16]
+
+def series_point_name(lat, lon, key):
+    """
+    drive file prefix of the series export, the same request always gets the same name
+    """
+    return str(lat).replace('.', '') + '_' + str(lon).replace('.', '') + '_' + key
+
+def cache_path():
+    path = os.getenv('SERIES_CACHE_PATH') or os.getenv('SERIES_SAVE_PATH')
+    if path is None:
+        raise ValueError('SERIES_CACHE_PATH is not set')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def cache_file_path(key):
+    return os.path.join(cache_path(), f'{key}.csv')
+
+def load_cached_series(key):
+    """
+    the stored table of the series, None on a cache miss
+    """
+    file_path = cache_file_path(key)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        return pd.read_csv(file_path)
+    except pd.errors.EmptyDataError: # gee writes an empty file when no scene passes the filters
+        return pd.DataFrame(columns=SERIES_DEDUP_COLUMNS)
+
+def store_series(key, params, file_path):
+    """
+    move the downloaded table into the cache, the parameters are kept next to it
+    """
+    with open(cache_file_path(key) + '.json.part', 'w', encoding='utf-8') as f:
+        json.dump(params, f, indent=2)
+    os.replace(cache_file_path(key) + '.json.part', os.path.join(cache_path(), f'{key}.json'))
+    os.replace(file_path, cache_file_path(key))
+    return load_cached_series(key)
+
+def wait_for_cached_series(key, timeout, gap=10):
+    """
+    wait for another process to store the series, None if it is not stored within timeout seconds
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        series = load_cached_series(key)
+        if series is not None or time.monotonic() >= deadline:
+            return series
+        telemetry.sleep(gap, 'series_wait', job=key)
+
+def collapse(key, produce):
+    """
+    return the cached series or produce it, identical requests running at the same time wait
+    for the first one instead of starting their own export
+    """
+    series = load_cached_series(key)
+    if series is not None:
+        logging.info(f'series {key} served from cache')
+        return series
+    with inflight_lock:
+        future = inflight.get(key)
+        owner = future is None
+        if owner:
+            future = inflight[key] = Future()
+    if not owner:
+        logging.info(f'series {key} is being exported, waiting for it')
+        return future.result()
+    try:
+        series = load_cached_series(key) # stored by a request that finished since the first lookup
+        if series is None:
+            series = produce()
+        future.set_result(series)
+        return series
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with inflight_lock:
+            inflight.pop(key, None)
+
+def site_params(params):
+    """
+    the parameters of a site series kept up to date by appending, everything but the date range
+    """
+    return {name: value for name, value in params.items() if name not in ['date_start', 'date_end']}
+
+def site_file_path(site_key):
+    return os.path.join(cache_path(), f'site_{site_key}.csv')
+
+def load_site_series(site_key):
+    file_path = site_file_path(site_key)
+    if not os.path.exists(file_path):
+        return None
+    return pd.read_csv(file_path)
+
+def last_acquisition_date(series):
+    """
+    'YYYY-MM-DD' of the newest observation of the series, None if it is empty
+    """
+    if series is None or series.empty:
+        return None
+    last = series.sort_values(['year', 'month', 'day']).iloc[-1]
+    return f"{int(last['year'])}-{int(last['month']):02}-{int(last['day']):02}"
+
+def merge_series(series, new_series):
+    """
+    append the new observations, a scene already stored is replaced by its new row
+    """
+    if series is None or series.empty:
+        merged = new_series
+    elif new_series.empty:
+        merged = series
+    else:
+        merged = pd.concat([series, new_series], ignore_index=True)
+    merged = merged.drop_duplicates(SERIES_DEDUP_COLUMNS, keep='last')
+    return merged.sort_values(['year', 'month', 'day', 'satellite']).reset_index(drop=True)
+
+def store_site_series(site_key, params, series):
+    file_path = site_file_path(site_key)
+    series.to_csv(file_path + '.part', index=False)
+    os.replace(file_path + '.part', file_path)
+    with open(file_path + '.json.part', 'w', encoding='utf-8') as f:
+        json.dump(params, f, indent=2)
+    os.replace(file_path + '.json.part', os.path.join(cache_path(), f'site_{site_key}.json'))
+    logging.info(f'site series {site_key} stored with {len(series)} observations')
+    return series
@@ -0,0 +1,180 @@
+import ee
+import time
+import random
+import rate_limit
+import telemetry
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_MISSING_POLLS = 3 # a task absent from this many listings is given up as failed
+START_RETRIES = 4
+CLOCK_SKEW_SECONDS = 60
+
+def fetch_tasks():
+    """
+    list every task in the project with one bulk request
+    """
+    return {task['id']: task for task in rate_limit.call('task_list', ee.data.getTaskList)}
+
+def fetch_task_states():
+    return {task_id: task['state'] for task_id, task in fetch_tasks().items()}
+
+def find_started_task(task, description, since):
+    """
+    id of the task if a start that raised went through anyway, matched by description and creation time.
+    the request id of the task is made on the client and is not the id the task list reports
+    """
+    for task_id, entry in fetch_tasks().items():
+        if entry.get('description') == description and entry.get('state') not in ['FAILED', 'CANCELLED'] \
+                and entry.get('creation_timestamp_ms', 0) >= (since - CLOCK_SKEW_SECONDS) * 1000:
+            return task_id
+    return None
+
+def start_task(task, description, retries=START_RETRIES, base_delay=2.0):
+    """
+    start the export task. a throttled start was rejected and is retried, but after a timeout or a
+    server error the task may have started anyway, so the task list is checked before starting it again
+    """
+    since = time.time()
+    for attempt in range(retries + 1):
+        try:
+            rate_limit.call('task_start', task.start, retries=0)
+            return task
+        except Exception as e:
+            if not rate_limit.is_transient(e) or attempt == retries:
+                raise
+            if not rate_limit.is_throttled(e):
+                task_id = find_started_task(task, description, since)
+                if task_id is not None:
+                    logging.warning(f"{description} start failed({e}) but task {task_id} exists, not started again")
+                    task.id = task_id
+                    return task
+            delay = random.uniform(0, base_delay * 2 ** attempt)
+            logging.info(f"{description} failed to start({e}), retry {attempt + 1} in {delay:.1f} seconds")
+            time.sleep(delay)
+
+def record_task_spans(task, task_identifier):
+    """
+    time spent in the earth engine queue (READY) and computing (RUNNING), from the task timestamps
+    """
+    created = task.get('creation_timestamp_ms')
+    started = task.get('start_timestamp_ms')
+    updated = task.get('update_timestamp_ms')
+    if created is not None and started is not None:
+        telemetry.record_span('ee_ready', created / 1000, (started - created) / 1000, job=task_identifier)
+    if started is not None and updated is not None:
+        telemetry.record_span('ee_running', started / 1000, (updated - started) / 1000, task['state'].lower(), job=task_identifier)
+
+class TaskPoller:
+    """
+    single supervisor for all outstanding export tasks
+
+    one listing request is made per tick no matter how many tasks are registered,
+    finished tasks are handed to a small pool of download workers. on_failure may restart
+    the export and return the new task id, which is polled again under the same identifier
+    """
+    def __init__(self, on_complete, on_failure=None, gap=20, download_workers=4, max_missing_polls=MAX_MISSING_POLLS):
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.gap = gap
+        self.max_missing_polls = max_missing_polls
+        self.pending = {} # task id -> task identifier
+        self.missing = {} # task id -> number of listings the task was absent from
+        self.dispatching = 0 # finished tasks whose callback is not done yet
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stopped = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix='download')
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='task_poller', daemon=True)
+            self.thread.start()
+        return self
+
+    def submit(self, task_id, task_identifier):
+        with self.lock:
+            self.pending[task_id] = task_identifier
+            self.idle.clear()
+        logging.info(f'{task_identifier} registered to poller')
+        self.start()
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+
+    def join(self):
+        """
+        block until every registered task is finished and downloaded
+        """
+        self.idle.wait()
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=False)
+
+    def _callback(self, callback, task_identifier, retry):
+        task_id = None
+        try:
+            if callback is not None:
+                task_id = callback(task_identifier)
+        except Exception as e:
+            logging.error(f"{task_identifier} callback failed: {e}")
+        with self.lock:
+            self.dispatching -= 1
+            if retry and task_id is not None:
+                self.pending[task_id] = task_identifier
+                logging.info(f'{task_identifier} restarted as {task_id}')
+            if not self.pending and not self.dispatching:
+                self.idle.set()
+
+    def _dispatch(self, task_id, task_identifier, state):
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {task_identifier} task state: {state}")
+        if state == 'COMPLETED':
+            print(f"✓ {task_identifier} task success")
+            self.executor.submit(self._callback, self.on_complete, task_identifier, False)
+        else:
+            logging.error(f"{task_identifier} failed")
+            print(f"× {task_identifier} task failed")
+            self.executor.submit(self._callback, self.on_failure, task_identifier, True)
+
+    def _poll(self):
+        with self.lock:
+            if not self.pending:
+                return
+        with telemetry.span('task_list'):
+            tasks = fetch_tasks()
+        finished = []
+        with self.lock:
+            for task_id, task_identifier in self.pending.items():
+                task = tasks.get(task_id)
+                if task is None: # older than the listing or an unknown id, it would block join forever
+                    self.missing[task_id] = self.missing.get(task_id, 0) + 1
+                    if self.missing[task_id] >= self.max_missing_polls:
+                        logging.error(f"{task_identifier} task {task_id} not found in {self.missing[task_id]} task listings")
+                        finished.append((task_id, task_identifier, {'id': task_id, 'state': 'FAILED'}))
+                elif task['state'] in ['COMPLETED', 'FAILED', 'CANCELLED']:
+                    finished.append((task_id, task_identifier, task))
+            for task_id, _, _ in finished:
+                del self.pending[task_id]
+                self.missing.pop(task_id, None)
+            self.dispatching += len(finished)
+        for task_id, task_identifier, task in finished:
+            record_task_spans(task, task_identifier)
+            self._dispatch(task_id, task_identifier, task['state'])
+        with self.lock:
+            if not self.pending and not self.dispatching:
+                self.idle.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self._poll()
+            except Exception as e:
+                logging.error(f"error to poll task states: {e}")
+            self.stopped.wait(self.gap)
@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, start_http_server
+
+# the stages last from milliseconds (cached lookups) to hours (export tasks waiting in the queue)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+stage_seconds = Histogram('lst_stage_seconds', 'wall clock time of the pipeline stages', ['stage', 'status'], buckets=STAGE_BUCKETS)
+download_bytes = Counter('lst_download_bytes', 'bytes downloaded from drive')
+
+trace_lock = threading.Lock()
+trace_file = None
+
+def write_trace(record):
+    """
+    append one span to the json lines file at TRACE_FILE_PATH, nothing is written if it is not set
+    """
+    global trace_file
+    trace_file_path = os.getenv('TRACE_FILE_PATH')
+    if trace_file_path is None:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with trace_lock:
+        if trace_file is None:
+            trace_file = open(trace_file_path, 'a', encoding='utf-8', buffering=1)
+        trace_file.write(line + '\n')
+
+def record_span(stage, start, duration, status='ok', **keys):
+    """
+    record a span measured elsewhere, e.g. from the timestamps of an earth engine task
+    """
+    stage_seconds.labels(stage=stage, status=status).observe(duration)
+    write_trace({'stage': stage, 'start': start, 'duration': round(duration, 3), 'status': status,
+                 'thread': threading.current_thread().name, **keys})
+
+@contextmanager
+def span(stage, **keys):
+    """
+    time the block as one span of the stage, the yielded dict can carry extra keys such as bytes
+
+    the status is the exception name if the block raises
+    """
+    extra = {}
+    start = time.time()
+    status = 'ok'
+    try:
+        yield extra
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        record_span(stage, start, time.time() - start, status, **keys, **extra)
+
+def sleep(seconds, stage='sleep', **keys):
+    """
+    time.sleep recorded as a span, so the fixed waits show up in the trace
+    """
+    with span(stage, **keys):
+        time.sleep(seconds)
+
+def start_metrics_server(port=None):
+    """
+    serve the counters and histograms in prometheus text format on METRICS_PORT, if set
+    """
+    port = port or os.getenv('METRICS_PORT')
+    if port is None:
+        return
+    start_http_server(int(port))
+    logging.info(f"metrics served on port {port}")
@@ -0,0 +1,44 @@
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+import numpy as np
+from export_profile import NODATA, EXPORT_PROFILES, read_decoded
+from mosaic import mosaic_tiles
+
+def pack(values, scale, offset):
+    """
+    the packing apply_export_profile does on the server
+    """
+    packed = np.clip(np.round((values - offset) / scale), 1, 65535)
+    return np.where(np.isnan(values), NODATA, packed).astype(np.uint16)
+
+def write_export(file_path, bands):
+    profile = {'driver': 'GTiff', 'width': 64, 'height': 64, 'count': len(bands), 'dtype': 'uint16',
+               'crs': 'EPSG:4326', 'transform': rasterio.Affine(0.00027, 0, 114, 0, -0.00027, 31), 'nodata': NODATA}
+    with rasterio.open(file_path, 'w', **profile) as dst:
+        for index, band in enumerate(bands, start=1):
+            dst.write(band, index)
+
+def test_recompute_profile_round_trip_into_a_cog(tmp_path):
+    profile = EXPORT_PROFILES['recompute']
+    rng = np.random.default_rng(0)
+    values = {
+        'B10': rng.uniform(250, 330, (64, 64)),
+        'NDVI': rng.uniform(-1, 1, (64, 64)),
+        'TPW': rng.uniform(0, 60, (64, 64)),
+        'EM_bare': rng.uniform(0.9, 1, (64, 64)),
+        'QA_PIXEL': np.full((64, 64), 21824.0),
+    }
+    values['NDVI'][0, 0] = np.nan
+    bands = [pack(values[band], *profile['scales'].get(band, (1, 0))) for band in profile['bands']]
+    file_path = str(tmp_path / 'wuhanLandsat200001.tif')
+    write_export(file_path, bands)
+    mosaic_tiles([file_path], file_path, export_profile=profile)
+    with rasterio.open(file_path) as src:
+        assert src.tags(ns='IMAGE_STRUCTURE').get('LAYOUT') == 'COG'
+        assert list(src.descriptions) == profile['bands']
+        for index, band in enumerate(profile['bands'], start=1):
+            scale = profile['scales'].get(band, (1, 0))[0]
+            decoded = read_decoded(src, index)
+            assert np.array_equal(np.isnan(decoded), np.isnan(values[band]))
+            assert np.nanmax(np.abs(decoded - values[band])) <= scale
@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip('pydrive')
+import requests
+import telemetry
+from fetch_drive import DriveDownloader, is_export_of
+from fake_backend import FakeDrive, lognormal
+
+def test_is_export_of():
+    assert is_export_of('wuhanLandsat200001.tif', 'wuhanLandsat200001')
+    assert is_export_of('wuhanLandsat200001-0000000000-0000000000.tif', 'wuhanLandsat200001')
+    assert not is_export_of('wuhanLandsat2000011.tif', 'wuhanLandsat200001')
+    assert not is_export_of('wuhanLandsat200001_r1c2.tif', 'wuhanLandsat200001')
+
+def fake_drive():
+    return FakeDrive(speedup=1, list_latency=lognormal(0, 0), bandwidth=1e12)
+
+def test_find_files_relists_on_a_miss():
+    drive = fake_drive()
+    drive.add_file('exports', 'other.tif', b'0')
+    downloader = DriveDownloader(drive, session=drive.session())
+    folder_id = downloader.get_folder_id('exports')
+    assert downloader.find_files(folder_id, 'wuhanLandsat200001') == []
+    drive.add_file('exports', 'wuhanLandsat200001.tif', b'1')
+    assert [file_meta['title'] for file_meta in downloader.find_files(folder_id, 'wuhanLandsat200001')] == ['wuhanLandsat200001.tif']
+
+def test_download_and_clean_verifies_and_deletes(tmp_path):
+    drive = fake_drive()
+    drive.add_file('exports', 'wuhanLandsat200001-0000000000-0000000000.tif', b'tile one')
+    drive.add_file('exports', 'wuhanLandsat200001-0000000256-0000000000.tif', b'tile two')
+    downloader = DriveDownloader(drive, session=drive.session())
+    file_list = downloader.download_and_clean(downloader.get_folder_id('exports'), 'wuhanLandsat200001', str(tmp_path))
+    assert sorted(open(file_name, 'rb').read() for file_name in file_list) == [b'tile one', b'tile two']
+    assert drive.files == {}
+
+def test_duplicate_titles_keep_the_newest(tmp_path):
+    drive = fake_drive()
+    drive.add_file('exports', 'wuhanLandsat200001.tif', b'orphan of a failed download')
+    drive.add_file('exports', 'wuhanLandsat200001.tif', b're-export')
+    downloader = DriveDownloader(drive, session=drive.session())
+    file_list = downloader.download_and_clean(downloader.get_folder_id('exports'), 'wuhanLandsat200001', str(tmp_path))
+    assert [open(file_name, 'rb').read() for file_name in file_list] == [b're-export']
+    assert drive.files == {}
+
+class DroppingSession:
+    """
+    drops the first transfer of every file after `drop_after` bytes
+    """
+    def __init__(self, session, drop_after):
+        self.session = session
+        self.drop_after = drop_after
+        self.ranges = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        response = self.session.request(method, url, headers=headers, **kwargs)
+        if method != 'GET':
+            return response
+        self.ranges.append((headers or {}).get('Range'))
+        if len(self.ranges) > 1:
+            return response
+        content = response.iter_content
+        def iter_content(chunk_size):
+            sent = 0
+            for chunk in content(chunk_size):
+                if sent >= self.drop_after:
+                    raise requests.exceptions.ChunkedEncodingError('connection broken')
+                sent += len(chunk)
+                yield chunk
+        response.iter_content = iter_content
+        return response
+
+def test_dropped_stream_resumes_from_the_part_file(tmp_path):
+    drive = fake_drive()
+    drive.add_file('exports', 'wuhanLandsat200001.tif', bytes(range(256)) * 4)
+    session = DroppingSession(drive.session(), drop_after=256)
+    downloader = DriveDownloader(drive, chunk_size=128, session=session)
+    file_meta = downloader.find_files(downloader.get_folder_id('exports'), 'wuhanLandsat200001')[0]
+    file_name = downloader.download(file_meta, str(tmp_path), base_delay=0)
+    assert open(file_name, 'rb').read() == bytes(range(256)) * 4
+    assert session.ranges == [None, 'bytes=256-']
+
+def test_drive_spans_carry_the_job_labels(tmp_path, monkeypatch):
+    records = []
+    monkeypatch.setattr(telemetry, 'write_trace', records.append)
+    drive = fake_drive()
+    drive.add_file('exports', 'wuhanLandsat200001.tif', b'image')
+    downloader = DriveDownloader(drive, session=drive.session())
+    labels = {'city': '武汉', 'year': 2000, 'month': 1, 'satellite': 'L5'}
+    downloader.download_and_clean(downloader.get_folder_id('exports'), 'wuhanLandsat200001', str(tmp_path), labels)
+    spans = {record['stage']: record for record in records}
+    for stage in ['drive_list', 'drive_download']:
+        assert {key: spans[stage][key] for key in labels} == labels
@@ -0,0 +1,80 @@
+import pytest
+
+ee = pytest.importorskip('ee')
+import time
+import threading
+from types import SimpleNamespace
+import info_batcher
+
+class FakeList:
+    """
+    ee.List whose getInfo goes through ee.data.computeValue like the real one
+    """
+    def __init__(self, objects):
+        self.objects = objects
+
+    def getInfo(self):
+        return ee.data.computeValue(self)
+
+@pytest.fixture
+def sent_requests(monkeypatch):
+    """
+    the stubbed computeValue doubles every number and fails the whole list on a 'bad' object
+    """
+    sent = []
+    def compute_value(ee_list):
+        sent.append(list(ee_list.objects))
+        if 'bad' in ee_list.objects:
+            raise ee.EEException('Number.multiply: Parameter value is required')
+        return [value * 2 for value in ee_list.objects]
+    monkeypatch.setattr(ee.data, 'computeValue', compute_value)
+    monkeypatch.setattr(info_batcher, 'ee', SimpleNamespace(List=FakeList, data=ee.data))
+    return sent
+
+def test_concurrent_calls_share_one_request(sent_requests):
+    batcher = info_batcher.InfoBatcher(max_batch=32, window=0.2, max_workers=1)
+    results = {}
+    threads = [threading.Thread(target=lambda value=value: results.__setitem__(value, batcher.submit(value).result())) for value in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == {value: value * 2 for value in range(5)}
+    assert len(sent_requests) == 1
+
+def test_full_batch_is_sent_before_the_window(sent_requests):
+    batcher = info_batcher.InfoBatcher(max_batch=3, window=60, max_workers=1)
+    futures = [batcher.submit(value) for value in range(3)]
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4]
+    assert sent_requests == [[0, 1, 2]]
+
+def test_partial_batch_is_sent_after_the_window(sent_requests):
+    batcher = info_batcher.InfoBatcher(max_batch=32, window=0.1, max_workers=1)
+    started = time.monotonic()
+    assert batcher.submit(1).result(timeout=5) == 2
+    assert time.monotonic() - started >= 0.1
+
+def test_flush_sends_without_waiting(sent_requests):
+    batcher = info_batcher.InfoBatcher(max_batch=32, window=60, max_workers=1)
+    futures = [batcher.submit(value) for value in range(2)]
+    batcher.flush()
+    assert [future.result(timeout=5) for future in futures] == [0, 2]
+
+def test_failed_batch_is_evaluated_one_by_one(sent_requests):
+    batcher = info_batcher.InfoBatcher(max_batch=3, window=60, max_workers=1)
+    futures = [batcher.submit(value) for value in [1, 'bad', 3]]
+    assert futures[0].result(timeout=5) == 2
+    assert futures[2].result(timeout=5) == 6
+    with pytest.raises(ee.EEException):
+        futures[1].result(timeout=5)
+    assert sent_requests == [[1, 'bad', 3], [1], ['bad'], [3]]
+
+def test_limit_compute_value_wraps_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ee.data, 'computeValue', lambda ee_object: calls.append(ee_object) or 'value')
+    info_batcher.limit_compute_value()
+    limited = ee.data.computeValue
+    info_batcher.limit_compute_value()
+    assert ee.data.computeValue is limited
+    assert ee.data.computeValue('object') == 'value'
+    assert calls == ['object']
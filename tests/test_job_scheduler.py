@@ -0,0 +1,47 @@
+import time
+import threading
+from job_scheduler import run_jobs
+
+def test_cheapest_job_of_the_window_starts_first():
+    started = []
+    run_jobs([('a', 3), ('b', 1), ('c', 2), ('d', 1)], lambda job: started.append(job[0]), max_in_flight=1,
+             cost=lambda job: job[1], lookahead=4)
+    assert started == ['b', 'd', 'c', 'a']
+
+def test_jobs_are_pulled_lazily_into_the_window():
+    pulled = []
+    def jobs():
+        for job in range(6):
+            pulled.append(job)
+            yield job
+    started = []
+    def worker(job):
+        started.append((job, len(pulled)))
+    run_jobs(jobs(), worker, max_in_flight=1, lookahead=2)
+    assert [job for job, _ in started] == list(range(6))
+    assert all(pulled_count <= job + 2 for job, pulled_count in started)
+
+def test_in_flight_jobs_are_bounded():
+    lock = threading.Lock()
+    running, peak = [0], [0]
+    def worker(job):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return job * 2
+    results = {}
+    run_jobs(range(20), worker, max_in_flight=3, on_result=results.__setitem__)
+    assert peak[0] == 3
+    assert results == {job: job * 2 for job in range(20)}
+
+def test_failing_job_does_not_stop_the_others():
+    def worker(job):
+        if job == 2:
+            raise RuntimeError('export failed')
+        return job
+    results = []
+    run_jobs(range(5), worker, max_in_flight=2, on_result=lambda job, result: results.append((job, result)))
+    assert sorted(results) == [(0, 0), (1, 1), (2, None), (3, 3), (4, 4)]
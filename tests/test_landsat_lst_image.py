@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip('ee_lst')
+pytest.importorskip('folium')
+import monitor
+import landsat_lst_image
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+class EmptyDownloader:
+    def get_folder_id(self, folder_name):
+        return 'folder'
+
+    def download_and_clean(self, folder_id, cloud_file_name, save_path, labels=None):
+        return []
+
+def test_empty_download_never_completes_the_job(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setenv('JOB_LEDGER_FILE_PATH', str(tmp_path / 'ledger.sqlite'))
+    monitor.init_ledger()
+    monkeypatch.setattr(landsat_lst_image, 'DRIVE_SETTLE_SECONDS', 0)
+    monkeypatch.setattr(monitor, 'complete_job', lambda description: calls.append(('complete', description)))
+    monkeypatch.setattr(monitor, 'fail_job', lambda description, error: calls.append(('fail', description)))
+    gauth = SimpleNamespace(credentials=SimpleNamespace(refresh_token='token', token_expiry=datetime.now() + timedelta(days=1)))
+    landsat_lst_image.download_exported_file(gauth, EmptyDownloader(), 'exports', str(tmp_path), 'wuhanLandsat200001')
+    assert calls == [('fail', 'wuhanLandsat200001')]
+
+def test_failed_tile_is_rebuilt_from_the_ledger(monkeypatch, tmp_path):
+    monkeypatch.setenv('JOB_LEDGER_FILE_PATH', str(tmp_path / 'ledger.sqlite'))
+    monitor.init_ledger()
+    monkeypatch.setattr(landsat_lst_image, 'tile_exports', {}) # a restarted process knows none of the tiles
+    bounds = [114.0, 30.0, 114.1, 30.1]
+    monitor.register_tiles('wuhanLandsat200001', [(600, 2940, bounds)], {'folder': 'exports', 'satellite': 'L5', 'date': '2000-01-12'})
+    monitor.submit_tile('wuhanLandsat200001', 600, 2940, 'TASK1')
+    exports = []
+    monkeypatch.setattr(landsat_lst_image, 'scene_day_image', lambda satellite, date, geometry, cloud_threshold, use_ndvi: (satellite, date))
+    monkeypatch.setattr(landsat_lst_image.ee.Geometry, 'Rectangle', lambda *args: tuple(args[0]))
+    def start_export(image, description, folder_name, region, **grid):
+        exports.append((image, description, folder_name, region))
+        return SimpleNamespace(id='TASK2')
+    monkeypatch.setattr(landsat_lst_image, 'start_export', start_export)
+    assert landsat_lst_image.record_failed_export('wuhanLandsat200001_r600c2940') == 'TASK2'
+    assert exports == [(('L5', '2000-01-12'), 'wuhanLandsat200001_r600c2940', 'exports', tuple(bounds))]
+
+def test_failed_tile_without_ledger_params_fails_the_job(monkeypatch, tmp_path):
+    monkeypatch.setenv('JOB_LEDGER_FILE_PATH', str(tmp_path / 'ledger.sqlite'))
+    monitor.init_ledger()
+    monkeypatch.setattr(landsat_lst_image, 'tile_exports', {})
+    monitor.register_tiles('wuhanLandsat200001', [(600, 2940, None)])
+    failed = []
+    monkeypatch.setattr(monitor, 'fail_job', lambda description, error: failed.append(description))
+    assert landsat_lst_image.record_failed_export('wuhanLandsat200001_r600c2940') is None
+    assert failed == ['wuhanLandsat200001']
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('ee_lst')
+import landsat_lst_timeseries
+from types import SimpleNamespace
+
+class FakeCollection:
+    def __init__(self, source):
+        self.source = source
+
+    def aggregate_array(self, column):
+        return ('aggregate_array', column)
+
+    def filter(self, condition):
+        return ('filter', self.source, condition)
+
+@pytest.fixture
+def fake_ee(monkeypatch):
+    fake = SimpleNamespace(
+        FeatureCollection=FakeCollection,
+        Feature=lambda geometry, properties: (properties['site_id'], geometry),
+        Geometry=SimpleNamespace(Point=tuple),
+        Filter=SimpleNamespace(inList=lambda column, values: (column, values)),
+    )
+    monkeypatch.setattr(landsat_lst_timeseries, 'ee', fake)
+    return fake
+
+def test_csv_sites_are_chunked_on_the_client(fake_ee, tmp_path):
+    site_file = tmp_path / 'sites.csv'
+    site_file.write_text('site_id,lon,lat\n' + ''.join(f's{index},114.{index},30.{index}\n' for index in range(5)))
+    chunks = landsat_lst_timeseries.load_site_chunks(str(site_file), chunk_size=2)
+    assert [[site_id for site_id, _ in chunk.source] for chunk in chunks] == [['s0', 's1'], ['s2', 's3'], ['s4']]
+    assert chunks[0].source[1] == ('s1', (114.1, 30.1))
+
+def test_asset_sites_are_chunked_by_id(fake_ee, monkeypatch):
+    monkeypatch.setattr(landsat_lst_timeseries, 'evaluate', lambda ee_object: ['a', 'b', 'c'])
+    chunks = landsat_lst_timeseries.load_site_chunks('users/me/sites', chunk_size=2)
+    assert chunks == [('filter', 'users/me/sites', ('site_id', ['a', 'b'])), ('filter', 'users/me/sites', ('site_id', ['c']))]
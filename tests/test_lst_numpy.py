@@ -0,0 +1,56 @@
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+pytest.importorskip('dotenv')
+import json
+import numpy as np
+import lst_numpy
+
+SMW = [{'TPWpos': position, 'A': 1.0 + position / 100, 'B': -50.0 - position, 'C': 5.0 + position / 10} for position in range(10)]
+
+@pytest.fixture
+def coefficients(tmp_path):
+    file_path = tmp_path / 'coefficients.json'
+    file_path.write_text(json.dumps({'L8': {'em_veg': 0.99, 'smw': SMW[::-1]}})) # listed in any order
+    return lst_numpy.load_coefficients(str(file_path))
+
+def test_compute_fvc():
+    fvc = lst_numpy.compute_fvc(np.array([0.2, 0.53, 0.86, 0.95]))
+    assert np.allclose(fvc, [0, 0.25, 1, 1])
+
+def test_compute_tpw_position():
+    tpw = np.array([0, 3, 6, 6.1, 12, 53.9, 54, 54.1, 80])
+    assert lst_numpy.compute_tpw_position(tpw).tolist() == [0, 0, 0, 1, 1, 8, 8, 9, 9]
+
+def test_compute_emissivity_with_water_and_snow():
+    fvc = np.full(4, 0.5)
+    em_bare = np.full(4, 0.97)
+    qa = np.array([0, 1 << 7, 1 << 5, (1 << 7) | (1 << 5)], dtype=np.uint16)
+    assert np.allclose(lst_numpy.compute_emissivity(fvc, em_bare, 0.99), 0.98)
+    assert np.allclose(lst_numpy.compute_emissivity(fvc, em_bare, 0.99, qa), [0.98, lst_numpy.EM_WATER, lst_numpy.EM_SNOW, lst_numpy.EM_SNOW])
+
+def test_compute_lst(coefficients):
+    lst = lst_numpy.compute_lst(np.array([300.0, 280.0]), np.array([0.98, 0.95]), np.array([2, 9]), coefficients['L8'])
+    assert np.allclose(lst, [1.02 * 300 / 0.98 - 52 / 0.98 + 5.2, 1.09 * 280 / 0.95 - 59 / 0.95 + 5.9])
+
+def test_process_window_masks_missing_tpw(coefficients):
+    bands = {'B10': np.array([300.0, 300.0]), 'NDVI': np.array([0.53, 0.53]), 'EM_bare': np.array([0.97, 0.97]),
+             'TPW': np.array([10.0, np.nan]), 'QA_PIXEL': np.array([0.0, 0.0])}
+    lst = lst_numpy.process_window(bands.get, coefficients['L8'])
+    em = 0.25 * 0.99 + 0.75 * 0.97
+    assert np.isclose(lst[0], 1.01 * 300 / em - 51 / em + 5.1, rtol=1e-6)
+    assert np.isnan(lst[1])
+
+def test_missing_bands():
+    assert lst_numpy.missing_bands(['B10', 'NDVI', 'TPW', 'EM_bare', 'QA_PIXEL']) == []
+    assert lst_numpy.missing_bands(['B10', 'TPW', 'EM']) == []
+    assert lst_numpy.missing_bands(['LST', 'QA_PIXEL']) == ['B10', 'TPW', 'EM or EM_bare with NDVI']
+
+def test_lst_profile_export_is_refused(tmp_path, coefficients):
+    src_path = str(tmp_path / 'wuhanLandsat200001.tif')
+    with rasterio.open(src_path, 'w', driver='GTiff', width=4, height=4, count=2, dtype='float32',
+                       crs='EPSG:4326', transform=rasterio.Affine(0.00027, 0, 114, 0, -0.00027, 31)) as dst:
+        dst.write(np.zeros((2, 4, 4), dtype=np.float32))
+        dst.descriptions = ('LST', 'QA_PIXEL')
+    with pytest.raises(ValueError, match='recompute'):
+        lst_numpy.process_scene(src_path, str(tmp_path / 'lst.tif'), 'L8', coefficients)
@@ -0,0 +1,43 @@
+import monitor
+
+def init(monkeypatch, tmp_path):
+    monkeypatch.setenv('JOB_LEDGER_FILE_PATH', str(tmp_path / 'ledger.sqlite'))
+    monitor.init_ledger()
+
+def test_claimed_month_is_not_claimed_again(monkeypatch, tmp_path):
+    init(monkeypatch, tmp_path)
+    assert monitor.claim_job('武汉', 2000, 1) is True
+    assert monitor.claim_job('武汉', 2000, 1) is False
+    monitor.assign_job_satellite('武汉', 2000, 1, 'L5')
+    monitor.submit_job('武汉', 2000, 1, 'L5', 'TASK1', 'wuhanLandsat200001')
+    monitor.complete_job('wuhanLandsat200001')
+    assert monitor.claim_job('武汉', 2000, 1) is False
+    assert monitor.count_in_flight() == 0
+
+def test_claim_respects_in_flight_limit(monkeypatch, tmp_path):
+    init(monkeypatch, tmp_path)
+    assert monitor.claim_job('武汉', 2000, 1, max_in_flight=1) is True
+    assert monitor.claim_job('武汉', 2000, 2, max_in_flight=1) is None
+    monitor.record_search_result('武汉', 2000, 1, 'EMPTY', 'no scene')
+    assert monitor.count_in_flight() == 0
+    assert monitor.claim_job('武汉', 2000, 2, max_in_flight=1) is True
+
+def test_assign_merges_failed_satellite_row(monkeypatch, tmp_path):
+    init(monkeypatch, tmp_path)
+    monitor.claim_job('武汉', 2000, 1)
+    monitor.assign_job_satellite('武汉', 2000, 1, 'L5')
+    monitor.release_job('武汉', 2000, 1, 'L5', 'export failed')
+    monitor.claim_job('武汉', 2000, 1)
+    monitor.assign_job_satellite('武汉', 2000, 1, 'L5')
+    job_states = monitor.load_job_states()[('武汉', 2000, 1)]
+    assert job_states == [('L5', 'CLAIMED', 2, None)]
+
+def test_tile_export_params_survive_in_the_ledger(monkeypatch, tmp_path):
+    init(monkeypatch, tmp_path)
+    bounds = [114.0, 30.0, 114.1, 30.1]
+    monitor.register_tiles('wuhanLandsat200001', [(600, 2940, bounds), (600, 2941, None)])
+    assert monitor.load_tile_export('wuhanLandsat200001', 600, 2940) is None
+    monitor.register_tiles('wuhanLandsat200001', [(600, 2940, bounds)], {'folder': 'exports', 'satellite': 'L5', 'date': '2000-01-12'})
+    monitor.init_ledger()
+    assert monitor.load_tile_export('wuhanLandsat200001', 600, 2940) == \
+        {'folder': 'exports', 'satellite': 'L5', 'date': '2000-01-12', 'bounds': bounds}
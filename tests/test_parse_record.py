@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip('ee')
+pytest.importorskip('openpyxl')
+import pandas as pd
+import parse_record
+import record_writer
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+def write_records(record_file_path, rows):
+    with open(record_file_path, 'w', encoding='utf-8') as f:
+        f.write(','.join(record_writer.RECORD_HEADER) + '\n')
+        for row in rows:
+            f.write(','.join(map(str, row)) + '\n')
+
+def test_csv_and_index_keep_the_last_duplicate(monkeypatch, tmp_path):
+    record_file_path = str(tmp_path / 'record.csv')
+    write_records(record_file_path, [['武汉', 2000, 1, 1, 1, 5, 5, 3], ['武汉', 2000, 1, 1, 1, 2, 2, 19]])
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = '武汉'
+    sheet.append(parse_record.date_line(2000))
+    sheet['B1'].fill = PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid')
+    workbook.save(tmp_path / 'tags.xlsx')
+    monkeypatch.setattr(parse_record, 'get_geo_boundary', lambda: {'武汉': None})
+    monkeypatch.chdir(tmp_path)
+    parse_record.reverse_parse_record(str(tmp_path / 'tags.xlsx'), record_file_path, 2000, 2000)
+    output = pd.read_json(tmp_path / 'remote_sensing_record.json', lines=True)
+    assert output['day'].tolist() == [19]
+    assert record_writer.query_records(record_file_path, '武汉', 2000, 1)['day'].tolist() == [19]
@@ -0,0 +1,88 @@
+import threading
+import requests
+import rate_limit
+
+class Throttled(Exception):
+    def __init__(self):
+        super().__init__('Too many requests')
+
+def test_nested_call_reuses_the_held_slot():
+    endpoint = rate_limit.Endpoint('nested', 100.0, 1)
+    rate_limit.endpoints['nested'] = endpoint
+    try:
+        result = []
+        def run():
+            result.append(rate_limit.call('nested', rate_limit.call, 'nested', lambda: 'inner'))
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=5)
+        assert result == ['inner']
+        assert endpoint.in_flight == 0
+    finally:
+        rate_limit.endpoints.pop('nested', None)
+
+def test_throttled_errors_are_retried():
+    rate_limit.endpoints['retried'] = rate_limit.Endpoint('retried', 100.0, 2)
+    try:
+        attempts = []
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise Throttled()
+            return 'done'
+        assert rate_limit.call('retried', flaky, base_delay=0.001) == 'done'
+        assert len(attempts) == 3
+    finally:
+        rate_limit.endpoints.pop('retried', None)
+
+def test_is_throttled():
+    assert rate_limit.is_throttled(Throttled())
+    assert rate_limit.is_transient(TimeoutError('timed out'))
+    assert not rate_limit.is_throttled(TimeoutError('timed out'))
+
+class ComputationTimedOut(Exception): # how ee.EEException reports a computation over the time limit
+    def __init__(self):
+        super().__init__('Computation timed out.')
+
+class ServerError(Exception):
+    def __init__(self, status):
+        super().__init__(f'{status} error')
+        self.response = type('Response', (), {'status_code': status})()
+
+def test_only_transport_timeouts_are_transient():
+    assert rate_limit.is_transient(requests.Timeout('read timed out'))
+    assert rate_limit.is_transient(ServerError(504))
+    assert rate_limit.is_transient(ServerError(408))
+    assert not rate_limit.is_transient(ComputationTimedOut())
+
+def test_server_errors_do_not_cut_the_limits():
+    endpoint = rate_limit.Endpoint('server_error', 100.0, 4)
+    rate_limit.endpoints['server_error'] = endpoint
+    try:
+        attempts = []
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ServerError(503)
+            return 'done'
+        assert rate_limit.call('server_error', flaky, base_delay=0.001) == 'done'
+        assert endpoint.concurrency == 4
+    finally:
+        rate_limit.endpoints.pop('server_error', None)
+
+def test_computation_timeout_is_not_retried():
+    endpoint = rate_limit.Endpoint('computation', 100.0, 4)
+    rate_limit.endpoints['computation'] = endpoint
+    try:
+        attempts = []
+        def heavy():
+            attempts.append(1)
+            raise ComputationTimedOut()
+        try:
+            rate_limit.call('computation', heavy, base_delay=0.001)
+        except ComputationTimedOut:
+            pass
+        assert attempts == [1]
+        assert endpoint.concurrency == 4
+    finally:
+        rate_limit.endpoints.pop('computation', None)
@@ -0,0 +1,83 @@
+import os
+import time
+import sqlite3
+import record_writer
+
+def row(month, day=1):
+    return ['武汉', 2000, month, 1.0, 1.0, 5.0, 5.0, day]
+
+def read_lines(record_file_path):
+    with open(record_file_path, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+def test_batch_is_written_when_full(tmp_path):
+    record_file_path = str(tmp_path / 'record.csv')
+    writer = record_writer.RecordWriter(record_file_path, batch_size=2, flush_interval=60)
+    try:
+        writer.write(row(1))
+        time.sleep(0.2)
+        assert len(read_lines(record_file_path)) == 1 # header only
+        writer.write(row(2))
+        time.sleep(0.2)
+        assert len(read_lines(record_file_path)) == 3
+    finally:
+        writer.close()
+
+def test_partial_batch_is_written_by_age_while_rows_keep_arriving(tmp_path):
+    record_file_path = str(tmp_path / 'record.csv')
+    writer = record_writer.RecordWriter(record_file_path, batch_size=100, flush_interval=0.5)
+    try:
+        for month in range(1, 11): # a row every 0.15 s never leaves the queue idle for flush_interval
+            writer.write(row(month))
+            time.sleep(0.15)
+        assert len(read_lines(record_file_path)) > 1
+    finally:
+        writer.close()
+    assert len(read_lines(record_file_path)) == 11
+
+def test_index_keeps_the_last_duplicate(tmp_path):
+    record_file_path = str(tmp_path / 'record.csv')
+    writer = record_writer.RecordWriter(record_file_path)
+    writer.write(row(1, day=3))
+    writer.write(row(1, day=19))
+    writer.close()
+    assert record_writer.query_records(record_file_path, '武汉', 2000, 1)['day'].tolist() == [19]
+    assert record_writer.load_recorded_keys(record_file_path) == {('武汉', 2000, 1)}
+
+def test_failed_batch_does_not_stop_the_writer(tmp_path, monkeypatch):
+    record_file_path = str(tmp_path / 'record.csv')
+    writer = record_writer.RecordWriter(record_file_path)
+    write_batch = writer.write_batch
+    def fail_once(conn, batch, sync):
+        monkeypatch.setattr(writer, 'write_batch', write_batch)
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(writer, 'write_batch', fail_once)
+    writer.write(row(1))
+    writer.flush() # returns although the batch failed
+    writer.write(row(2))
+    writer.close()
+    assert record_writer.load_recorded_keys(record_file_path) == {('武汉', 2000, 2)}
+
+def test_new_csv_is_not_served_the_old_index(tmp_path):
+    record_file_path = str(tmp_path / 'record.csv')
+    writer = record_writer.RecordWriter(record_file_path)
+    writer.write(row(1))
+    writer.close()
+    os.remove(record_file_path)
+    writer = record_writer.RecordWriter(record_file_path)
+    writer.close()
+    assert record_writer.load_recorded_keys(record_file_path) == set()
+    assert record_writer.query_records(record_file_path).empty
+
+def test_index_follows_a_csv_replaced_behind_its_back(tmp_path):
+    record_file_path = str(tmp_path / 'record.csv')
+    writer = record_writer.RecordWriter(record_file_path)
+    writer.write(row(1))
+    writer.write(row(2))
+    writer.close()
+    with open(record_file_path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    with open(record_file_path + '.new', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines[:2]) + '\n')
+    os.replace(record_file_path + '.new', record_file_path)
+    assert record_writer.load_recorded_keys(record_file_path) == {('武汉', 2000, 1)}
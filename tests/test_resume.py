@@ -0,0 +1,7 @@
+import resume
+
+def test_only_assembled_images_count_as_downloaded(tmp_path):
+    for file_name in ['wuhanLandsat200001.tif', 'wuhanLandsat200002-0000000000-0000000000.tif',
+                      'wuhanLandsat200003.tif.part', 'wuhanLandsat200004_r120c539.tif', 'shanghaiLandsat200001.tif']:
+        (tmp_path / file_name).write_bytes(b'')
+    assert resume.load_downloaded_jobs(str(tmp_path), ['武汉']) == {('武汉', 2000, 1)}
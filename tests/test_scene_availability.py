@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip('ee')
+from scene_availability import candidate_satellites, parse_availability
+
+AVAILABILITY = parse_availability({
+    'L8': [{'month_key': '2014-07', 'count': 2, 'min': 12.5}, {'month_key': '2014-08', 'count': 1, 'min': 60.0}],
+    'L7': [{'month_key': '2014-07', 'count': 2, 'min': 3.0}, {'month_key': '2014-08', 'count': 1, 'min': 24.9}],
+    'L5': [{'month_key': '2014-08', 'count': 1, 'min': 25.0}],
+    'L4': [],
+})
+
+@pytest.mark.parametrize('year, month, cloud_threshold, satellite_list, expected', [
+    (2014, 7, 25, ['L8', 'L5', 'L7', 'L4'], ['L8', 'L7']), # in preference order, L5 and L4 have no scene
+    (2014, 7, 10, ['L8', 'L5', 'L7', 'L4'], ['L7']), # L8 only has cloudier scenes
+    (2014, 8, 25, ['L8', 'L5', 'L7', 'L4'], ['L7']), # a scene at the threshold is not under it
+    (2014, 8, 60.5, ['L7', 'L8'], ['L7', 'L8']), # the given order is kept
+    (2014, 9, 100, ['L8', 'L5', 'L7', 'L4'], []), # no scene in the month
+    (2014, 7, 25, ['L9'], []), # satellite not in the index
+])
+def test_candidate_satellites(year, month, cloud_threshold, satellite_list, expected):
+    assert candidate_satellites(AVAILABILITY, year, month, cloud_threshold, satellite_list) == expected
+
+def test_month_with_scenes_but_no_cloud_cover_is_pruned():
+    availability = {'L7': {'2003-06': [1, None]}}
+    assert candidate_satellites(availability, 2003, 6, 25) == []
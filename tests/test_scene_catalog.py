@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip('ee')
+import pandas as pd
+from scene_catalog import CATALOG_COLUMNS, select_best_scene
+
+def scene(satellite, day, cloud_cover, sr_cloud, urban_porpotion):
+    return {'satellite': satellite, 'date': f'2000-01-{day:02}', 'year': 2000, 'month': 1, 'day': day, 'scene_ids': '',
+            'cloud_cover': cloud_cover, 'toa_porpotion': 1.0, 'sr_porpotion': 1.0, 'urban_porpotion': urban_porpotion,
+            'toa_cloud': sr_cloud, 'sr_cloud': sr_cloud}
+
+def test_scene_barely_touching_the_city_never_wins():
+    catalog = pd.DataFrame([scene('L5', 3, 5, 0.0, 0.05), scene('L5', 19, 10, 4.0, 1.0)], columns=CATALOG_COLUMNS)
+    assert select_best_scene(catalog, 2000, 1, ['L5'], 25)['day'] == 19
+
+def test_satellite_preference_and_cloud_threshold():
+    catalog = pd.DataFrame([scene('L7', 3, 5, 1.0, 1.0), scene('L5', 19, 30, 0.0, 1.0), scene('L5', 11, 20, 8.0, 1.0)],
+                           columns=CATALOG_COLUMNS)
+    assert select_best_scene(catalog, 2000, 1, ['L5', 'L7'], 25)['day'] == 11
+    assert select_best_scene(catalog, 2000, 2, ['L5', 'L7'], 25) is None
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip('rasterio')
+pytest.importorskip('pypinyin')
+import scene_index
+from contextlib import closing
+
+SCENES = [ # description, city, year, month, date, satellite, sr cloud ratio, (west, east, south, north)
+    ('wuhanLandsat200007', '武汉', 2000, 7, '2000-07-12', 'L5', 5.0, (113.7, 115.1, 29.9, 31.4)),
+    ('wuhanLandsat200012', '武汉', 2000, 12, '2000-12-03', 'L7', 30.0, (113.7, 115.1, 29.9, 31.4)),
+    ('beijingLandsat200107', '北京', 2001, 7, '2001-07-20', 'L7', 2.0, (115.4, 117.5, 39.4, 41.1)),
+    ('beijingLandsat200108', '北京', 2001, 8, None, 'L5', None, (115.4, 117.5, 39.4, 41.1)),
+]
+
+@pytest.fixture(autouse=True)
+def index(monkeypatch, tmp_path):
+    monkeypatch.setenv('SCENE_INDEX_FILE_PATH', str(tmp_path / 'scenes.sqlite'))
+    with closing(scene_index.connect()) as conn, conn:
+        for description, city, year, month, date, satellite, cloud, bounds in SCENES:
+            cursor = conn.execute("""
+                INSERT INTO scenes (description, city, year, month, date, satellite, sr_cloud_ratio, file_path, file_size, file_mtime)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 0)
+            """, (description, city, year, month, date, satellite, cloud, f'{description}.tif'))
+            conn.execute('INSERT INTO scene_bounds VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, *bounds))
+
+def descriptions(scenes):
+    return scenes['description'].tolist()
+
+def test_query_scenes_filters():
+    assert len(scene_index.query_scenes()) == len(SCENES)
+    assert descriptions(scene_index.query_scenes(bbox=(114.2, 30.4, 114.5, 30.7))) == ['wuhanLandsat200007', 'wuhanLandsat200012']
+    assert descriptions(scene_index.query_scenes(bbox=(115.0, 31.0, 116.0, 40.0))) == \
+        ['wuhanLandsat200007', 'wuhanLandsat200012', 'beijingLandsat200107', 'beijingLandsat200108']
+    assert descriptions(scene_index.query_scenes(bbox=(100.0, 20.0, 101.0, 21.0))) == []
+    assert descriptions(scene_index.query_scenes(date_start='2000-07-12', date_end='2001-07-19')) == ['wuhanLandsat200007', 'wuhanLandsat200012']
+    assert descriptions(scene_index.query_scenes(months=[7, 8], satellites=['L7'])) == ['beijingLandsat200107']
+    assert descriptions(scene_index.query_scenes(max_cloud=10, city='武汉')) == ['wuhanLandsat200007']
+
+def test_query_scenes_needs_the_index(monkeypatch):
+    monkeypatch.delenv('SCENE_INDEX_FILE_PATH')
+    with pytest.raises(ValueError):
+        scene_index.query_scenes()
@@ -0,0 +1,69 @@
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('prometheus_client')
+import threading
+import series_cache
+
+PARAMS = series_cache.series_params(30.35, 114.35, 30, '2000-01-01', '2001-01-01', 20, True)
+
+@pytest.fixture(autouse=True)
+def cache_path(monkeypatch, tmp_path):
+    monkeypatch.setenv('SERIES_CACHE_PATH', str(tmp_path))
+    return tmp_path
+
+def write_series(file_path, rows):
+    pd.DataFrame(rows, columns=['satellite', 'year', 'month', 'day', 'lst']).to_csv(file_path, index=False)
+
+def test_wait_for_cached_series(tmp_path):
+    key = series_cache.series_key(PARAMS)
+    assert series_cache.wait_for_cached_series(key, timeout=0, gap=0) is None
+    write_series(tmp_path / 'download.csv', [['L5', 2000, 1, 12, 290.5]])
+    series_cache.store_series(key, PARAMS, str(tmp_path / 'download.csv'))
+    assert series_cache.wait_for_cached_series(key, timeout=0, gap=0)['lst'].tolist() == [290.5]
+
+def test_identical_requests_share_one_export(tmp_path):
+    key = series_cache.series_key(PARAMS)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    def produce():
+        calls.append(key)
+        started.set()
+        release.wait(5)
+        write_series(tmp_path / 'download.csv', [['L5', 2000, 1, 12, 290.5]])
+        return series_cache.store_series(key, PARAMS, str(tmp_path / 'download.csv'))
+    results = []
+    owner = threading.Thread(target=lambda: results.append(series_cache.collapse(key, produce)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(series_cache.collapse(key, produce)))
+    waiter.start()
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert calls == [key]
+    assert [len(series) for series in results] == [1, 1]
+
+def test_empty_export_is_a_cached_empty_series(tmp_path):
+    key = series_cache.series_key(PARAMS)
+    (tmp_path / 'download.csv').write_text('')
+    series = series_cache.store_series(key, PARAMS, str(tmp_path / 'download.csv'))
+    assert series.empty
+    assert series_cache.load_cached_series(key) is not None
+
+def series_frame(rows):
+    return pd.DataFrame(rows, columns=['satellite', 'year', 'month', 'day', 'lst'])
+
+def test_last_acquisition_date():
+    assert series_cache.last_acquisition_date(None) is None
+    assert series_cache.last_acquisition_date(series_frame([])) is None
+    series = series_frame([['L7', 2003, 11, 5, 288.0], ['L5', 2003, 12, 1, 285.0], ['L5', 2003, 2, 20, 280.0]])
+    assert series_cache.last_acquisition_date(series) == '2003-12-01'
+
+def test_merge_series_replaces_scenes_asked_again():
+    series = series_frame([['L5', 2003, 12, 1, 285.0], ['L7', 2003, 11, 5, 288.0]])
+    new_series = series_frame([['L7', 2003, 12, 1, 286.0], ['L5', 2003, 12, 1, 285.5], ['L7', 2004, 1, 2, 281.0]])
+    merged = series_cache.merge_series(series, new_series)
+    assert merged[['satellite', 'year', 'month', 'day', 'lst']].values.tolist() == [
+        ['L7', 2003, 11, 5, 288.0], ['L5', 2003, 12, 1, 285.5], ['L7', 2003, 12, 1, 286.0], ['L7', 2004, 1, 2, 281.0]]
+    assert series_cache.merge_series(None, new_series).equals(series_cache.merge_series(new_series, series_frame([])))
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('ee')
+import rate_limit
+import task_poller
+
+@pytest.fixture(autouse=True)
+def fast_task_start(monkeypatch):
+    monkeypatch.setitem(rate_limit.endpoints, 'task_start', rate_limit.Endpoint('task_start', 1000.0, 2))
+
+def test_missing_task_fails_after_max_missing_polls(monkeypatch):
+    monkeypatch.setattr(task_poller, 'fetch_tasks', lambda: {})
+    failed = []
+    poller = task_poller.TaskPoller(lambda identifier: None, failed.append, max_missing_polls=3)
+    poller.thread = object() # poll by hand instead of from the background thread
+    poller.submit('TASK1', 'wuhanLandsat200001')
+    for _ in range(2):
+        poller._poll()
+    assert poller.pending_count() == 1
+    poller._poll()
+    poller.join()
+    assert failed == ['wuhanLandsat200001']
+    assert poller.pending_count() == 0
+
+def test_listed_task_is_dispatched(monkeypatch):
+    monkeypatch.setattr(task_poller, 'fetch_tasks', lambda: {'TASK1': {'id': 'TASK1', 'state': 'COMPLETED'}})
+    completed = []
+    poller = task_poller.TaskPoller(completed.append)
+    poller.thread = object()
+    poller.submit('TASK1', 'wuhanLandsat200001')
+    poller._poll()
+    poller.join()
+    assert completed == ['wuhanLandsat200001']
+
+class TimedOutTask:
+    def __init__(self, started):
+        self.id = None
+        self.started = started
+
+    def start(self):
+        self.started.append(1)
+        raise TimeoutError('timed out')
+
+def test_timed_out_start_is_not_repeated_when_the_task_exists(monkeypatch):
+    monkeypatch.setattr(task_poller, 'fetch_tasks', lambda: {'TASK1': {
+        'id': 'TASK1', 'description': 'wuhanLandsat200001', 'state': 'READY', 'creation_timestamp_ms': 2e12}})
+    started = []
+    task = task_poller.start_task(TimedOutTask(started), 'wuhanLandsat200001', base_delay=0.001)
+    assert started == [1]
+    assert task.id == 'TASK1'
+
+def test_started_task_is_found_although_it_has_a_request_id(monkeypatch):
+    monkeypatch.setattr(task_poller, 'fetch_tasks', lambda: {'P7QMX2': {
+        'id': 'P7QMX2', 'description': 'wuhanLandsat200001', 'state': 'RUNNING', 'creation_timestamp_ms': 2e12}})
+    started = []
+    timed_out_task = TimedOutTask(started)
+    timed_out_task._request_id = '5b0c7f3e-0a4e-4c1d-9d7a-2f1f6c1e8d11' # uuid made on the client by ee.data.newTaskId
+    task = task_poller.start_task(timed_out_task, 'wuhanLandsat200001', base_delay=0.001)
+    assert started == [1]
+    assert task.id == 'P7QMX2'
+
+def test_timed_out_start_is_retried_when_no_task_exists(monkeypatch):
+    monkeypatch.setattr(task_poller, 'fetch_tasks', lambda: {})
+    started = []
+    try:
+        task_poller.start_task(TimedOutTask(started), 'wuhanLandsat200001', retries=2, base_delay=0.001)
+    except TimeoutError:
+        pass
+    assert started == [1, 1, 1]
@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip('ee_lst') # zonal_stats reads the boundaries through boundary_cache and landsat_lst_image
+pytest.importorskip('folium')
+pytest.importorskip('rasterio')
+import numpy as np
+import rasterio
+import zonal_stats
+from rasterio.transform import from_origin
+
+def boundary(city_name):
+    return {'city_name': city_name, 'city_code': 1}
+
+def test_only_assembled_images_are_listed(tmp_path):
+    for file_name in ['wuhanLandsat200001.tif', 'wuhanLandsat200002-0000000000-0000000000.tif', 'shanghaiLandsat200001.tif']:
+        (tmp_path / file_name).write_bytes(b'')
+    raster_list = zonal_stats.list_lst_rasters(str(tmp_path), [boundary('武汉')])
+    assert [(year, month) for _, _, year, month in raster_list] == [(2000, 1)]
+
+def test_histogram_percentiles():
+    histogram, _ = np.histogram(np.arange(280, 320, 0.01), bins=zonal_stats.HISTOGRAM_BINS, range=zonal_stats.HISTOGRAM_RANGE)
+    p10, p50, p90 = zonal_stats.histogram_percentiles(histogram, [10, 50, 90])
+    bin_width = (zonal_stats.HISTOGRAM_RANGE[1] - zonal_stats.HISTOGRAM_RANGE[0]) / zonal_stats.HISTOGRAM_BINS
+    assert abs(p10 - 284) <= bin_width
+    assert abs(p50 - 300) <= bin_width
+    assert abs(p90 - 316) <= bin_width
+    assert all(np.isnan(zonal_stats.histogram_percentiles(np.zeros(zonal_stats.HISTOGRAM_BINS), [50])))
+
+def test_mean_ignores_values_outside_the_histogram(tmp_path):
+    lst = np.full((64, 64), 300.0, dtype=np.float32)
+    lst[:, :32] = 310.0
+    lst[0, 40] = 1000.0 # out of the histogram range, must not skew the rural mean
+    profile = {'driver': 'GTiff', 'height': 64, 'width': 64, 'count': 1, 'dtype': 'float32', 'crs': 'EPSG:4326',
+               'transform': from_origin(114, 31, 0.01, 0.01)}
+    file_path = str(tmp_path / 'wuhanLandsat200001.tif')
+    with rasterio.open(file_path, 'w', **profile) as dst:
+        dst.write(lst, 1)
+        dst.set_band_description(1, 'LST')
+    city = {'type': 'Polygon', 'coordinates': [[[114, 31], [114.64, 31], [114.64, 30.36], [114, 30.36], [114, 31]]]}
+    urban = {'type': 'Polygon', 'coordinates': [[[114, 31], [114.32, 31], [114.32, 30.36], [114, 30.36], [114, 31]]]}
+    city_boundary = {'city_name': '武汉', 'city_code': 1, 'city_geometry': city, 'urban_geometry': urban}
+    row = zonal_stats.zonal_stats({}, file_path, city_boundary, 2000, 1)
+    assert row['urban_count'] == 64 * 32
+    assert row['rural_count'] == 64 * 32 - 1
+    assert row['rural_mean'] == pytest.approx(300.0)
+    assert row['suhi_mean'] == pytest.approx(10.0)
@@ -1,13 +1,24 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
-from landsat_lst_image import export_lst_image, filter_city_bound, create_lst_image
+from landsat_lst_image import export_lst_image, create_lst_image, download_exported_file, record_failed_export, CLOUD_THRESHOLD
+from task_poller import TaskPoller
+from fetch_drive import DriveDownloader
+from boundary_cache import load_city_boundaries
+from resume import load_finished_jobs, plan_months
+from job_scheduler import run_jobs
+from scene_availability import load_availability, candidate_satellites
+from scene_catalog import load_catalog
+from export_grid import grid_tiles, tile_pixels
 from dotenv import load_dotenv
-from parseRecord import parse_record
+from parse_record import parse_record
+from functools import partial
+from info_batcher import limit_compute_value
+import monitor
+import record_writer
+import telemetry
 import os
 import ee
 import logging
-import csv
 
 logging.basicConfig(
     filename='workflow_image.log',
@@ -19,20 +30,69 @@ logger = logging.getLogger(__name__)
 logging.getLogger('ee').setLevel(logging.WARNING)
 
 def init_record_file():
-    record_file_path = os.getenv('RECORD_FILE_PATH') # csv
-    monitor_file_path = os.getenv('PROCESS_MONITOR_FILE_PATH')
-    header = ['city', 'year', 'month', 'toa_image_porpotion', 'sr_image_porpotion', 'toa_cloud_ratio', 'sr_cloud_ratio', 'day']
-    with open(monitor_file_path, 'w', newline='') as f:
-        pass
-    if (not os.path.exists(record_file_path)):
-        with open(record_file_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
+    monitor.init_ledger()
+    record_writer.get_writer() # writes the header of a new record file
 
-def create_lst_image_timeseries(folder_name,save_path,to_drive = True):
+def iterate_jobs(city_boundaries, year_list, finished_jobs, availabilities, use_catalog=False):
+    """
+    yield the (city, year, month) jobs still to do across all cities and years, with the satellites worth searching
+
+    with use_catalog the scenes are chosen from the local scene catalog of the city
+    """
+    for index, city_boundary in enumerate(city_boundaries, start=1):
+        print(f'Processing city id: {index}')
+        city_name = city_boundary['city_name']
+        city_geometry = ee.Geometry(city_boundary['city_geometry'])
+        logging.info(f"{city_name}'s administrative city area: {city_boundary['area']}")
+        urban_geometry = ee.Geometry(city_boundary['urban_geometry'])
+        check_city_name = city_boundary['urban_city_name']
+        if (city_name != check_city_name):
+            logging.warning(f"City name mismatch: {city_name}, {check_city_name}")
+            continue
+        availability = availabilities[city_boundary['city_code']]
+        catalog = None
+        if (use_catalog):
+            try:
+                catalog = load_catalog(city_boundary['city_code'], city_geometry, urban_geometry)
+            except Exception as e: # one city's catalog must not stop the jobs of every city
+                logging.error(f"{city_name} scene catalog failed to build({e}), search the scenes on the server")
+        tiles = None
+        if (tile_pixels() is not None):
+            tiles = grid_tiles(city_boundary['city_geometry'], tile_pixels())
+            logging.info(f"{city_name} is exported as {len(tiles)} grid tiles")
+        for year in year_list:
+            for month in plan_months(city_name, year, finished_jobs):
+                yield {
+                    'city_name': city_name, 'year': year, 'month': month,
+                    'city_geometry': city_geometry, 'urban_geometry': urban_geometry,
+                    'satellites': candidate_satellites(availability, year, month, CLOUD_THRESHOLD),
+                    'catalog': catalog,
+                    'tiles': tiles
+                }
+
+def expected_job_cost(job):
+    """
+    number of scene searches in the worst case, jobs without any candidate satellite cost nothing
+    """
+    return len(job['satellites'])
+
+def run_export_job(poller, folder_name, to_drive, job):
+    return export_lst_image(poller, job['city_name'], job['year'], job['month'],
+                            job['city_geometry'], job['urban_geometry'], folder_name, to_drive, job['satellites'], job['catalog'], job['tiles'])
+
+def run_create_job(folder_name, to_drive, job):
+    return create_lst_image(job['city_name'], job['year'], job['month'],
+                            job['city_geometry'], job['urban_geometry'], folder_name, to_drive, job['satellites'], job['catalog'])
+
+def log_job_result(job, result):
+    if result is None:
+        logging.info(f"{job['city_name']} {job['year']}-{job['month']:02} not exported")
+    else:
+        logging.info(f"{job['city_name']} {job['year']}-{job['month']:02} exported")
+
+def create_lst_image_timeseries(folder_name,save_path,to_drive = True, resume = True, retry_empty = False):
     asset_path = 'projects/ee-channingtong/assets/'
-    total_boundary = ee.FeatureCollection(asset_path + 'YZBboundary')
-    #total_geometry = total_boundary.union().geometry()
+    max_workers = int(os.getenv('MAX_WORKERS', 12)) # jobs in flight, the request concurrency is bounded by the rate limiter
     if (to_drive):
         gauth = GoogleAuth()
         gauth.LoadCredentialsFile(os.getenv('CREDENTIALS_FILE_PATH'))
@@ -48,48 +108,25 @@ def create_lst_image_timeseries(folder_name,save_path,to_drive = True):
         if gauth.credentials.refresh_token is None:
             print('refresh token is None')
             return
-    index = 0
-    for city_boundary in total_boundary.getInfo()['features']:
-        index += 1
-        print(f'Processing city id: {index}')
-        city_name = city_boundary['properties']['市名']
-        city_code = city_boundary['properties']['市代码']
-        city_geometry = ee.Geometry(city_boundary['geometry'])
-        logging.info(f"{city_name}'s administrative city area: {city_geometry.area().getInfo()}")
-        asset_name = f'urban_{city_code}'
-        urban_boundary = ee.FeatureCollection(asset_path + asset_name)
-        urban_geometry = filter_city_bound(urban_boundary.geometry())
-        check_city_name = urban_boundary.getInfo()['features'][0]['properties']['city_name']
-        if (city_name != check_city_name):
-            logging.warning(f"City name mismatch: {city_name}, {check_city_name}")
-            continue
-        year_list = range(1985,2025)
-        for year in year_list:
-            month_list = range(1,13)
-            if (to_drive):
-                with ThreadPoolExecutor(max_workers=5) as executor:
-                    task_states = [executor.submit(
-                        export_lst_image, 
-                        gauth = gauth,
-                        city_name = city_name, 
-                        year = year,month = month,
-                        city_geometry = city_geometry, urban_geometry = urban_geometry, 
-                        folder_name = folder_name, to_drive = to_drive,
-                        drive = drive, save_path = save_path
-                    ) for month in month_list]
-                    exported_months = [month for month in as_completed(task_states) if month is not None]
-                    logging.info(f"{city_name} {year} exported months: {exported_months}")
-            else:
-                with ThreadPoolExecutor(max_workers=9) as executor:
-
-                    finish_states = [executor.submit(
-                        create_lst_image, city_name = city_name, 
-                        year = year,month = month,
-                        city_geometry = city_geometry, urban_geometry = urban_geometry, 
-                        folder_name = folder_name, to_drive = to_drive
-                    ) for month in month_list]
-                    exported_months = [month for month in as_completed(finish_states) if month is not None]
-                    logging.info(f"{city_name} {year} exported months: {exported_months}")
+        poller = TaskPoller(partial(download_exported_file, gauth, DriveDownloader(drive), folder_name, save_path), record_failed_export).start()
+        for task_id, file_name in monitor.list_submitted_jobs().items(): # resume the exports of the last run
+            poller.submit(task_id, file_name)
+    city_boundaries = load_city_boundaries(asset_path)
+    finished_jobs = set()
+    if (resume):
+        city_names = [city_boundary['city_name'] for city_boundary in city_boundaries]
+        finished_jobs = load_finished_jobs(os.getenv('RECORD_FILE_PATH'), save_path, city_names, to_drive, retry_empty)
+    availabilities = load_availability(city_boundaries)
+    use_catalog = os.getenv('SCENE_CATALOG_PATH') is not None
+    jobs = iterate_jobs(city_boundaries, range(1985,2025), finished_jobs, availabilities, use_catalog)
+    if (to_drive):
+        worker = partial(run_export_job, poller, folder_name, to_drive)
+    else:
+        worker = partial(run_create_job, folder_name, to_drive)
+    run_jobs(jobs, worker, max_workers, cost=expected_job_cost, on_result=log_job_result)
+    if (to_drive):
+        poller.join()
+    record_writer.close_writer()
     print("All done. >_<")
 
 def __main__():
@@ -97,11 +134,14 @@ def __main__():
     SAVE_PATH = os.getenv('IMAGE_SAVE_PATH')
     project_name = os.getenv('PROJECT_NAME')
     ee.Initialize(project=project_name)
+    limit_compute_value()
+    telemetry.start_metrics_server()
 
     folder_name = 'landsat_lst_timeseries'
     init_record_file()
 
-    create_lst_image_timeseries(folder_name,SAVE_PATH,False)
+    resume = os.getenv('RESUME', 'true').lower() == 'true'
+    create_lst_image_timeseries(folder_name,SAVE_PATH,False,resume)
     parse_record(os.getenv('RECORD_FILE_PATH'))
     
 if __name__ == '__main__':
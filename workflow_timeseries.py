@@ -1,14 +1,13 @@
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
-from landsat_lst_timeseries import create_series
-from fetch_drive import download_and_clean, check_task_status
+from landsat_lst_timeseries import fetch_series, update_series, create_batch_series, wait_for_task, SERIES_FOLDER
+from fetch_drive import DriveDownloader
 from dotenv import load_dotenv
 import os
 import ee
 
 def __main__():
     load_dotenv()
-    SAVE_PATH = os.getenv('SERIES_SAVE_PATH')
     FOLDER_ID = os.getenv('SERIES_FOLDER_ID')
 
     gauth = GoogleAuth()
@@ -18,10 +17,20 @@ def __main__():
     ee.Initialize(project='ee-channingtong')
     lat = 114.35
     lon = 30.35
-    task = create_series(lat,lon)
-    is_success = check_task_status(task, gap = 10)
-    if is_success:
-        download_and_clean(drive,FOLDER_ID, SAVE_PATH)
+    downloader = DriveDownloader(drive)
+    site_source = os.getenv('SERIES_SITES')
+    if site_source is not None: # many sites exported together, one table per satellite and chunk of sites
+        save_path = os.getenv('SERIES_SAVE_PATH')
+        tasks = create_batch_series(site_source, os.getenv('SERIES_BATCH_NAME', 'sites'), int(os.getenv('SERIES_CHUNK_SIZE', 500)))
+        for task, export_name in tasks:
+            if wait_for_task(task.id, export_name):
+                downloader.download_and_clean(FOLDER_ID or downloader.get_folder_id(SERIES_FOLDER), export_name, save_path)
+        return
+    if os.getenv('SERIES_UPDATE', 'false').lower() == 'true':
+        series = update_series(downloader, lat, lon, folder_id=FOLDER_ID)
+    else:
+        series = fetch_series(downloader, lat, lon, folder_id=FOLDER_ID)
+    print(f"{len(series)} observations for ({lat}, {lon})")
 
 if __name__ == '__main__':
-    __main__()
\ No newline at end of file
+    __main__()
@@ -0,0 +1,125 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.features import geometry_mask
+from dotenv import load_dotenv
+from pypinyin import lazy_pinyin as pinyin
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from boundary_cache import load_cached_city_boundaries
+from resume import DOWNLOAD_FILE_PATTERN
+from export_profile import read_decoded
+
+# lst histogram in kelvin, percentiles are read from the histogram so a scene is scanned once block by block
+HISTOGRAM_RANGE = (200.0, 360.0)
+HISTOGRAM_BINS = 1600
+PERCENTILES = [10, 25, 50, 75, 90]
+ZONES = ['urban', 'rural']
+
+def list_lst_rasters(save_path, city_boundaries):
+    """
+    return (file path, city boundary, year, month) of the downloaded single file exports
+    """
+    boundaries = {''.join(pinyin(city_boundary['city_name'])): city_boundary for city_boundary in city_boundaries}
+    raster_list = []
+    for file_name in sorted(os.listdir(save_path)):
+        matched = DOWNLOAD_FILE_PATTERN.match(file_name)
+        if matched is None: # shards and tiles are mosaicked first
+            continue
+        city_boundary = boundaries.get(matched.group('city'))
+        if city_boundary is None:
+            continue
+        raster_list.append((os.path.join(save_path, file_name), city_boundary, int(matched.group('year')), int(matched.group('month'))))
+    return raster_list
+
+def get_zone_masks(zone_masks, city_boundary, transform, shape):
+    """
+    rasterize the urban and rural zones once per city grid, the rural zone is the city outside the urban area
+    """
+    key = (tuple(transform), shape)
+    if key not in zone_masks:
+        city = ~geometry_mask([city_boundary['city_geometry']], shape, transform)
+        urban = ~geometry_mask([city_boundary['urban_geometry']], shape, transform)
+        zone_masks[key] = {'urban': urban & city, 'rural': city & ~urban}
+    return zone_masks[key]
+
+def histogram_percentiles(histogram, percentiles):
+    edges = np.linspace(*HISTOGRAM_RANGE, HISTOGRAM_BINS + 1)
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] == 0:
+        return [np.nan] * len(percentiles)
+    positions = np.searchsorted(cumulative, np.array(percentiles) / 100 * cumulative[-1])
+    return list((edges[positions] + edges[positions + 1]) / 2)
+
+def zonal_stats(zone_masks, file_path, city_boundary, year, month):
+    """
+    mean, percentiles and valid pixel number of the urban and rural lst, and the surface urban heat island intensity
+    """
+    with rasterio.open(file_path) as src:
+        band = src.descriptions.index('LST') + 1 if 'LST' in src.descriptions else 1
+        masks = get_zone_masks(zone_masks, city_boundary, src.transform, src.shape)
+        sums = dict.fromkeys(ZONES, 0.0)
+        histograms = {zone: np.zeros(HISTOGRAM_BINS, dtype=np.int64) for zone in ZONES}
+        for _, window in src.block_windows(band):
+            lst = read_decoded(src, band, window).astype(np.float64)
+            valid = np.isfinite(lst)
+            rows, cols = window.toslices()
+            for zone in ZONES:
+                values = lst[valid & masks[zone][rows, cols]]
+                # the mean is taken over the pixels the histogram counts, out of range values are dropped from both
+                values = values[(values >= HISTOGRAM_RANGE[0]) & (values <= HISTOGRAM_RANGE[1])]
+                sums[zone] += values.sum()
+                histograms[zone] += np.histogram(values, bins=HISTOGRAM_BINS, range=HISTOGRAM_RANGE)[0]
+    row = {'city_name': city_boundary['city_name'], 'city_code': city_boundary['city_code'], 'year': year, 'month': month}
+    for zone in ZONES:
+        count = int(histograms[zone].sum())
+        row[f'{zone}_count'] = count
+        row[f'{zone}_mean'] = sums[zone] / count if count else np.nan
+        for percentile, value in zip(PERCENTILES, histogram_percentiles(histograms[zone], PERCENTILES)):
+            row[f'{zone}_p{percentile}'] = value
+    row['suhi_mean'] = row['urban_mean'] - row['rural_mean']
+    row['suhi_median'] = row['urban_p50'] - row['rural_p50']
+    return row
+
+def city_zonal_stats(city_raster_list):
+    """
+    the rasters of one city share the masks of their grid
+    """
+    zone_masks = {}
+    rows = []
+    for raster in city_raster_list:
+        try:
+            rows.append(zonal_stats(zone_masks, *raster))
+        except Exception as e:
+            logging.error(f"{raster[0]} failed to compute zonal statistics: {e}")
+    return rows
+
+def compute_zonal_stats(raster_list, max_workers=None):
+    """
+    compute the zonal statistics of every raster on a process pool, one row per city and month
+    """
+    city_raster_lists = {}
+    for raster in raster_list:
+        city_raster_lists.setdefault(raster[1]['city_code'], []).append(raster)
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(city_zonal_stats, city_raster_list): city_code for city_code, city_raster_list in city_raster_lists.items()}
+        for future in as_completed(futures):
+            try:
+                rows.extend(future.result())
+            except Exception as e:
+                logging.error(f"city {futures[future]} failed to compute zonal statistics: {e}")
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows).sort_values(by=['city_code', 'year', 'month']).reset_index(drop=True)
+
+def __main__():
+    load_dotenv()
+    raster_list = list_lst_rasters(os.getenv('IMAGE_SAVE_PATH'), load_cached_city_boundaries())
+    logging.info(f"compute zonal statistics of {len(raster_list)} rasters")
+    stats = compute_zonal_stats(raster_list)
+    stats.to_parquet(os.getenv('ZONAL_STATS_FILE_PATH'), index=False)
+
+if __name__ == '__main__':
+    __main__()